@@ -0,0 +1,196 @@
+# admission.py
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+from metrics import Counter, Gauge, Histogram
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests turned away before any work: reason=rate_limited (429), queue_full or queue_timeout (503).",
+    ("endpoint_class", "reason"),
+)
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Admitted requests currently running.", ("endpoint_class",))
+ADMISSION_QUEUED = Gauge("admission_queued", "Requests waiting for an in-flight slot.", ("endpoint_class",))
+ADMISSION_WAIT_SECONDS = Histogram(
+    "admission_wait_seconds", "Time admitted requests waited for an in-flight slot.", ("endpoint_class",)
+)
+
+class TokenBuckets:
+    """
+    Token bucket per client key, refilled lazily on each take. Only the
+    most recently seen max_clients keys are kept.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # key -> (tokens, last refill)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def clear(self):
+        self._buckets.clear()
+
+    def take(self, key: str) -> float:
+        """
+        Take one token: 0.0 on success, else seconds until one is available.
+        """
+        if self.rate <= 0 or self.burst <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+
+        wait = 0.0
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            wait = (1.0 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class EndpointClass:
+    """
+    Limits for one kind of work (OCR, PDF, LLM): a token bucket per client
+    (rate per second, burst) and a bound on requests running at once, with
+    at most max_queue more waiting up to max_wait seconds for a slot.
+    A rate, burst or max_in_flight of 0 turns that limit off.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        max_in_flight: int,
+        max_queue: int,
+        max_wait: float,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.buckets = TokenBuckets(rate, burst)
+        self.in_flight = 0
+        self._waiters: deque = deque()
+
+    # IN-FLIGHT SLOTS
+    async def acquire(self) -> Optional[str]:
+        """
+        Take an in-flight slot, waiting in FIFO order if needed. Returns the
+        rejection reason instead when the queue is full or the wait too long.
+        """
+        if self.max_in_flight <= 0 or (self.in_flight < self.max_in_flight and not self._waiters):
+            self._take()
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUED.inc(endpoint_class=self.name)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                return "queue_timeout"
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot was handed over as we went away
+            raise
+        finally:
+            ADMISSION_QUEUED.dec(endpoint_class=self.name)
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, endpoint_class=self.name)
+        return None
+
+    def _take(self):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight, endpoint_class=self.name)
+
+    def release(self):
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight, endpoint_class=self.name)
+        # hand the slot to the oldest waiter still there
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if waiter.done() or waiter.get_loop().is_closed():
+                continue
+            self._take()
+            waiter.set_result(None)
+            return
+
+    def retry_after(self) -> int:
+        """
+        Rough Retry-After for a shed request: the configured wait, at least 1s.
+        """
+        return max(1, math.ceil(self.max_wait))
+
+
+def client_key(scope) -> str:
+    """
+    Who a request is accounted to: the client address. API keys sent with
+    the request are not verified here and are the caller's free choice, so
+    keying on them would let one client take a fresh bucket per request
+    (or spend another client's); every key from one address shares its
+    bucket. Behind a proxy, run uvicorn with --proxy-headers so the
+    address is the real client's.
+    """
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """
+    Admission control for the expensive routes, before any of their work
+    starts: a request over its client's rate for the endpoint class gets
+    429, one that finds the class's in-flight slots and wait queue full
+    (or waits too long) gets 503, both with Retry-After. The slot is held
+    until the response has been sent, streamed responses included.
+    """
+
+    def __init__(self, app, routes: Dict[str, EndpointClass]):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        cls = self.routes.get(scope.get("path")) if scope["type"] == "http" else None
+        if cls is None:
+            await self.app(scope, receive, send)
+            return
+
+        wait = cls.buckets.take(client_key(scope))
+        if wait > 0:
+            ADMISSION_REJECTED.inc(endpoint_class=cls.name, reason="rate_limited")
+            await _reject(scope, receive, send, 429, f"Rate limit exceeded for {cls.name} requests.", math.ceil(wait))
+            return
+
+        reason = await cls.acquire()
+        if reason is not None:
+            ADMISSION_REJECTED.inc(endpoint_class=cls.name, reason=reason)
+            await _reject(scope, receive, send, 503, f"Server is busy with {cls.name} requests, try again later.", cls.retry_after())
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            cls.release()
+
+
+async def _reject(scope, receive, send, status: int, detail: str, retry_after: int):
+    response = JSONResponse({"detail": detail}, status_code=status, headers={"Retry-After": str(retry_after)})
+    await response(scope, receive, send)
+
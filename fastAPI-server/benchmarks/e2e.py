@@ -0,0 +1,319 @@
+# benchmarks/e2e.py
+"""
+End-to-end benchmark of the API: every endpoint driven at the given
+concurrency levels against the ASGI app in-process, with synthetic PDFs
+and images and the mock LLM provider (mock_llm), so it runs fully offline.
+
+Reports throughput, p50/p95/p99 latency and errors per scenario plus the
+peak RSS, and writes them (with the git commit) as JSON. --compare prints
+the change against an earlier result file. Without easyocr installed (or
+with --fake-ocr) OCR is replaced by a reader that takes --ocr-ms-per-mp
+per megapixel. Admission limits are off unless --admission is given;
+every request sends a different document / topic unless --warm-cache.
+
+    cd fastAPI-server
+    python benchmarks/e2e.py --concurrency 1 8 --requests 40 --output before.json
+    python benchmarks/e2e.py --only extract-pdf --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# after the server modules: some benchmarks share their module's name
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import WORDS, make_image, make_pdf, variant  # noqa: E402
+
+
+# LOCAL STAND-INS
+def install_fake_ocr(ms_per_megapixel: float):
+    """
+    Replace easyocr before main imports it (OCR then runs in-process).
+    """
+
+    class Reader:
+        def __init__(self, langs, gpu=False):
+            pass
+
+        def readtext(self, arr, detail=0):
+            time.sleep(arr.shape[0] * arr.shape[1] / 1e6 * ms_per_megapixel / 1000)
+            return [" ".join(WORDS[:5]), " ".join(WORDS[5:10])]
+
+        def readtext_batched(self, arrs, detail=0, batch_size=1):
+            return [self.readtext(a, detail) for a in arrs]
+
+    module = types.ModuleType("easyocr")
+    module.Reader = Reader
+    sys.modules["easyocr"] = module
+    os.environ["OCR_WORKERS"] = "0"
+
+
+# SCENARIOS
+def scenarios(args, llm_model: str) -> list:
+    """
+    (name, build(i) -> (method, path, request kwargs)) for every endpoint.
+    """
+    out = []
+    warm = args.warm_cache
+
+    for pages in args.pdf_pages:
+        pdf = make_pdf(pages, args.pdf_lines)
+
+        def build(i, pdf=pdf):
+            data = pdf if warm else variant(pdf, i)
+            return "POST", "/extract-pdf", {"files": {"file": ("bench.pdf", data, "application/pdf")}}
+
+        out.append((f"extract-pdf/{pages}p", build))
+
+    for size in args.image_sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        image = make_image(width, height, args.image_lines)
+
+        def build(i, image=image):
+            data = image if warm else variant(image, i)
+            return "POST", "/extract-image", {"files": {"file": ("bench.jpg", data, "image/jpeg")}}
+
+        out.append((f"extract-image/{width}x{height}", build))
+
+    if args.batch_files:
+        # half PDFs, half images, of the smallest configured sizes
+        pdf = make_pdf(min(args.pdf_pages), args.pdf_lines)
+        width, height = min(tuple(int(v) for v in size.lower().split("x")) for size in args.image_sizes)
+        image = make_image(width, height, args.image_lines)
+
+        def build(i):
+            files = []
+            for n in range(args.batch_files):
+                key = i * args.batch_files + n
+                if n % 2:
+                    files.append(("files", (f"{n}.jpg", image if warm else variant(image, key), "image/jpeg")))
+                else:
+                    files.append(("files", (f"{n}.pdf", pdf if warm else variant(pdf, key), "application/pdf")))
+            return "POST", "/extract/batch", {"files": files}
+
+        out.append((f"extract-batch/{args.batch_files}", build))
+
+    def topic(i):
+        return "Cell biology" if warm else f"Cell biology, part {i}"
+
+    def generate(stream):
+        def build(i):
+            body = {"model": llm_model, "api_key": "bench", "topic": topic(i), "stream": stream}
+            return "POST", "/mindmap/generate", {"json": body}
+        return build
+
+    def generate_batch(i):
+        topics = [topic(i * args.batch_topics + n) for n in range(args.batch_topics)]
+        body = {"model": llm_model, "api_key": "bench", "topics": topics}
+        return "POST", "/mindmap/generate/batch", {"json": body}
+
+    def explain(i):
+        tree = {"id": "root", "label": topic(i), "children": []}
+        return "POST", "/mindmap/explain", {"json": {"model": llm_model, "api_key": "bench", "mindmap": tree}}
+
+    def invoke(i):
+        messages = [{"role": "user", "content": f"Summarise {topic(i)}"}]
+        return "POST", "/llm/invoke", {"json": {"model": llm_model, "api_key": "bench", "messages": messages}}
+
+    out += [
+        ("mindmap-generate", generate(False)),
+        ("mindmap-generate-stream", generate(True)),
+        *([(f"mindmap-generate-batch/{args.batch_topics}", generate_batch)] if args.batch_topics else []),
+        ("mindmap-explain", explain),
+        ("llm-invoke", invoke),
+    ]
+    if args.only:
+        out = [(name, build) for name, build in out if any(name.startswith(o) for o in args.only)]
+    return out
+
+
+# MEASUREMENT
+def percentile(sorted_values: list, p: float) -> float:
+    # nearest rank
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def run_scenario(client, build, concurrency: int, requests: int, offset: int) -> dict:
+    latencies = []
+    errors = {}
+    numbers = iter(range(offset, offset + requests))
+
+    async def worker():
+        for i in numbers:
+            method, path, kwargs = build(i)
+            start = time.perf_counter()
+            r = await client.request(method, path, **kwargs)
+            await r.aread()
+            latencies.append(time.perf_counter() - start)
+            if r.status_code >= 400:
+                errors[str(r.status_code)] = errors.get(str(r.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def run_all(main_module, args) -> list:
+    import httpx
+
+    results = []
+    transport = httpx.ASGITransport(app=main_module.app)
+    async with main_module.lifespan(main_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            offset = 0
+            for name, build in scenarios(args, "mock-bench"):
+                # warm-up outside the timing (pools, lazily built clients)
+                method, path, kwargs = build(-1)
+                await client.request(method, path, **kwargs)
+
+                for concurrency in args.concurrency:
+                    r = await run_scenario(client, build, concurrency, args.requests, offset)
+                    offset += args.requests
+                    results.append({"scenario": name, "concurrency": concurrency, **r})
+                    print(
+                        f"{name:<28} c={concurrency:<3} {r['throughput_rps']:>8} rps  "
+                        f"p50 {r['p50_ms']:>8}  p95 {r['p95_ms']:>8}  p99 {r['p99_ms']:>8} ms  "
+                        f"errors {sum(r['errors'].values()):>3}  rss {r['peak_rss_mb']} MB",
+                        flush=True,
+                    )
+    return results
+
+
+# REPORTING
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"\nagainst {baseline_path}:")
+    print(f"{'scenario':<28} {'c':>3} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for r in results:
+        old = baseline.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        print(
+            f"{r['scenario']:<28} {r['concurrency']:>3} "
+            f"{change(r['throughput_rps'], old['throughput_rps']):>9} {change(r['p50_ms'], old['p50_ms']):>9} "
+            f"{change(r['p95_ms'], old['p95_ms']):>9} {change(r['p99_ms'], old['p99_ms']):>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=40, help="requests per scenario and concurrency level")
+    parser.add_argument("--only", nargs="+", help="scenario name prefixes, e.g. extract-pdf mindmap")
+    parser.add_argument("--pdf-pages", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--pdf-lines", type=int, default=40, help="text lines per PDF page")
+    parser.add_argument("--image-sizes", nargs="+", default=["640x480", "1920x1080", "4032x3024"])
+    parser.add_argument("--image-lines", type=int, default=8, help="text lines per image")
+    parser.add_argument("--batch-files", type=int, default=8, help="files per /extract/batch request, 0 = skip")
+    parser.add_argument("--batch-topics", type=int, default=20, help="topics per /mindmap/generate/batch request, 0 = skip")
+    parser.add_argument("--fake-ocr", action="store_true")
+    parser.add_argument("--ocr-ms-per-mp", type=float, default=150.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.2, help="log-normal shape, 0 = fixed")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=400.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of LLM calls failing with 500")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="fraction of LLM calls rate limited")
+    parser.add_argument("--mindmap-nodes", type=int, default=30)
+    parser.add_argument("--admission", action="store_true", help="keep the admission limits on")
+    parser.add_argument("--warm-cache", action="store_true", help="repeat identical requests")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    if args.fake_ocr:
+        install_fake_ocr(args.ocr_ms_per_mp)
+    else:
+        try:
+            import easyocr  # noqa: F401
+        except ImportError:
+            print("easyocr not installed, using the fake OCR reader")
+            args.fake_ocr = True
+            install_fake_ocr(args.ocr_ms_per_mp)
+
+    if not args.admission:
+        for cls in ("OCR", "PDF", "BATCH", "LLM", "LLM_BATCH"):
+            os.environ[f"ADMISSION_{cls}_RATE"] = "0"
+            os.environ[f"ADMISSION_{cls}_MAX_IN_FLIGHT"] = "0"
+    os.environ.update(
+        MOCK_LLM_ENABLED="1",
+        MOCK_LLM_LATENCY_MS=str(args.llm_latency_ms),
+        MOCK_LLM_LATENCY_SIGMA=str(args.llm_latency_sigma),
+        MOCK_LLM_TOKENS_PER_SECOND=str(args.llm_tokens_per_s),
+        MOCK_LLM_ERROR_RATE=str(args.llm_error_rate),
+        MOCK_LLM_RATE_LIMIT_RATE=str(args.llm_429_rate),
+        MOCK_LLM_NODES=str(args.mindmap_nodes),
+    )
+    # no shared cache file between runs
+    os.environ.pop("EXTRACT_CACHE_DB", None)
+    os.environ.pop("LLM_CACHE_DB", None)
+
+    import main as main_module
+
+    # whole documents are extracted, instead of stopping at the per-request text cap
+    main_module.MAX_PDF_TEXT_CHARS = 10 ** 9
+
+    results = asyncio.run(run_all(main_module, args))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": vars(args),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "results": results,
+    }
+    print(f"peak RSS {report['peak_rss_mb']} MB (worker processes {report['peak_rss_children_mb']} MB)")
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
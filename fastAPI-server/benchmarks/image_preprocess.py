@@ -0,0 +1,108 @@
+# benchmarks/image_preprocess.py
+"""
+OCR latency and accuracy with and without the image pre-processing pipeline.
+
+Renders known text onto a large synthetic "phone photo", saves it as JPEG and
+runs it through preprocess_image with the pipeline off (full-resolution RGB
+decode) and on (draft decode + downscale, optionally grayscale/autocontrast).
+Accuracy is the share of expected words found in the OCR output. Without
+easyocr installed (or with --no-ocr) only the decode/pre-processing stages
+are timed.
+
+    cd fastAPI-server
+    python benchmarks/image_preprocess.py --width 4032 --height 3024
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from image_preprocess import preprocess_image  # noqa: E402
+from synthetic import image_lines, make_image  # noqa: E402
+
+# text lines on the benchmark photo
+LINES = 8
+EXPECTED = {w for line in image_lines(LINES) for w in line.split()}
+
+
+def accuracy(lines) -> float:
+    found = set(re.findall(r"[a-z]+", " ".join(lines).lower()))
+    return sum(1 for w in EXPECTED if w in found) / len(EXPECTED)
+
+
+def run(data: bytes, settings: dict, reader, repeat: int) -> dict:
+    best_pre, best_ocr, stages, acc = None, None, None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        arr, timings = preprocess_image(io.BytesIO(data), **settings)
+        pre = time.perf_counter() - start
+        if best_pre is None or pre < best_pre:
+            best_pre, stages = pre, timings
+
+        if reader is not None:
+            start = time.perf_counter()
+            lines = reader.readtext(arr, detail=0)
+            ocr = time.perf_counter() - start
+            best_ocr = ocr if best_ocr is None else min(best_ocr, ocr)
+            acc = accuracy(lines)
+
+    return {
+        "settings": settings,
+        "array_shape": list(arr.shape),
+        "preprocess_s": round(best_pre, 4),
+        "stages_s": {k: round(v, 4) for k, v in stages.items()},
+        "ocr_s": None if best_ocr is None else round(best_ocr, 3),
+        "accuracy": acc,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--max-long-edge", type=int, default=2048)
+    parser.add_argument("--grayscale", action="store_true")
+    parser.add_argument("--autocontrast", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-ocr", action="store_true")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    reader = None
+    if not args.no_ocr:
+        try:
+            import easyocr
+
+            reader = easyocr.Reader(["en"], gpu=False)
+        except ImportError:
+            print("easyocr not installed, timing pre-processing only")
+
+    data = make_image(args.width, args.height, LINES)
+    off = {"max_long_edge": 0, "grayscale": False, "autocontrast": False, "max_pixels": 10 ** 9}
+    on = {
+        "max_long_edge": args.max_long_edge,
+        "grayscale": args.grayscale,
+        "autocontrast": args.autocontrast,
+        "max_pixels": 10 ** 9,
+    }
+    results = {"without": run(data, off, reader, args.repeat), "with": run(data, on, reader, args.repeat)}
+
+    print(f"{args.width}x{args.height} JPEG, {len(data) / 1024:.0f} KiB")
+    for name, r in results.items():
+        print(
+            f"{name:>8}: array {r['array_shape']}, pre-processing {r['preprocess_s']}s {r['stages_s']}, "
+            f"ocr {r['ocr_s'] if r['ocr_s'] is not None else '-'}s, accuracy {r['accuracy']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
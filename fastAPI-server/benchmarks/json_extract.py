@@ -0,0 +1,109 @@
+# benchmarks/json_extract.py
+"""
+Microbenchmark of JSON extraction from LLM replies: the previous
+fence-regex / first-{-last-} extractor against json_extract.find_json,
+per kind of reply (time per call and whether a value was recovered).
+
+    cd fastAPI-server
+    python benchmarks/json_extract.py --nodes 60 --number 2000
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from json_extract import find_json  # noqa: E402
+
+
+def legacy_extract(text):
+    # the extractor main.py used before json_extract
+    if not text:
+        return None
+    try:
+        json.loads(text)
+        return text
+    except ValueError:
+        pass
+    fence_match = re.search(r"```(?:json)?(.*)```", text, re.DOTALL | re.IGNORECASE)
+    if fence_match:
+        candidate = fence_match.group(1).strip()
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            text = candidate
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        candidate = text[start : end + 1]
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            return None
+    return None
+
+
+def make_tree(nodes: int) -> dict:
+    children = []
+    for i in range(nodes):
+        children.append({
+            "id": f"n{i}",
+            "label": f"Subtopic {i} about {{braces}} and \"quotes\"",
+            "relation": "includes",
+            "children": [],
+        })
+    return {"id": "root", "label": "Benchmark", "children": children}
+
+
+def replies(nodes: int) -> dict:
+    tree = json.dumps(make_tree(nodes), indent=2)
+    return {
+        "plain": tree,
+        "fenced": "```json\n" + tree + "\n```",
+        "prose_braces": "Here is the map for {topic}:\n" + tree + "\nHope {this} helps.",
+        "two_objects": tree + "\n" + tree,
+        "trailing_commas": tree.replace('"children": []', '"children": [],'),
+        "truncated": tree[: int(len(tree) * 0.8)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=60)
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    extractors = {
+        "legacy": legacy_extract,
+        "find_json": lambda text: find_json(text, repair=True),
+    }
+
+    results = []
+    for kind, text in replies(args.nodes).items():
+        for name, fn in extractors.items():
+            seconds = min(timeit.repeat(lambda: fn(text), number=args.number, repeat=3)) / args.number
+            results.append({
+                "reply": kind,
+                "extractor": name,
+                "bytes": len(text),
+                "us_per_call": round(seconds * 1e6, 1),
+                "recovered": fn(text) is not None,
+            })
+
+    print(f"{'reply':<16} {'extractor':<10} {'bytes':>7} {'us/call':>9} {'recovered':>10}")
+    for r in results:
+        print(f"{r['reply']:<16} {r['extractor']:<10} {r['bytes']:>7} {r['us_per_call']:>9} {str(r['recovered']):>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"nodes": args.nodes, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
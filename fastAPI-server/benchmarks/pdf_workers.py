@@ -0,0 +1,61 @@
+# benchmarks/pdf_workers.py
+"""
+Pages/second of PDFPool at different worker counts.
+
+    cd fastAPI-server
+    python benchmarks/pdf_workers.py --pages 400 --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pdf_extract import PDFPool  # noqa: E402
+from synthetic import make_pdf  # noqa: E402
+
+
+async def run_once(pool: PDFPool, data: bytes, pages: int) -> float:
+    start = time.perf_counter()
+    await pool.extract(data, None, max_chars=10 ** 9, max_pages=pages)
+    return time.perf_counter() - start
+
+
+async def bench(data: bytes, pages: int, workers: int, repeat: int) -> dict:
+    pool = PDFPool(workers=workers, parallel_min_pages=1)
+    try:
+        await run_once(pool, data, pages)  # spawn workers outside the timing
+        times = [await run_once(pool, data, pages) for _ in range(repeat)]
+    finally:
+        pool.shutdown()
+
+    best = min(times)
+    return {"workers": workers, "best_s": round(best, 4), "pages_per_s": round(pages / best, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    data = make_pdf(args.pages)
+    results = [asyncio.run(bench(data, args.pages, w, args.repeat)) for w in args.workers]
+
+    print(f"{args.pages} pages, {len(data) / 1024:.0f} KiB, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'best s':>8} {'pages/s':>9}")
+    for r in results:
+        print(f"{r['workers']:>8} {r['best_s']:>8} {r['pages_per_s']:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"pages": args.pages, "cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# benchmarks/synthetic.py
+"""
+Synthetic inputs for the benchmarks: text PDFs of any page count, images
+of any resolution and text density, and per-request variants of both that
+hash differently (so the extraction cache does not answer them).
+"""
+import io
+import random
+from typing import List
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFont
+
+WORDS = (
+    "photosynthesis converts light energy into chemical energy stored in glucose while "
+    "mitochondria produce energy through cellular respiration and ribosomes assemble proteins "
+    "from amino acids carried by transfer rna along the messenger rna strand"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_pdf(pages: int, lines_per_page: int = 40, seed: int = 0) -> bytes:
+    """
+    A PDF with real text on every page (lines_per_page lines of ~90 chars).
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        y = 50
+        for line in range(lines_per_page):
+            page.insert_text((40, y), f"{p + 1}.{line + 1} {sentence(rng, 12)}", fontsize=9)
+            y += 18
+    return doc.tobytes()
+
+
+def image_lines(lines: int = 8, seed: int = 0) -> List[str]:
+    """
+    The text make_image draws for the same lines and seed.
+    """
+    rng = random.Random(seed)
+    return [sentence(rng, 5) for _ in range(lines)]
+
+
+def make_image(width: int, height: int, lines: int = 8, fmt: str = "JPEG", seed: int = 0) -> bytes:
+    """
+    A light "photo" of width x height with `lines` lines of dark text.
+    """
+    img = Image.new("RGB", (width, height), (238, 236, 228))
+    draw = ImageDraw.Draw(img)
+    size = max(12, height // max(4 * lines, 40))
+    try:
+        font = ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+
+    y = height // 12
+    for text in image_lines(lines, seed):
+        draw.text((width // 12, y), text, fill=(30, 30, 35), font=font)
+        y += int(size * 1.8)
+
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=90) if fmt == "JPEG" else img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def variant(data: bytes, n: int) -> bytes:
+    """
+    The same document with n appended after its end marker: PDF readers and
+    image decoders ignore trailing bytes, but the content hash changes.
+    """
+    return data + b"\n%% variant " + str(n).encode()
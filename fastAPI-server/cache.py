@@ -0,0 +1,242 @@
+# cache.py
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from metrics import Counter, Gauge
+
+CACHE_HITS = Counter("cache_hits_total", "Cache lookups answered from the cache.", ("cache", "tier"))
+CACHE_MISSES = Counter("cache_misses_total", "Cache lookups that found nothing.", ("cache",))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries dropped to stay under the size bound.", ("cache", "tier"))
+CACHE_BYTES = Gauge("cache_bytes", "Bytes currently held by the in-memory tier.", ("cache",))
+
+
+def content_key(data: bytes, *settings: Any) -> str:
+    """
+    Content address for an upload: sha256 over the extraction settings and the raw bytes.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    h.update(b"\0")
+    h.update(data)
+    return h.hexdigest()
+
+
+# MEMORY TIER
+class MemoryLRU:
+    """
+    LRU map of key -> bytes, bounded by the total size of the stored values.
+    Entries may carry an expiry time, after which they read as missing.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires <= time.time():
+                del self._items[key]
+                self.bytes -= len(value)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, expires: Optional[float] = None) -> int:
+        """
+        Store value (until the expires timestamp, if given) and return how
+        many entries were evicted to make room. Values larger than the whole
+        cache are not stored.
+        """
+        if len(value) > self.max_bytes:
+            return 0
+
+        evicted = 0
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+
+            self._items[key] = (value, expires)
+            self.bytes += len(value)
+
+            while self.bytes > self.max_bytes:
+                _, (dropped, _) = self._items.popitem(last=False)
+                self.bytes -= len(dropped)
+                evicted += 1
+
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+
+# DISK TIER
+class SQLiteStore:
+    """
+    Key -> bytes table in a local SQLite file, shared by every worker process
+    on the host. Least recently used rows are deleted once the stored values
+    exceed max_bytes; rows past their expiry are ignored and deleted first.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        # files created before entries could expire lack the column
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(cache)")]
+        if "expires" not in columns:
+            conn.execute("ALTER TABLE cache ADD COLUMN expires REAL")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        """
+        (value, expiry timestamp or None) for a live key, or None.
+        """
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return row[0], row[1]
+
+    def set(self, key: str, value: bytes, expires: Optional[float] = None) -> int:
+        if len(value) > self.max_bytes:
+            return 0
+
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, accessed, expires) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), now, expires),
+        )
+
+        evicted = conn.execute("DELETE FROM cache WHERE expires <= ?", (now,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 64").fetchall()
+            for old_key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM cache WHERE key = ?", (old_key,))
+                total -= size
+                evicted += 1
+
+        conn.commit()
+        return evicted
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+
+
+# RESULT CACHE
+class ResultCache:
+    """
+    Two-tier cache for JSON-serialisable results: an in-memory LRU bounded
+    by bytes, backed by an optional SQLite file shared across workers.
+    Disk hits are promoted into memory. With ttl (seconds) set, entries
+    expire that long after they were stored.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        db_path: Optional[str] = None,
+        db_max_bytes: int = 0,
+        ttl: Optional[float] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.memory = MemoryLRU(max_bytes)
+        self.disk = SQLiteStore(db_path, db_max_bytes) if db_path else None
+
+    def _store_memory(self, key: str, raw: bytes, expires: Optional[float]):
+        evicted = self.memory.set(key, raw, expires)
+        if evicted:
+            CACHE_EVICTIONS.inc(evicted, cache=self.name, tier="memory")
+        CACHE_BYTES.set(self.memory.bytes, cache=self.name)
+
+    async def get(self, key: str) -> Any:
+        """
+        Cached value for key, or None.
+        """
+        raw = self.memory.get(key)
+        if raw is not None:
+            CACHE_HITS.inc(cache=self.name, tier="memory")
+            return json.loads(raw)
+
+        if self.disk is not None:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(None, self.disk.get_entry, key)
+            if entry is not None:
+                raw, expires = entry
+                CACHE_HITS.inc(cache=self.name, tier="disk")
+                self._store_memory(key, raw, expires)
+                return json.loads(raw)
+
+        CACHE_MISSES.inc(cache=self.name)
+        return None
+
+    async def set(self, key: str, value: Any):
+        raw = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        expires = self._expires()
+        self._store_memory(key, raw, expires)
+
+        if self.disk is not None:
+            loop = asyncio.get_running_loop()
+            evicted = await loop.run_in_executor(None, self.disk.set, key, raw, expires)
+            if evicted:
+                CACHE_EVICTIONS.inc(evicted, cache=self.name, tier="disk")
+
+    def _expires(self) -> Optional[float]:
+        return None if self.ttl is None else time.time() + self.ttl
+
+    def clear(self):
+        self.memory.clear()
+        CACHE_BYTES.set(0, cache=self.name)
+        if self.disk is not None:
+            self.disk.clear()
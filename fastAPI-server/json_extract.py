@@ -0,0 +1,139 @@
+# json_extract.py
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+# Tokens that matter when bracket-matching a candidate: whole strings
+# (possibly unterminated at the end of the reply) and structural characters
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"?|[{}\[\],]')
+_STRING_OR_TRAILING_COMMA = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|,(?=\s*[}\]])')
+_TRAILING_COMMA = re.compile(r",\s*$")
+_WHITESPACE = re.compile(r"\s*")
+
+_CLOSER = {"{": "}", "[": "]"}
+_DECODER = json.JSONDecoder()
+
+# How many cut points a truncated value is tried at, newest first
+MAX_TRUNCATION_ATTEMPTS = 32
+
+
+def _loads(candidate: str) -> Tuple[bool, Any]:
+    try:
+        return True, json.loads(candidate)
+    except ValueError:
+        return False, None
+
+
+def strip_trailing_commas(candidate: str) -> str:
+    """
+    Drop commas directly before a closing brace or bracket (outside strings),
+    the most common way LLM JSON is invalid.
+    """
+    return _STRING_OR_TRAILING_COMMA.sub(lambda m: m.group(1) or "", candidate)
+
+
+def _repair_truncated(text: str, cuts: List[Tuple[int, str]]) -> Optional[Tuple[Any, str]]:
+    """
+    Close a value that was cut off (e.g. at max_tokens): try the latest
+    positions where the text so far was complete up to an open container,
+    and append the closers that were open there.
+    """
+    for end, closers in reversed(cuts[-MAX_TRUNCATION_ATTEMPTS:]):
+        head = _TRAILING_COMMA.sub("", text[:end].rstrip())
+        candidate = strip_trailing_commas(head + closers)
+        ok, value = _loads(candidate)
+        if ok:
+            return value, candidate
+    return None
+
+
+def _scan(text: str, begin: int) -> Tuple[int, bool, List[Tuple[int, str]]]:
+    """
+    Match brackets from text[begin] on, outside strings. Returns the end of
+    the balanced value (-1 if the text ends first; the position after the
+    offending closer if a mismatched one was hit), whether it was
+    mismatched, and the cut points for _repair_truncated.
+    """
+    closers = _CLOSER[text[begin]]
+    # (index, closers) where cutting and closing gives complete JSON
+    cuts: List[Tuple[int, str]] = []
+
+    for m in _TOKEN.finditer(text, begin + 1):
+        ch = text[m.start()]
+        if ch == '"':
+            continue
+        j = m.start()
+        if ch == "{" or ch == "[":
+            closers = _CLOSER[ch] + closers
+            if ch == "[":
+                # an empty list is a fine place to stop, an empty object usually is not
+                cuts.append((j + 1, closers))
+        elif ch == "}" or ch == "]":
+            if ch != closers[0]:
+                return j + 1, True, cuts
+            closers = closers[1:]
+            if not closers:
+                return j + 1, False, cuts
+            cuts.append((j + 1, closers))
+        else:
+            cuts.append((j, closers))
+
+    return -1, False, cuts
+
+
+def find_json(text: str, repair: bool = False, starts: str = "{") -> Optional[Tuple[Any, str]]:
+    """
+    First complete JSON value in an LLM reply, as (value, json_text).
+
+    Each candidate start is handed to the C JSON decoder, which stops at
+    the end of the value, so prose (even prose with braces), markdown
+    fences and further JSON values around it cost nothing extra. Values
+    start at one of the `starts` characters (objects by default).
+
+    With repair=True, a candidate the decoder rejects is decoded again
+    without trailing commas, and a value the reply ends in the middle of
+    (e.g. cut off at max_tokens) is bracket-matched once and closed at its
+    last complete element. Returns None when there is nothing usable.
+
+    A rejected value is skipped as a whole: its inner objects are never
+    returned in its place (a broken root must not come back as one of its
+    children). Only a brace the decoder rejects straight away, i.e. one
+    in the surrounding prose, is stepped over one character at a time.
+    """
+    if not text:
+        return None
+
+    pos = 0
+    while True:
+        begin = min((i for i in (text.find(c, pos) for c in starts) if i != -1), default=-1)
+        if begin == -1:
+            return None
+
+        try:
+            value, end = _DECODER.raw_decode(text, begin)
+            return value, text[begin:end]
+        except json.JSONDecodeError as e:
+            error_pos = e.pos
+
+        if error_pos <= _WHITESPACE.match(text, begin + 1).end():
+            # rejected at its first token: a brace in the prose, not a value
+            pos = begin + 1
+            continue
+
+        if repair and text[error_pos:error_pos + 1] in ("}", "]") and text[:error_pos].rstrip().endswith(","):
+            fixed = strip_trailing_commas(text[begin:])
+            try:
+                value, end = _DECODER.raw_decode(fixed)
+                return value, fixed[:end]
+            except ValueError:
+                pass
+
+        end, mismatched, cuts = _scan(text, begin)
+        if end == -1:
+            # the reply ended inside this value
+            if repair:
+                return _repair_truncated(text[begin:], [(c - begin, s) for c, s in cuts])
+            return None
+
+        # not valid JSON; look for the next value after it
+        pos = end
@@ -1,49 +1,476 @@
 # llm_endpoint.py
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import hashlib
 import inspect
 import json
+import os
+import threading
+import time
+from typing import AsyncIterator, Callable, Optional
 
+import httpx
 from langchain_openai import ChatOpenAI
 from langchain_groq import ChatGroq
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from metrics import Counter, Gauge, Histogram, observe_stage
+from mock_llm import LOCAL_LLM_BASE_URL, MOCK_LLM_ENABLED, MockChatModel, local_model_name
+
 router = APIRouter()
 
+# Model prefixes get_llm knows how to build ("mock" and "local" are for
+# load tests and development, see mock_llm)
+PROVIDERS = ("groq", "openai", "deepseek", "gemini", "mock", "local")
+KEYLESS_PROVIDERS = ("mock", "local")
+
+# Client registry: how many configured clients to keep, and the shared
+# keep-alive HTTP pool every client of a provider goes through.
+LLM_CLIENT_CACHE_SIZE = int(os.environ.get("LLM_CLIENT_CACHE_SIZE", "64"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.environ.get("LLM_HTTP_KEEPALIVE_SECONDS", "60"))
+
+# Concurrency per provider: in-flight calls (LLM_MAX_CONCURRENCY, or e.g.
+# LLM_MAX_CONCURRENCY_GROQ for one provider) and how many calls may wait for
+# a slot before we answer 503. Clients without a native async API run on a
+# small dedicated thread pool instead of the default executor.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_WAITING = int(os.environ.get("LLM_MAX_WAITING", "256"))
+LLM_SYNC_THREADS = int(os.environ.get("LLM_SYNC_THREADS", "8"))
+
+LLM_CLIENTS = Counter("llm_client_cache_total", "LLM client registry lookups by result.", ("provider", "result"))
+LLM_HTTP_REQUESTS = Counter("llm_http_requests_total", "HTTP requests sent to LLM providers.", ("provider",))
+LLM_HTTP_CONNECTIONS = Counter(
+    "llm_http_connections_opened_total",
+    "New TCP connections opened to LLM providers (requests minus this = reused connections).",
+    ("provider",),
+)
+
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "LLM calls currently running.", ("provider",))
+LLM_WAITING = Gauge("llm_waiting", "LLM calls waiting for a concurrency slot.", ("provider",))
+LLM_ERRORS = Counter(
+    "llm_errors_total", "Failed LLM calls by provider and HTTP status (or error type).", ("provider", "status")
+)
+LLM_REJECTED = Counter("llm_rejected_total", "LLM calls refused because the wait queue was full.", ("provider",))
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from starting a streamed LLM call to its first text chunk.",
+    ("provider",),
+)
+
+
+# SHARED HTTP POOLS
+_http_clients = {}
+_http_lock = threading.Lock()
+
+
+def _http_pool(provider: str):
+    """
+    (sync, async) httpx clients shared by every LLM client of a provider.
+    Requests and newly opened connections are counted through httpcore's
+    trace hook, so connection reuse shows up in /metrics.
+    """
+    with _http_lock:
+        pair = _http_clients.get(provider)
+        if pair is not None:
+            return pair
+
+        def trace(event, info):
+            if event == "connection.connect_tcp.complete":
+                LLM_HTTP_CONNECTIONS.inc(provider=provider)
+
+        async def atrace(event, info):
+            trace(event, info)
+
+        def on_request(request):
+            LLM_HTTP_REQUESTS.inc(provider=provider)
+            request.extensions["trace"] = trace
+
+        async def on_async_request(request):
+            LLM_HTTP_REQUESTS.inc(provider=provider)
+            request.extensions["trace"] = atrace
+
+        limits = httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_SECONDS,
+        )
+        timeout = httpx.Timeout(120.0, connect=10.0)
+        pair = (
+            httpx.Client(limits=limits, timeout=timeout, event_hooks={"request": [on_request]}),
+            httpx.AsyncClient(limits=limits, timeout=timeout, event_hooks={"request": [on_async_request]}),
+        )
+        _http_clients[provider] = pair
+        return pair
+
+
+async def close_http_pools():
+    with _http_lock:
+        pairs = list(_http_clients.values())
+        _http_clients.clear()
+    for client, async_client in pairs:
+        client.close()
+        await async_client.aclose()
+
+
 # LLM FACTORY
-def get_llm(model: str, api_key: str, temperature: float, max_tokens: int):
-    if model.startswith("groq"):
+def _provider(model: str) -> str:
+    for name in PROVIDERS:
+        if model.startswith(name):
+            return name
+    raise Exception("Unsupported model prefix.")
+
+
+def provider_name(model: str) -> str:
+    """
+    Provider of a model for limits and metrics ("other" when unknown).
+    """
+    try:
+        return _provider(model)
+    except Exception:
+        return "other"
+
+
+def provider_api_key(provider: str) -> str | None:
+    """
+    The provider's own key from <PROVIDER>_API_KEY, "" for providers that
+    need none (mock, local), None when it is not configured.
+    """
+    key = os.environ.get(f"{provider.upper()}_API_KEY")
+    if key:
+        return key
+    return "" if provider in KEYLESS_PROVIDERS else None
+
+
+def _build_llm(provider: str, model: str, api_key: str, temperature: float, max_tokens: int):
+    if provider == "groq":
+        http_client, http_async_client = _http_pool(provider)
         return ChatGroq(
             model=model,
             groq_api_key=api_key,
             temperature=temperature,
             max_tokens=max_tokens,
+            http_client=http_client,
+            http_async_client=http_async_client,
         )
 
-    if model.startswith("openai"):
+    if provider == "openai":
+        http_client, http_async_client = _http_pool(provider)
         return ChatOpenAI(
             model=model,
             openai_api_key=api_key,
             temperature=temperature,
             max_tokens=max_tokens,
+            http_client=http_client,
+            http_async_client=http_async_client,
         )
 
-    if model.startswith("deepseek"):
+    if provider == "deepseek":
+        http_client, http_async_client = _http_pool(provider)
         return ChatOpenAI(
             model=model,
             openai_api_key=api_key,
             openai_api_base="https://api.deepseek.com/v1",
             temperature=temperature,
             max_tokens=max_tokens,
+            http_client=http_client,
+            http_async_client=http_async_client,
         )
 
-    if model.startswith("gemini"):
-        return ChatGoogleGenerativeAI(
-            model=model,
-            google_api_key=api_key,
+    if provider == "mock":
+        if not MOCK_LLM_ENABLED:
+            raise Exception("The mock LLM is disabled (set MOCK_LLM_ENABLED=1).")
+        return MockChatModel(model, max_tokens)
+
+    if provider == "local":
+        if not LOCAL_LLM_BASE_URL:
+            raise Exception("No local LLM server configured (set LOCAL_LLM_BASE_URL).")
+        http_client, http_async_client = _http_pool(provider)
+        return ChatOpenAI(
+            model=local_model_name(model),
+            openai_api_key=api_key or "local",
+            openai_api_base=LOCAL_LLM_BASE_URL,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            http_client=http_client,
+            http_async_client=http_async_client,
         )
 
-    raise Exception("Unsupported model prefix.")
+    # gemini: the Google client manages its own transport; reusing the
+    # client instance keeps that transport (and its connections) alive
+    return ChatGoogleGenerativeAI(
+        model=model,
+        google_api_key=api_key,
+    )
+
+
+# CLIENT REGISTRY
+_llm_clients: "OrderedDict[tuple, object]" = OrderedDict()
+_llm_clients_lock = threading.Lock()
+
+
+def _key_fingerprint(api_key: str | None) -> str:
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def get_llm(model: str, api_key: str, temperature: float, max_tokens: int):
+    """
+    Configured chat model for (provider, model, API key, generation params).
+    Clients are kept in an LRU registry of LLM_CLIENT_CACHE_SIZE entries, so
+    repeated requests reuse the client and its warm HTTP connections.
+    """
+    provider = _provider(model)
+    key = (provider, model, _key_fingerprint(api_key), temperature, max_tokens)
+
+    with _llm_clients_lock:
+        llm = _llm_clients.get(key)
+        if llm is not None:
+            _llm_clients.move_to_end(key)
+            LLM_CLIENTS.inc(provider=provider, result="hit")
+            return llm
+
+    llm = _build_llm(provider, model, api_key, temperature, max_tokens)
+    LLM_CLIENTS.inc(provider=provider, result="miss")
+
+    with _llm_clients_lock:
+        _llm_clients[key] = llm
+        _llm_clients.move_to_end(key)
+        while len(_llm_clients) > LLM_CLIENT_CACHE_SIZE:
+            evicted_key, _ = _llm_clients.popitem(last=False)
+            LLM_CLIENTS.inc(provider=evicted_key[0], result="evicted")
+
+    return llm
+
+# INVOCATION
+class LLMBusy(Exception):
+    """Too many calls are already waiting for this provider."""
+
+    # read by resilience.classify: try another provider rather than wait here
+    retry_reason = "busy"
+    retry_after = 1.0
+
+
+class _ProviderLimiter:
+    def __init__(self, provider: str, limit: int, max_waiting: int):
+        self.provider = provider
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(limit)
+
+    def check(self):
+        """
+        Raise LLMBusy if a call made now would be refused.
+        """
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            LLM_REJECTED.inc(provider=self.provider)
+            raise LLMBusy(f"Too many pending requests for {self.provider}.")
+
+    async def __aenter__(self):
+        if self.semaphore.locked():
+            self.check()
+            self.waiting += 1
+            LLM_WAITING.inc(provider=self.provider)
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+                LLM_WAITING.dec(provider=self.provider)
+        else:
+            await self.semaphore.acquire()
+        LLM_IN_FLIGHT.inc(provider=self.provider)
+
+    async def __aexit__(self, *exc):
+        LLM_IN_FLIGHT.dec(provider=self.provider)
+        self.semaphore.release()
+
+
+_limiters = {}
+_sync_executor = ThreadPoolExecutor(max_workers=LLM_SYNC_THREADS, thread_name_prefix="llm-sync")
+
+
+def _limiter(provider: str) -> _ProviderLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None or limiter.loop is not asyncio.get_running_loop():
+        limit = int(os.environ.get(f"LLM_MAX_CONCURRENCY_{provider.upper()}", LLM_MAX_CONCURRENCY))
+        limiter = _limiters[provider] = _ProviderLimiter(provider, limit, LLM_MAX_WAITING)
+    return limiter
+
+
+async def ainvoke_llm(llm, messages, provider: str):
+    """
+    Invoke a chat model without tying up a thread: LangChain models are
+    awaited through ainvoke(), coroutine invoke()s are awaited directly and
+    only plain sync clients go to the dedicated LLM thread pool. At most
+    the provider's concurrency limit of calls run at once; raises LLMBusy
+    when the provider's wait queue is full.
+    """
+    async with _limiter(provider):
+        started = time.perf_counter()
+        try:
+            return await _ainvoke(llm, messages)
+        except Exception as e:
+            LLM_ERRORS.inc(provider=provider, status=_error_status(e))
+            raise
+        finally:
+            observe_stage("llm_call", time.perf_counter() - started)
+
+
+def _error_status(exc: BaseException) -> str:
+    # provider SDK errors carry the HTTP status on themselves or their response
+    for obj in (exc, getattr(exc, "response", None)):
+        status = getattr(obj, "status_code", None)
+        if isinstance(status, int):
+            return str(status)
+    return type(exc).__name__
+
+
+async def _ainvoke(llm, messages):
+    ainvoke = getattr(llm, "ainvoke", None)
+    if callable(ainvoke):
+        return await ainvoke(messages)
+
+    invoke_fn = llm.invoke
+    if inspect.iscoroutinefunction(invoke_fn):
+        return await invoke_fn(messages)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sync_executor, lambda: invoke_fn(messages))
+
+
+# STREAMING
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _usage(resp):
+    # LangChain messages carry usage_metadata; raw OpenAI-style dicts carry "usage"
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None and isinstance(resp, dict):
+        usage = resp.get("usage")
+    return usage if isinstance(usage, dict) else None
+
+
+def _add_usage(total: dict, usage):
+    # token counts arrive spread over the chunks; nested details are summed too
+    for name, value in (usage or {}).items():
+        if isinstance(value, dict):
+            _add_usage(total.setdefault(name, {}), value)
+        elif isinstance(value, (int, float)):
+            total[name] = total.get(name, 0) + value
+
+
+async def _chunks(llm, messages):
+    astream = getattr(llm, "astream", None)
+    if callable(astream):
+        async for chunk in astream(messages):
+            yield chunk
+        return
+
+    # no streaming API: the whole reply is relayed as a single chunk
+    yield await _ainvoke(llm, messages)
+
+
+class LLMStream:
+    """
+    Text chunks of one streamed chat model call, for use with async for.
+    Usage metadata is summed over the chunks and the time to the first
+    text chunk is recorded while iterating.
+
+    Raises LLMBusy right away when the provider's wait queue is full, so
+    the caller can still answer 503 before its response has started.
+    """
+
+    def __init__(self, llm, messages, provider: str):
+        self.llm = llm
+        self.messages = messages
+        self.provider = provider
+        self.usage = {}
+        self.first_token: Optional[float] = None
+        self.elapsed: Optional[float] = None
+        self._limiter = _limiter(provider)
+        self._limiter.check()
+
+    async def __aiter__(self):
+        started = time.perf_counter()
+        try:
+            async with self._limiter:
+                async for chunk in _chunks(self.llm, self.messages):
+                    _add_usage(self.usage, _usage(chunk))
+
+                    text = _extract_text(chunk)
+                    if not text:
+                        continue
+                    if self.first_token is None:
+                        self.first_token = time.perf_counter() - started
+                        LLM_FIRST_TOKEN_SECONDS.observe(self.first_token, provider=self.provider)
+                    yield text
+        except Exception as e:
+            LLM_ERRORS.inc(provider=self.provider, status=_error_status(e))
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - started
+            observe_stage("llm_stream", self.elapsed)
+
+    def summary(self) -> dict:
+        """
+        Usage and timing for the final event of a stream.
+        """
+        return {
+            "usage": self.usage or None,
+            "timing": {
+                "first_token_ms": None if self.first_token is None else round(self.first_token * 1000, 1),
+                "total_ms": None if self.elapsed is None else round(self.elapsed * 1000, 1),
+            },
+        }
+
+
+def stream_llm(
+    llm, messages, provider: str, model: str, on_done: Optional[Callable[[LLMStream], None]] = None
+) -> AsyncIterator[str]:
+    """
+    Server-sent events for a chat model call: one "token" event per text
+    chunk as the provider produces it, then a "done" event with usage and
+    timing (or an "error" event if the call fails midway). on_done is
+    called with the finished stream before the "done" event.
+    Raises LLMBusy before anything is sent, see LLMStream.
+    """
+    return _relay(LLMStream(llm, messages, provider), model, on_done)
+
+
+async def _relay(stream: LLMStream, model: str, on_done=None):
+    try:
+        async for text in stream:
+            yield sse_event("token", {"text": text})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"LLM error: {e}"})
+        return
+
+    if on_done is not None:
+        on_done(stream)
+    yield sse_event("done", {"model": model, **stream.summary()})
+
+
+# READINESS
+def provider_status():
+    """
+    LLM readiness for /ready: clients are built on first use, so a provider
+    is usable as soon as its own <PROVIDER>_API_KEY is configured (mock and
+    local need no key, only to be enabled). Ready when any provider is.
+    """
+    providers = {name: {"api_key_configured": provider_api_key(name) is not None} for name in PROVIDERS}
+    providers["mock"]["enabled"] = MOCK_LLM_ENABLED
+    providers["local"]["enabled"] = bool(LOCAL_LLM_BASE_URL)
+    return {
+        "ready": any(p["api_key_configured"] and p.get("enabled", True) for p in providers.values()),
+        "providers": providers,
+    }
 
 # TEXT EXTRACTOR
 def _extract_text(resp):
@@ -96,12 +523,17 @@ async def invoke(request: Request):
     if not callable(invoke_fn):
         raise HTTPException(500, "LLM has no invoke() method")
 
+    if data.get("stream"):
+        try:
+            events = stream_llm(llm, messages, provider_name(model), model)
+        except LLMBusy as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": "1"})
+        return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
     try:
-        if inspect.iscoroutinefunction(invoke_fn):
-            resp = await invoke_fn(messages)
-        else:
-            loop = asyncio.get_running_loop()
-            resp = await loop.run_in_executor(None, lambda: invoke_fn(messages))
+        resp = await ainvoke_llm(llm, messages, provider_name(model))
+    except LLMBusy as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(500, f"LLM error: {e}")
 
@@ -1,89 +1,323 @@
 # main.py
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List, Any
-import io
+from contextlib import asynccontextmanager
+from typing import Dict, List, Any, Tuple
 import os
 import asyncio
-import inspect
 import json
-from llm_endpoint import router as llm_router, get_llm, _extract_text
+import math
+import tempfile
+import time
+from llm_endpoint import (
+    router as llm_router,
+    get_llm,
+    _extract_text,
+    _usage,
+    ainvoke_llm,
+    close_http_pools,
+    provider_api_key,
+    provider_name,
+    provider_status,
+    stream_llm,
+    sse_event,
+    LLMStream,
+    LLMBusy,
+    SSE_HEADERS,
+)
 from pydantic import BaseModel
-import re
-import json
-from json import JSONDecodeError
 
 # PDF extraction
-import fitz  # PyMuPDF
-
-# Image OCR (EasyOCR)
-import numpy as np
-from PIL import Image
-import easyocr
+from pdf_extract import PDFOpenError, PDFPool, PDFPoolBroken, PDFTooLarge
+
+# Image OCR (EasyOCR, run in worker processes)
+from image_preprocess import ImageTooLarge, preprocess_image
+from ocr_pool import OCRPool, OCRBatcher, OCRQueueFull
+
+from cache import ResultCache, content_key
+from singleflight import SingleFlight
+from admission import AdmissionMiddleware, EndpointClass
+from resilience import LLM_FALLBACK_MODELS, LLMTarget, ProviderUnavailable, call_resilient
+from uploads import Upload, UploadLimitMiddleware, read_upload
+from starlette.formparsers import MultiPartParser
+from tree_stream import StreamParseError, TreeStreamParser
+from json_extract import find_json
+from mindmap_tree import TreeUnusable, normalise_tree
+from prompts import (
+    MINDMAP_EXPLAIN,
+    MINDMAP_GENERATE,
+    PromptTemplate,
+    mindmap_explain_request,
+    mindmap_generate_request,
+)
+import metrics
+from metrics import RequestMetricsMiddleware, observe_stage, request_stage, timed
+from profiling import ProfileMiddleware, ProfileStore
 
 MAX_FILE_SIZE = 5 * 1024 * 1024
 
-app = FastAPI(title="PDF + Image OCR (EasyOCR)")
+# Uploads up to this size stay in memory; bigger ones are spooled to a temp
+# file and memory-mapped, which bounds the heap used per concurrent upload.
+UPLOAD_SPOOL_MAX_SIZE = int(os.environ.get("UPLOAD_SPOOL_MAX_SIZE", str(1024 * 1024)))
+MultiPartParser.spool_max_size = UPLOAD_SPOOL_MAX_SIZE
+
+# PDF limits, checked while extracting so oversized documents stop early
+MAX_PDF_TEXT_CHARS = 3000
+MAX_PDF_PAGES = int(os.environ.get("MAX_PDF_PAGES", "200"))
+
+# Most OCR text returned for one image
+MAX_IMAGE_TEXT_CHARS = 1000
+
+# Batch extraction (/extract/batch): files per request, total request size
+# and total text returned (each file also has the single-file limits), and
+# how many files of one batch are extracted at the same time.
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "20"))
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", str(25 * 1024 * 1024)))
+BATCH_MAX_TEXT_CHARS = int(os.environ.get("BATCH_MAX_TEXT_CHARS", "20000"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+
+# Batch mindmap generation (/mindmap/generate/batch): topics per request and
+# how many of them are generated at the same time (the provider limits of
+# llm_endpoint still apply on top).
+MINDMAP_BATCH_MAX_TOPICS = int(os.environ.get("MINDMAP_BATCH_MAX_TOPICS", "100"))
+MINDMAP_BATCH_CONCURRENCY = int(os.environ.get("MINDMAP_BATCH_CONCURRENCY", "16"))
+
+# PDF pool: worker processes (0 = default thread executor) and the page
+# count from which a document is split across all workers.
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "2"))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "16"))
+
+_LANGS = os.environ.get("EASYOCR_LANGS", "en").split(",")
+API_KEY = os.environ.get('GEMINI_API_KEY')
+
+_use_gpu = bool(int(os.environ.get("EASYOCR_GPU", "0")))
+
+# OCR pool settings: worker processes (0 = run in-process), torch threads per
+# worker and how many jobs may wait for a free worker before we answer 503.
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "1"))
+OCR_TORCH_THREADS = int(os.environ.get("OCR_TORCH_THREADS", "1"))
+OCR_MAX_QUEUE = int(os.environ.get("OCR_MAX_QUEUE", "16"))
+
+# Image pre-processing before OCR: downscale to a maximum long edge (JPEGs
+# decode directly at a reduced scale), optional grayscale / autocontrast and
+# a pixel cap against decompression bombs.
+IMAGE_PREPROCESS = {
+    "max_long_edge": int(os.environ.get("IMAGE_MAX_LONG_EDGE", "2048")),
+    "grayscale": bool(int(os.environ.get("IMAGE_GRAYSCALE", "0"))),
+    "autocontrast": bool(int(os.environ.get("IMAGE_AUTOCONTRAST", "0"))),
+    "max_pixels": int(os.environ.get("IMAGE_MAX_PIXELS", str(50_000_000))),
+}
+
+# Micro-batching: images arriving within the window are OCR'd together.
+# OCR_BATCH_MAX_SIZE=1 disables batching.
+OCR_BATCH_MAX_SIZE = int(os.environ.get("OCR_BATCH_MAX_SIZE", "8"))
+OCR_BATCH_MAX_WAIT_MS = float(os.environ.get("OCR_BATCH_MAX_WAIT_MS", "5"))
+
+# Extraction result cache: in-memory LRU (bounded by bytes) plus an optional
+# SQLite file shared by all workers on the host.
+EXTRACT_CACHE_MAX_BYTES = int(os.environ.get("EXTRACT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EXTRACT_CACHE_DB = os.environ.get("EXTRACT_CACHE_DB")
+EXTRACT_CACHE_DB_MAX_BYTES = int(os.environ.get("EXTRACT_CACHE_DB_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Limits for generated mindmaps: deeper / wider / larger trees are cut
+# down before they reach the canvas, long labels are shortened.
+MINDMAP_MAX_DEPTH = int(os.environ.get("MINDMAP_MAX_DEPTH", "6"))
+MINDMAP_MAX_CHILDREN = int(os.environ.get("MINDMAP_MAX_CHILDREN", "12"))
+MINDMAP_MAX_NODES = int(os.environ.get("MINDMAP_MAX_NODES", "300"))
+MINDMAP_MAX_LABEL_CHARS = int(os.environ.get("MINDMAP_MAX_LABEL_CHARS", "120"))
+
+# LLM response cache for the mindmap endpoints: replies to the same
+# (normalised) request, model and generation settings are reused for
+# LLM_CACHE_TTL_SECONDS. Only fairly deterministic calls are cached:
+# temperature must be at most LLM_CACHE_MAX_TEMPERATURE.
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB")
+LLM_CACHE_DB_MAX_BYTES = int(os.environ.get("LLM_CACHE_DB_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_TEMPERATURE = float(os.environ.get("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+
+# Admission control per endpoint class: requests per second and burst per
+# client address, requests running at once, and how many more may wait for
+# a slot (at most ADMISSION_MAX_WAIT_SECONDS) before we answer 503. Over the
+# rate is 429. 0 turns a limit off.
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "5"))
+ADMISSION = {
+    "ocr": EndpointClass(
+        "ocr",
+        rate=float(os.environ.get("ADMISSION_OCR_RATE", "2")),
+        burst=int(os.environ.get("ADMISSION_OCR_BURST", "10")),
+        max_in_flight=int(os.environ.get("ADMISSION_OCR_MAX_IN_FLIGHT", "8")),
+        max_queue=int(os.environ.get("ADMISSION_OCR_MAX_QUEUE", "16")),
+        max_wait=ADMISSION_MAX_WAIT_SECONDS,
+    ),
+    "pdf": EndpointClass(
+        "pdf",
+        rate=float(os.environ.get("ADMISSION_PDF_RATE", "2")),
+        burst=int(os.environ.get("ADMISSION_PDF_BURST", "10")),
+        max_in_flight=int(os.environ.get("ADMISSION_PDF_MAX_IN_FLIGHT", "8")),
+        max_queue=int(os.environ.get("ADMISSION_PDF_MAX_QUEUE", "16")),
+        max_wait=ADMISSION_MAX_WAIT_SECONDS,
+    ),
+    "batch": EndpointClass(
+        "batch",
+        rate=float(os.environ.get("ADMISSION_BATCH_RATE", "0.5")),
+        burst=int(os.environ.get("ADMISSION_BATCH_BURST", "3")),
+        max_in_flight=int(os.environ.get("ADMISSION_BATCH_MAX_IN_FLIGHT", "4")),
+        max_queue=int(os.environ.get("ADMISSION_BATCH_MAX_QUEUE", "8")),
+        max_wait=ADMISSION_MAX_WAIT_SECONDS,
+    ),
+    "llm": EndpointClass(
+        "llm",
+        rate=float(os.environ.get("ADMISSION_LLM_RATE", "5")),
+        burst=int(os.environ.get("ADMISSION_LLM_BURST", "20")),
+        max_in_flight=int(os.environ.get("ADMISSION_LLM_MAX_IN_FLIGHT", "64")),
+        max_queue=int(os.environ.get("ADMISSION_LLM_MAX_QUEUE", "64")),
+        max_wait=ADMISSION_MAX_WAIT_SECONDS,
+    ),
+    "llm_batch": EndpointClass(
+        "llm_batch",
+        rate=float(os.environ.get("ADMISSION_LLM_BATCH_RATE", "0.2")),
+        burst=int(os.environ.get("ADMISSION_LLM_BATCH_BURST", "2")),
+        max_in_flight=int(os.environ.get("ADMISSION_LLM_BATCH_MAX_IN_FLIGHT", "4")),
+        max_queue=int(os.environ.get("ADMISSION_LLM_BATCH_MAX_QUEUE", "8")),
+        max_wait=ADMISSION_MAX_WAIT_SECONDS,
+    ),
+}
+
+# Every response carries a Server-Timing header with its stage breakdown.
+SERVER_TIMING = bool(int(os.environ.get("SERVER_TIMING", "1")))
+
+# Opt-in profiling for trusted callers: requests with "X-Profile: 1" and
+# X-Profile-Token equal to PROFILE_TOKEN run under a sampling profiler.
+# The folded stacks (flame graph input) are kept in PROFILE_DIR and can be
+# fetched from /debug/profiles/<name in the X-Profile response header>.
+# Without PROFILE_TOKEN profiling is off.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "manaska-profiles"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "100"))
+
+profile_store = ProfileStore(PROFILE_TOKEN, PROFILE_DIR, max_files=PROFILE_MAX_FILES)
+
+extract_cache = ResultCache(
+    "extract",
+    max_bytes=EXTRACT_CACHE_MAX_BYTES,
+    db_path=EXTRACT_CACHE_DB,
+    db_max_bytes=EXTRACT_CACHE_DB_MAX_BYTES,
+)
+
+llm_cache = ResultCache(
+    "llm",
+    max_bytes=LLM_CACHE_MAX_BYTES,
+    db_path=LLM_CACHE_DB,
+    db_max_bytes=LLM_CACHE_DB_MAX_BYTES,
+    ttl=LLM_CACHE_TTL_SECONDS,
+)
+
+llm_flights = SingleFlight("llm")
+
+pdf_pool = PDFPool(workers=PDF_WORKERS, parallel_min_pages=PDF_PARALLEL_MIN_PAGES)
+
+ocr_pool = OCRPool(
+    _LANGS,
+    gpu=_use_gpu,
+    workers=OCR_WORKERS,
+    torch_threads=OCR_TORCH_THREADS,
+    max_queue=OCR_MAX_QUEUE,
+)
+ocr_batcher = OCRBatcher(
+    ocr_pool,
+    max_batch_size=OCR_BATCH_MAX_SIZE,
+    max_wait=OCR_BATCH_MAX_WAIT_MS / 1000,
+)
+
+# executor queue depths, read when /metrics is scraped
+EXECUTOR_PENDING = metrics.Gauge(
+    "executor_pending", "Jobs submitted to an executor and not finished yet (queued + running).", ("executor",)
+)
+EXECUTOR_PENDING.set_function(lambda: ocr_pool.pending, executor="ocr")
+EXECUTOR_PENDING.set_function(lambda: ocr_batcher.queued, executor="ocr_batch_queue")
+EXECUTOR_PENDING.set_function(lambda: pdf_pool.pending, executor="pdf")
+
+EXTRACT_BATCH_FILES = metrics.Counter(
+    "extract_batch_files_total", "Files extracted through /extract/batch, by kind and status.", ("kind", "status")
+)
+MINDMAP_BATCH_TOPICS = metrics.Counter(
+    "mindmap_batch_topics_total", "Topics generated through /mindmap/generate/batch, by status.", ("status",)
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # models load and warm up after startup; /ready tells when OCR can take traffic
+    ocr_pool.load_in_background()
+    pdf_pool.start()
+    yield
+    pdf_pool.shutdown()
+    await close_http_pools()
+    ocr_batcher.shutdown()
+    ocr_pool.shutdown()
+
+
+app = FastAPI(title="PDF + Image OCR (EasyOCR)", lifespan=lifespan)
 
 origins = [
     "http://localhost:3000", 
     "https://manaska.vercel.app"    
 ]
 
+# added before CORS so its 413s still carry CORS headers
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/extract-pdf": MAX_FILE_SIZE,
+        "/extract-image": MAX_FILE_SIZE,
+        "/extract/batch": BATCH_MAX_BYTES,
+    },
+)
+
+# also before CORS, so 429/503 answers reach browsers as well
+app.add_middleware(
+    AdmissionMiddleware,
+    routes={
+        "/extract-image": ADMISSION["ocr"],
+        "/extract-pdf": ADMISSION["pdf"],
+        "/extract/batch": ADMISSION["batch"],
+        "/mindmap/generate": ADMISSION["llm"],
+        "/mindmap/generate/batch": ADMISSION["llm_batch"],
+        "/mindmap/explain": ADMISSION["llm"],
+        "/llm/invoke": ADMISSION["llm"],
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # so the frontend can read the stage breakdown and profile name
+    expose_headers=["Server-Timing", "X-Profile"],
 )
 
-_LANGS = os.environ.get("EASYOCR_LANGS", "en").split(",")
-API_KEY = os.environ.get('GEMINI_API_KEY')
+app.add_middleware(ProfileMiddleware, store=profile_store, interval=PROFILE_INTERVAL_MS / 1000)
+
+# outermost, so requests turned away by the middlewares above are counted too
+app.add_middleware(RequestMetricsMiddleware, server_timing=SERVER_TIMING, timing_allow_origins=origins)
+
 
-_use_gpu = bool(int(os.environ.get("EASYOCR_GPU", "0")))
-reader = easyocr.Reader(_LANGS, gpu=_use_gpu)  # this loads model into memory
 def _extract_json_from_text(text: str) -> str | None:
     """
     Try to extract the first JSON object from a text response.
     Handles cases like:
     - ```json ... ```
-    - plain text before/after the JSON
+    - plain text (even with braces) before/after the JSON
+    - trailing commas, and replies cut off mid-object (see json_extract)
     """
-    if not text:
-        return None
-
-    # If it's already valid JSON, just return it
-    try:
-        json.loads(text)
-        return text
-    except JSONDecodeError:
-        pass
-
-    # Remove markdown code fences if present
-    # e.g. ```json { ... } ``` or ``` { ... } ```
-    fence_match = re.search(r"```(?:json)?(.*)```", text, re.DOTALL | re.IGNORECASE)
-    if fence_match:
-        candidate = fence_match.group(1).strip()
-        try:
-            json.loads(candidate)
-            return candidate
-        except JSONDecodeError:
-            text = candidate  # keep trying below with braces
-
-    # Fallback: take substring between first '{' and last '}'
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        candidate = text[start : end + 1]
-        try:
-            json.loads(candidate)
-            return candidate
-        except JSONDecodeError:
-            return None
+    found = find_json(text, repair=True)
+    return None if found is None else found[1]
 
-    return None
 
 async def _call_llm(
     model: str,
@@ -91,10 +325,33 @@ async def _call_llm(
     messages: List[Dict[str, str]],
     max_tokens: int = 512,
     temperature: float = 0.2,
+    template: PromptTemplate | None = None,
 ) -> str:
     """
     Shared helper to call any configured LLM (OpenAI, Groq, DeepSeek, Gemini)
-    and always return plain text content.
+    and always return plain text content. See _call_llm_answered.
+    """
+    text, _ = await _call_llm_answered(model, api_key, messages, max_tokens, temperature, template)
+    return text
+
+
+async def _call_llm_answered(
+    model: str,
+    api_key: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int = 512,
+    temperature: float = 0.2,
+    template: PromptTemplate | None = None,
+) -> Tuple[str, str]:
+    """
+    Calls the LLM and returns its plain text reply together with the model
+    that gave it: a fallback model when the requested one failed, so its
+    replies are not cached as the requested model's. Concurrent identical
+    calls are coalesced into one upstream request. Rate limits, overload and
+    transport errors are retried with backoff and then handed down the
+    LLM_FALLBACK_MODELS chain (see resilience.call_resilient). Calls built
+    from a prompt template are accounted to it (tokens, prefix cache hits,
+    latency).
     """
     try:
         llm = get_llm(model, api_key, temperature, max_tokens)
@@ -105,16 +362,76 @@ async def _call_llm(
     if not callable(invoke_fn):
         raise HTTPException(status_code=500, detail="LLM has no invoke() method")
 
+    targets = [_llm_target(model, llm, messages)]
+    for fallback in LLM_FALLBACK_MODELS:
+        provider = provider_name(fallback)
+        if fallback == model or provider == "other":
+            continue
+        # a key is only ever sent to its own provider
+        fallback_key = provider_api_key(provider)
+        if fallback_key is None and provider == provider_name(model):
+            fallback_key = api_key
+        if fallback_key is None:
+            continue
+        try:
+            fallback_llm = get_llm(fallback, fallback_key, temperature, max_tokens)
+        except Exception:
+            continue
+        targets.append(_llm_target(fallback, fallback_llm, messages))
+
+    async def call() -> Tuple[str, str]:
+        started = time.perf_counter()
+        try:
+            # native async where the client has it, bounded per provider
+            resp, used = await call_resilient(targets)
+        except ProviderUnavailable as e:
+            retry_after = str(max(1, math.ceil(e.retry_after or 1)))
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": retry_after})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"LLM error: {e}")
+
+        if template is not None:
+            template.record(_usage(resp), time.perf_counter() - started)
+
+        return _extract_text(resp), used.model
+
+    # identical requests already in flight share that call's reply (or error)
+    flight_key = content_key(
+        json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8"),
+        model, api_key, temperature, max_tokens,
+    )
+    return await llm_flights.do(flight_key, call)
+
+
+def _llm_target(model: str, llm, messages: List[Dict[str, str]]) -> LLMTarget:
+    provider = provider_name(model)
+    return LLMTarget(model, provider, lambda: ainvoke_llm(llm, messages, provider))
+
+
+def _stream_llm(
+    model: str,
+    api_key: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int = 512,
+    temperature: float = 0.2,
+    template: PromptTemplate | None = None,
+) -> StreamingResponse:
+    """
+    Like _call_llm, but relays the reply as server-sent events while the
+    provider generates it (see llm_endpoint.stream_llm for the events).
+    """
     try:
-        if inspect.iscoroutinefunction(invoke_fn):
-            resp = await invoke_fn(messages)
-        else:
-            loop = asyncio.get_running_loop()
-            resp = await loop.run_in_executor(None, lambda: invoke_fn(messages))
+        llm = get_llm(model, api_key, temperature, max_tokens)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"LLM error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        on_done = None if template is None else (lambda stream: template.record(stream.usage, stream.elapsed))
+        events = stream_llm(llm, messages, provider_name(model), model, on_done)
+    except LLMBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
-    return _extract_text(resp)
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 class MindmapGenerateRequest(BaseModel):
@@ -123,50 +440,159 @@ class MindmapGenerateRequest(BaseModel):
     topic: str          # topic or whole text you want to convert into mindmap
     max_tokens: int = 800
     temperature: float = 0.2
+    stream: bool = False    # send nodes as server-sent events while the tree is generated
+    bypass_cache: bool = False    # always ask the LLM (the fresh reply still refreshes the cache)
+
+
+class MindmapBatchRequest(BaseModel):
+    model: str
+    api_key: str
+    topics: List[str]   # one mindmap per topic (or text)
+    max_tokens: int = 800
+    temperature: float = 0.2
+    stream: bool = False    # send each tree as a server-sent event as soon as it is ready
+    bypass_cache: bool = False    # always ask the LLM (the fresh reply still refreshes the cache)
 
 
 class MindmapExplainRequest(BaseModel):
     model: str
     api_key: str
-    mindmap: str
+    mindmap: Dict[str, Any] | str     # tree object, or the tree already serialised as JSON
     question: str | None = None
     max_tokens: int = 800
     temperature: float = 0.2
+    stream: bool = False    # reply as server-sent events instead of one JSON body
+    bypass_cache: bool = False    # always ask the LLM (the fresh reply still refreshes the cache)
+
+
+def _llm_cache_key(template: PromptTemplate, user_content: str, body, *settings) -> str | None:
+    """
+    Response cache key for a templated call, or None when the call is too
+    random to cache. Whitespace and case in the request are normalised so
+    "Photosynthesis" and " photosynthesis" share an entry. settings are
+    whatever else shaped the cached value (e.g. the mindmap limits).
+    """
+    if body.temperature > LLM_CACHE_MAX_TEMPERATURE:
+        return None
+    normalised = " ".join(user_content.split()).casefold()
+    return content_key(
+        normalised.encode("utf-8"),
+        "llm", template.name, template.fingerprint, body.model, body.temperature, body.max_tokens, *settings,
+    )
+
+
+async def _cached_reply(cache_key: str | None, bypass: bool):
+    if cache_key is None or bypass:
+        return None
+    return await llm_cache.get(cache_key)
+
+
+def _observe_upload_read(request: Request):
+    # from the start of the request (RequestMetricsMiddleware) until the upload is received and spooled
+    started = request.scope.get("state", {}).get("request_started")
+    if started is not None:
+        observe_stage("upload_read", time.perf_counter() - started)
+
+
+async def _extract_pdf_text(data, page_spec: str) -> Dict[str, str]:
+    """
+    Cached PDF extraction: {"text": ...}, or {"error": ...} when the
+    document is over the page/text limits.
+    """
+    # same bytes + same extraction settings and limits -> same result (text
+    # or "too large"); entries outlive restarts, so changed limits must miss
+    cache_key = content_key(data, "pdf", "text", page_spec, MAX_PDF_PAGES, MAX_PDF_TEXT_CHARS)
+    cached = await extract_cache.get(cache_key)
+
+    if cached is None:
+        try:
+            # parsed in the PDF pool, off the event loop
+            text = await pdf_pool.extract(data, page_spec, MAX_PDF_TEXT_CHARS, MAX_PDF_PAGES)
+            cached = {"text": text}
+        except PDFOpenError as e:
+            raise HTTPException(status_code=400, detail=f"Unable to open PDF: {e}")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except PDFTooLarge as e:
+            cached = {"error": str(e)}
+        except PDFPoolBroken as e:
+            raise HTTPException(
+                status_code=503,
+                detail=f"PDF parsing is unavailable, try again later: {e}",
+                headers={"Retry-After": "1"},
+            )
+        await extract_cache.set(cache_key, cached)
+
+    return cached
+
+
+async def _ocr_image(upload: Upload) -> str:
+    """
+    Cached OCR of an uploaded image.
+    """
+    cache_key = content_key(upload.data, "image", _LANGS, IMAGE_PREPROCESS)
+    text = await extract_cache.get(cache_key)
+
+    if text is None:
+        loop = asyncio.get_running_loop()
+        try:
+            # decode + downscale on the default executor (EasyOCR expects numpy array)
+            arr, timings = await loop.run_in_executor(
+                None, lambda: preprocess_image(upload.stream(), **IMAGE_PREPROCESS)
+            )
+            # per-stage metrics are recorded by preprocess_image itself
+            request_stage("image_decode", sum(timings.values()))
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Unable to open image: {e}")
+
+        try:
+            # detail=0 -> returns list of strings; batched and run in the OCR pool
+            started = time.perf_counter()
+            results: List[str] = await ocr_batcher.readtext(arr)
+            request_stage("ocr", time.perf_counter() - started)
+        except OCRQueueFull:
+            raise HTTPException(
+                status_code=503,
+                detail="OCR is busy, try again later.",
+                headers={"Retry-After": "1"},
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OCR failed: {e}")
+
+        text = "\n".join(results).strip()
+        await extract_cache.set(cache_key, text)
+
+    return text
 
 
 @app.post("/extract-pdf")
-async def extract_pdf(request: Request, file: UploadFile = File(...)) -> Dict[str, str]:
+async def extract_pdf(
+    request: Request,
+    file: UploadFile = File(...),
+    pages: str | None = None,
+) -> Dict[str, str]:
     """
     Accepts a PDF upload and returns its extracted text (concatenated pages).
+    `pages` optionally selects 1-based pages, e.g. "1-5", "3,7" or "10-".
+    The request size is capped by UploadLimitMiddleware while it streams in.
     """
 
-    cl = request.headers.get("content-length")
-    if cl and int(cl) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail="File too large")
-
     if file.content_type not in ("application/pdf", "application/octet-stream"):
         raise HTTPException(status_code=400, detail="File must be a PDF.")
 
-    data = await file.read()
+    upload = await read_upload(file, MAX_FILE_SIZE)
+    _observe_upload_read(request)
     try:
-        doc = fitz.open(stream=data, filetype="pdf")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Unable to open PDF: {e}")
+        cached = await _extract_pdf_text(upload.data, (pages or "").replace(" ", ""))
+    finally:
+        upload.close()
 
-    pages: List[str] = []
-    for i, page in enumerate(doc, start=1):
-        try:
-            text = page.get_text("text")
-        except Exception:
-            text = page.get_text()
-        pages.append(text.strip())
+    if "error" in cached:
+        raise HTTPException(status_code=413, detail=cached["error"])
 
-    full_text = "\n\n".join(p for p in pages if p)
-    
-    if len(full_text) > 3000:
-        raise HTTPException(status_code=413, detail="File content too large.")
-
-    return JSONResponse({"filename": file.filename, "text": full_text})
+    return JSONResponse({"filename": file.filename, "text": cached["text"]})
 
 
 @app.post("/extract-image")
@@ -174,42 +600,126 @@ async def extract_image(request: Request, file: UploadFile = File(...)) -> Dict[
     """
     Accepts an image upload and returns OCR text detected by EasyOCR.
     Supports common image types: jpeg, png, bmp, tiff, webp.
+    The request size is capped by UploadLimitMiddleware while it streams in.
     """
- 
-    cl = request.headers.get("content-length")
-    if cl and int(cl) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail="File too large")
 
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image.")
 
-    image_bytes = await file.read()
+    upload = await read_upload(file, MAX_FILE_SIZE)
+    _observe_upload_read(request)
     try:
-        # Load image and convert to RGB (EasyOCR expects numpy array)
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Unable to open image: {e}")
+        text = await _ocr_image(upload)
+    finally:
+        upload.close()
+
+    if len(text) > MAX_IMAGE_TEXT_CHARS:
+        raise HTTPException(status_code=413, detail="File content too large.")
+
+    return JSONResponse({"filename": file.filename, "text": text})
+
+
+@app.post("/extract/batch")
+async def extract_batch(request: Request, files: List[UploadFile] = File(...)) -> StreamingResponse:
+    """
+    Accepts several PDFs and/or images in one multipart request (field
+    "files") and extracts them concurrently, streaming one server-sent
+    "file" event per file as it finishes:
+
+        {"index": 2, "filename": "b.png", "kind": "image", "status": 200, "text": "..."}
+
+    A file that fails carries "status" (as the single-file endpoint would
+    answer) and "error" instead of "text"; the others are unaffected. A
+    final "done" event counts files, errors and the text returned. Each
+    file has the limits of /extract-pdf and /extract-image; on top, the
+    request is capped at BATCH_MAX_BYTES and the texts returned at
+    BATCH_MAX_TEXT_CHARS in total (files past that get a 413).
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} files per batch.")
+
+    _observe_upload_read(request)
+    return StreamingResponse(_batch_events(files), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def _batch_kind(file: UploadFile) -> str | None:
+    content_type = file.content_type or ""
+    if content_type == "application/pdf":
+        return "pdf"
+    if content_type.startswith("image/"):
+        return "image"
+    if content_type == "application/octet-stream" and (file.filename or "").lower().endswith(".pdf"):
+        return "pdf"
+    return None
+
 
-    arr = np.array(img)
+async def _extract_batch_file(index: int, file: UploadFile) -> Dict[str, Any]:
+    kind = _batch_kind(file)
+    result = {"index": index, "filename": file.filename, "kind": kind}
+    if kind is None:
+        return {**result, "status": 400, "error": "File must be a PDF or an image."}
 
     try:
-        # detail=0 -> returns list of strings; adjust if you want bounding boxes
-        results: List[str] = reader.readtext(arr, detail=0)
+        upload = await read_upload(file, MAX_FILE_SIZE)
+        try:
+            if kind == "pdf":
+                cached = await _extract_pdf_text(upload.data, "")
+                if "error" in cached:
+                    raise HTTPException(status_code=413, detail=cached["error"])
+                text = cached["text"]
+            else:
+                text = await _ocr_image(upload)
+                if len(text) > MAX_IMAGE_TEXT_CHARS:
+                    raise HTTPException(status_code=413, detail="File content too large.")
+        finally:
+            upload.close()
+    except HTTPException as e:
+        return {**result, "status": e.status_code, "error": e.detail}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OCR failed: {e}")
+        return {**result, "status": 500, "error": f"Extraction failed: {e}"}
 
-    text = "\n".join(results).strip()
- 
-    if len(text) > 1000:
-        raise HTTPException(status_code=413, detail="File content too large.")
+    return {**result, "status": 200, "text": text}
 
-    return JSONResponse({"filename": file.filename, "text": text})
+
+async def _batch_events(files: List[UploadFile]):
+    # BATCH_CONCURRENCY files at a time, so one batch cannot fill the OCR queue by itself
+    slots = asyncio.Semaphore(max(BATCH_CONCURRENCY, 1))
+
+    async def run(index: int, file: UploadFile):
+        async with slots:
+            return await _extract_batch_file(index, file)
+
+    tasks = [asyncio.ensure_future(run(i, f)) for i, f in enumerate(files)]
+    text_chars = 0
+    errors = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if "text" in result:
+                if text_chars + len(result["text"]) > BATCH_MAX_TEXT_CHARS:
+                    result = {k: v for k, v in result.items() if k != "text"}
+                    result.update(status=413, error="Batch text limit reached.")
+                else:
+                    text_chars += len(result["text"])
+
+            errors += "error" in result
+            EXTRACT_BATCH_FILES.inc(kind=result["kind"] or "other", status=str(result["status"]))
+            yield sse_event("file", result)
+    finally:
+        # the client went away: stop the files not extracted yet
+        for task in tasks:
+            task.cancel()
+
+    yield sse_event("done", {"files": len(files), "errors": errors, "text_chars": text_chars})
 
 
 @app.post("/mindmap/generate")
 async def generate_mindmap(body: MindmapGenerateRequest):
     """
     Generate a tree-style mindmap JSON from a topic or paragraph.
+    With "stream": true the nodes arrive as server-sent events while the
+    tree is being generated. Other requests may be answered from the LLM
+    response cache (see LLM_CACHE_*).
 
     Schema:
 
@@ -234,423 +744,255 @@ async def generate_mindmap(body: MindmapGenerateRequest):
     }
     """
 
-    system_prompt = """
-You are a mindmap generator for an educational app.
+    if body.stream:
+        messages = MINDMAP_GENERATE.messages(mindmap_generate_request(body.topic))
+        try:
+            llm = get_llm(body.model, API_KEY, body.temperature, body.max_tokens)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            stream = LLMStream(llm, messages, provider_name(body.model))
+        except LLMBusy as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        return StreamingResponse(
+            _mindmap_events(stream, body.model, MINDMAP_GENERATE),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
 
-You ALWAYS answer with ONLY valid JSON (no markdown, no comments, no backticks).
+    return {"mindmap": await _generate_mindmap(body.topic, body)}
 
-Target schema (tree):
 
-{
-  "id": "root",
-  "label": string,
-  "children": [
-    {
-      "id": string,
-      "label": string,
-      "relation": string,   # 1–2 word arrow label describing relationship from parent to child
-      "children": [
-        { "id": string, "label": string, "relation": string, "children": [] }
-      ]
-    }
-  ]
-}
+async def _generate_mindmap(topic: str, body) -> Dict[str, Any]:
+    """
+    Normalised mindmap for one topic, from the LLM response cache or a
+    (non-streamed) LLM call. Raises HTTPException like the endpoint.
+    """
+    user_content = mindmap_generate_request(topic)
+    # the cached tree is already cut to the limits; entries outlive restarts,
+    # so changed limits must miss
+    cache_key = _llm_cache_key(
+        MINDMAP_GENERATE, user_content, body,
+        MINDMAP_MAX_DEPTH, MINDMAP_MAX_CHILDREN, MINDMAP_MAX_NODES, MINDMAP_MAX_LABEL_CHARS,
+    )
 
-Before you answer:
-1. Silently think step by step about:
-   - What is the main topic?
-   - 4–8 key subtopics.
-   - 1–4 concise details for each subtopic.
-   - For each child node choose a 1–2 word relationship label (e.g., "uses", "contains", "is a", "helps", "requires", "explains").
-2. Organize them into 2–3 levels of depth (root → subtopics → details).
-3. Then output ONLY the final JSON.
-""".strip()
-
-    # --- Few-shot examples (two examples) ---
-    example_topic_1 = "Basics of Computer Networks"
-
-    example_assistant_1 = {
-        "id": "root",
-        "label": "Computer Networks",
-        "children": [
-            {
-                "id": "n1",
-                "label": "Key Concepts",
-                "relation": "covers",
-                "children": [
-                    { "id": "n1a", "label": "Nodes (hosts, routers, switches)", "relation": "are", "children": [] },
-                    { "id": "n1b", "label": "Links (wired, wireless)", "relation": "connect", "children": [] }
-                ]
-            },
-            {
-                "id": "n2",
-                "label": "Layers (OSI view)",
-                "relation": "organizes",
-                "children": [
-                    { "id": "n2a", "label": "Physical + Data Link", "relation": "include", "children": [] },
-                    { "id": "n2b", "label": "Network (IP)", "relation": "routes", "children": [] },
-                    { "id": "n2c", "label": "Transport (TCP/UDP)", "relation": "ensures", "children": [] }
-                ]
-            }
-        ]
-    }
+    cached = await _cached_reply(cache_key, body.bypass_cache)
+    if cached is not None:
+        return cached
 
-    example_topic_2 = "Introduction to Machine Learning"
+    reply, answered_by = await _call_llm_answered(
+        model=body.model,
+        api_key=API_KEY,
+        messages=MINDMAP_GENERATE.messages(user_content),
+        max_tokens=body.max_tokens,
+        temperature=body.temperature,
+        template=MINDMAP_GENERATE,
+    )
 
-    # Bigger / wider example for second few-shot
-    example_assistant_2 = {
-        "id": "root",
-        "label": "Machine Learning",
-        "children": [
-            {
-                "id": "m1",
-                "label": "Learning Types",
-                "relation": "includes",
-                "children": [
-                    { "id": "m1a", "label": "Supervised Learning", "relation": "uses", "children": [
-                        { "id": "m1a1", "label": "Regression", "relation": "predicts", "children": [] },
-                        { "id": "m1a2", "label": "Classification", "relation": "labels", "children": [] }
-                    ]},
-                    { "id": "m1b", "label": "Unsupervised Learning", "relation": "finds", "children": [
-                        { "id": "m1b1", "label": "Clustering", "relation": "groups", "children": [] },
-                        { "id": "m1b2", "label": "Dimensionality Reduction", "relation": "reduces", "children": [] }
-                    ]},
-                    { "id": "m1c", "label": "Reinforcement Learning", "relation": "trains", "children": [
-                        { "id": "m1c1", "label": "Agent-Environment", "relation": "interacts", "children": [] }
-                    ]}
-                ]
-            },
-            {
-                "id": "m2",
-                "label": "Algorithms",
-                "relation": "provides",
-                "children": [
-                    { "id": "m2a", "label": "Linear Models (Linear/Logistic)", "relation": "fit", "children": [] },
-                    { "id": "m2b", "label": "Tree-based (Decision Trees, RF)", "relation": "split", "children": [] },
-                    { "id": "m2c", "label": "SVM", "relation": "separates", "children": [] },
-                    { "id": "m2d", "label": "Neural Networks", "relation": "approximate", "children": [] }
-                ]
-            },
-            {
-                "id": "m3",
-                "label": "Model Evaluation",
-                "relation": "measures",
-                "children": [
-                    { "id": "m3a", "label": "Metrics (Accuracy, RMSE)", "relation": "use", "children": [] },
-                    { "id": "m3b", "label": "Validation (Cross-val)", "relation": "prevents", "children": [] },
-                    { "id": "m3c", "label": "Bias-Variance Tradeoff", "relation": "balances", "children": [] }
-                ]
-            },
-            {
-                "id": "m4",
-                "label": "Data",
-                "relation": "requires",
-                "children": [
-                    { "id": "m4a", "label": "Feature Engineering", "relation": "creates", "children": [] },
-                    { "id": "m4b", "label": "Data Cleaning", "relation": "fixes", "children": [] },
-                    { "id": "m4c", "label": "Datasets (Train/Test/Val)", "relation": "split", "children": [] }
-                ]
-            },
-            {
-                "id": "m5",
-                "label": "Deployment",
-                "relation": "enables",
-                "children": [
-                    { "id": "m5a", "label": "Model Serving", "relation": "delivers", "children": [] },
-                    { "id": "m5b", "label": "Monitoring", "relation": "tracks", "children": [] },
-                    { "id": "m5c", "label": "Versioning", "relation": "controls", "children": [] }
-                ]
-            }
-        ]
-    }
+    mindmap, _ = _normalise_mindmap(_parse_mindmap_reply(reply))
 
-    example_user_msg_1 = f"Create a mindmap in the required JSON tree schema for this topic:\n\n{example_topic_1}"
-    example_user_msg_2 = f"Create a mindmap in the required JSON tree schema for this topic:\n\n{example_topic_2}"
+    # only usable (normalised) trees from the requested model are cached
+    if cache_key is not None and answered_by == body.model:
+        await llm_cache.set(cache_key, mindmap)
 
-    user_prompt = f"""
-Create a mindmap in the required JSON tree schema for this topic or content:
+    return mindmap
 
-{body.topic}
-""".strip()
 
-    messages = [
-        {"role": "system", "content": system_prompt},
+@app.post("/mindmap/generate/batch")
+async def generate_mindmap_batch(body: MindmapBatchRequest):
+    """
+    Generate one mindmap per topic (e.g. a whole syllabus) in one request.
+    Up to MINDMAP_BATCH_CONCURRENCY topics are generated at once, all with
+    the same precomputed prompt prefix, so a batch takes about as long as
+    its slowest calls rather than the sum of them. Repeated topics and
+    topics generated before are answered once / from the cache.
+
+    Every topic gets a result with its "index", "topic" and "status": the
+    normalised "mindmap" (200), or an "error" with the status the single
+    endpoint would have answered. Without "stream" the reply is
+    {"results": [...in topic order], "errors": n}; with it, each result is
+    a server-sent "item" event as soon as it is ready, then a "done" event.
+    """
+    if len(body.topics) > MINDMAP_BATCH_MAX_TOPICS:
+        raise HTTPException(status_code=413, detail=f"At most {MINDMAP_BATCH_MAX_TOPICS} topics per batch.")
 
-        # few-shot pair 1
-        {"role": "user", "content": example_user_msg_1},
-        {"role": "assistant", "content": json.dumps(example_assistant_1, ensure_ascii=False)},
+    # an unknown model fails the whole batch up front, not every topic
+    try:
+        get_llm(body.model, API_KEY, body.temperature, body.max_tokens)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # few-shot pair 2 (larger/wider example)
-        {"role": "user", "content": example_user_msg_2},
-        {"role": "assistant", "content": json.dumps(example_assistant_2, ensure_ascii=False)},
+    if body.stream:
+        return StreamingResponse(_mindmap_batch_events(body), media_type="text/event-stream", headers=SSE_HEADERS)
 
-        # real request
-        {"role": "user", "content": user_prompt},
-    ]
+    results = [result async for result in _mindmap_batch_results(body)]
+    results.sort(key=lambda result: result["index"])
+    return {"results": results, "errors": sum("error" in result for result in results)}
 
-    reply = await _call_llm(
-        model=body.model,
-        api_key=API_KEY,
-        messages=messages,
-        max_tokens=body.max_tokens,
-        temperature=body.temperature,
-    )
 
+async def _mindmap_batch_results(body: MindmapBatchRequest):
+    # results in completion order
+    slots = asyncio.Semaphore(max(MINDMAP_BATCH_CONCURRENCY, 1))
+
+    async def run(index: int, topic: str) -> Dict[str, Any]:
+        result = {"index": index, "topic": topic}
+        if not topic.strip():
+            return {**result, "status": 400, "error": "Empty topic."}
+        async with slots:
+            try:
+                return {**result, "status": 200, "mindmap": await _generate_mindmap(topic, body)}
+            except HTTPException as e:
+                return {**result, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                return {**result, "status": 500, "error": f"Generation failed: {e}"}
+
+    tasks = [asyncio.ensure_future(run(i, topic)) for i, topic in enumerate(body.topics)]
     try:
-        mindmap = json.loads(reply)
-    except JSONDecodeError:
-        cleaned = _extract_json_from_text(reply)
-        if not cleaned:
-            raise HTTPException(
-                status_code=500,
-                detail="LLM did not return valid JSON for mindmap.",
-            )
-        mindmap = json.loads(cleaned)
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            MINDMAP_BATCH_TOPICS.inc(status=str(result["status"]))
+            yield result
+    finally:
+        # the client went away: stop the topics not generated yet
+        for task in tasks:
+            task.cancel()
+
+
+async def _mindmap_batch_events(body: MindmapBatchRequest):
+    errors = 0
+    async for result in _mindmap_batch_results(body):
+        errors += "error" in result
+        yield sse_event("item", result)
+    yield sse_event("done", {"topics": len(body.topics), "errors": errors})
+
+
+def _parse_mindmap_reply(reply: str):
+    # one scan of the reply; repairs trailing commas and truncated trees
+    with timed("json_extract"):
+        found = find_json(reply, repair=True)
+    if found is None:
+        raise HTTPException(
+            status_code=500,
+            detail="LLM did not return valid JSON for mindmap.",
+        )
+    return found[0]
+
 
-    if not isinstance(mindmap, dict) or "id" not in mindmap or "label" not in mindmap or "children" not in mindmap:
+def _normalise_mindmap(mindmap) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """
+    The tree with ids, fields, size and labels fixed up, and the fixes
+    made (see mindmap_tree.normalise_tree); 500 only when it has no usable
+    root.
+    """
+    try:
+        with timed("mindmap_normalise"):
+            tree, fixes = normalise_tree(
+                mindmap,
+                max_depth=MINDMAP_MAX_DEPTH,
+                max_children=MINDMAP_MAX_CHILDREN,
+                max_nodes=MINDMAP_MAX_NODES,
+                max_label_chars=MINDMAP_MAX_LABEL_CHARS,
+            )
+    except TreeUnusable:
         raise HTTPException(
             status_code=500,
             detail="Mindmap JSON has unexpected structure.",
         )
+    return tree, fixes
 
-    return {"mindmap": mindmap}
 
-
-@app.post("/mindmap/explain")
-async def explain_mindmap(body: MindmapExplainRequest):
+async def _mindmap_events(stream: LLMStream, model: str, template: PromptTemplate):
     """
-    Explain an existing tree-style mindmap to the user in simple language.
+    Server-sent events for a streamed /mindmap/generate: a "node" event
+    (id, label, relation, parent_id) for every node as soon as the reply
+    has described it, then "done" with the validated tree, usage and
+    timing, or "error" with the same details the JSON endpoint gives.
+    Streamed nodes are already cut to the mindmap limits and carry the ids
+    of the final tree. When the tree still needed fixing, or the reply had
+    to be recovered from its full text, "done" has "replaces_nodes": true
+    and its tree replaces the streamed nodes.
     """
+    parser = TreeStreamParser(
+        max_depth=MINDMAP_MAX_DEPTH,
+        max_children=MINDMAP_MAX_CHILDREN,
+        max_nodes=MINDMAP_MAX_NODES,
+        max_label_chars=MINDMAP_MAX_LABEL_CHARS,
+    )
+    parsing = True
+    parts: List[str] = []
 
-    system_prompt = """
-You are a tutor who explains mindmaps in a clear, friendly way.
-
-Mindmap schema (tree):
+    try:
+        async for text in stream:
+            parts.append(text)
+            if not parsing:
+                continue
+            try:
+                for node in parser.feed(text):
+                    yield sse_event("node", node)
+            except StreamParseError:
+                # not clean JSON; the full text still gets the usual recovery below
+                parsing = False
+    except Exception as e:
+        yield sse_event("error", {"detail": f"LLM error: {e}"})
+        return
+    template.record(stream.usage, stream.elapsed)
 
-{
-  "id": "root",
-  "label": string,
-  "children": [
-    {
-      "id": string,
-      "label": string,
-      "relation": string,    # OPTIONAL: a 1-2 word arrow label describing relationship from parent to this child
-      "children": [ ... node schema recursively ... ]
-    }
-  ]
-}
+    # the parser already gave every node its final id; a reply it could not
+    # follow is parsed again from scratch, so the streamed nodes are replaced
+    streamed = parsing and parser.done
+    try:
+        mindmap = parser.result() if streamed else _parse_mindmap_reply("".join(parts))
+        mindmap, fixes = _normalise_mindmap(mindmap)
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail})
+        return
 
-Before answering:
-1. Silently analyze the tree: root topic, main branches, relationships (the "relation" field on children), and important leaves.
-2. Plan a logical explanation: overview → main branches → key details. When a child node has a "relation" field, briefly incorporate that 1–2 word relationship into the explanation (for example: "Layer X — routes network traffic").
-3. Then write the explanation as plain text. Do NOT use Markdown, headings, bold, italics, bullets using asterisks, or other Markdown markers (no '#', '*', '```', or '**'). Use simple paragraphs and plain hyphenated lists where helpful.
-4. Use simple language, as if teaching a student.
-
-Do NOT modify the given JSON. Only explain it.
-""".strip()
-
-    # --- Few-shot examples (three examples: two minimal, one bigger/wider) ---
-    # Example 1 (minimal)
-    example_mindmap_1 = {
-        "id": "root",
-        "label": "HTTP Basics",
-        "children": [
-            {
-                "id": "h1",
-                "label": "Request-Response",
-                "relation": "follows",
-                "children": []
-            },
-            {
-                "id": "h2",
-                "label": "Methods",
-                "relation": "include",
-                "children": [
-                    {"id": "h2a", "label": "GET", "relation": "retrieves", "children": []},
-                    {"id": "h2b", "label": "POST", "relation": "submits", "children": []}
-                ]
-            }
-        ]
-    }
-    example_question_1 = "Explain this as if I'm new to web development."
-    example_user_1 = (
-        "Here is the mindmap JSON:\n\n"
-        + json.dumps(example_mindmap_1, ensure_ascii=False, indent=2)
-        + "\n\nUser question:\n"
-        + example_question_1
-    )
-    example_answer_1 = """
-Overview
+    done = {"mindmap": mindmap, "model": model, **stream.summary()}
+    # any fix may make the final tree differ from what was streamed
+    if not streamed or fixes:
+        done["replaces_nodes"] = True
+    yield sse_event("done", done)
 
-This mindmap is about HTTP Basics, the core idea behind web communication.
 
-Request-Response
-- HTTP works as a request-response model: the client sends a request and the server replies. (Relation: follows)
+@app.post("/mindmap/explain")
+async def explain_mindmap(body: MindmapExplainRequest):
+    """
+    Explain an existing tree-style mindmap to the user in simple language.
+    With "stream": true the explanation arrives as server-sent events;
+    other requests may be answered from the LLM response cache.
+    """
 
-Methods
-- The Methods branch lists common HTTP methods. (Relation: include)
-- GET — used to retrieve data from the server. (Relation: retrieves)
-- POST — used to submit data to the server (for example, form submissions). (Relation: submits)
+    user_content = mindmap_explain_request(body.mindmap, body.question)
+    messages = MINDMAP_EXPLAIN.messages(user_content)
+    cache_key = _llm_cache_key(MINDMAP_EXPLAIN, user_content, body)
+
+    if body.stream:
+        return _stream_llm(
+            model=body.model,
+            api_key=API_KEY,
+            messages=messages,
+            max_tokens=body.max_tokens,
+            temperature=body.temperature,
+            template=MINDMAP_EXPLAIN,
+        )
 
-Quick tip
-- Remember: GET is for reading, POST is for sending or creating.
-""".strip()
+    cached = await _cached_reply(cache_key, body.bypass_cache)
+    if cached is not None:
+        return {"explanation": cached}
 
-    # Example 2 (minimal)
-    example_mindmap_2 = {
-        "id": "root",
-        "label": "Git Basics",
-        "children": [
-            {
-                "id": "g1",
-                "label": "Workflow",
-                "relation": "follows",
-                "children": [
-                    {"id": "g1a", "label": "Clone", "relation": "creates", "children": []},
-                    {"id": "g1b", "label": "Commit", "relation": "records", "children": []},
-                    {"id": "g1c", "label": "Push", "relation": "sends", "children": []}
-                ]
-            }
-        ]
-    }
-    example_question_2 = "Explain this to a beginner who has never used version control."
-    example_user_2 = (
-        "Here is the mindmap JSON:\n\n"
-        + json.dumps(example_mindmap_2, ensure_ascii=False, indent=2)
-        + "\n\nUser question:\n"
-        + example_question_2
-    )
-    example_answer_2 = """
-Overview
-
-This mindmap covers Git Basics, a common version control workflow.
-
-Workflow
-- The Workflow node outlines typical steps. (Relation: follows)
-- Clone — creates a local copy of a repository from a remote. (Relation: creates)
-- Commit — records your changes locally with a message. (Relation: records)
-- Push — sends commits from your local repo to the remote repository. (Relation: sends)
-
-Quick tip
-- Think of clone → commit → push as: copy, save locally, then upload.
-""".strip()
-
-    # Example 3 (bigger / wider)
-    example_mindmap_3 = {
-        "id": "root",
-        "label": "Machine Learning Overview",
-        "children": [
-            {
-                "id": "m1",
-                "label": "Types",
-                "relation": "includes",
-                "children": [
-                    {"id": "m1a", "label": "Supervised", "relation": "uses", "children": [
-                        {"id": "m1a1", "label": "Regression", "relation": "predicts", "children": []},
-                        {"id": "m1a2", "label": "Classification", "relation": "labels", "children": []}
-                    ]},
-                    {"id": "m1b", "label": "Unsupervised", "relation": "finds", "children": [
-                        {"id": "m1b1", "label": "Clustering", "relation": "groups", "children": []},
-                        {"id": "m1b2", "label": "Dimensionality Reduction", "relation": "reduces", "children": []}
-                    ]},
-                    {"id": "m1c", "label": "Reinforcement", "relation": "trains", "children": []}
-                ]
-            },
-            {
-                "id": "m2",
-                "label": "Pipeline",
-                "relation": "comprises",
-                "children": [
-                    {"id": "m2a", "label": "Data Collection", "relation": "gathers", "children": []},
-                    {"id": "m2b", "label": "Preprocessing", "relation": "cleans", "children": []},
-                    {"id": "m2c", "label": "Modeling", "relation": "fits", "children": []},
-                    {"id": "m2d", "label": "Evaluation", "relation": "measures", "children": []},
-                    {"id": "m2e", "label": "Deployment", "relation": "serves", "children": []}
-                ]
-            },
-            {
-                "id": "m3",
-                "label": "Algorithms",
-                "relation": "provide",
-                "children": [
-                    {"id": "m3a", "label": "Linear Models", "relation": "fit", "children": []},
-                    {"id": "m3b", "label": "Decision Trees", "relation": "split", "children": []},
-                    {"id": "m3c", "label": "Neural Networks", "relation": "approximate", "children": []}
-                ]
-            }
-        ]
-    }
-    example_question_3 = "Explain this as an overview for someone learning ML for the first time."
-    example_user_3 = (
-        "Here is the mindmap JSON:\n\n"
-        + json.dumps(example_mindmap_3, ensure_ascii=False, indent=2)
-        + "\n\nUser question:\n"
-        + example_question_3
-    )
-    example_answer_3 = """
-Overview
-
-This mindmap gives a broad overview of Machine Learning, covering types, pipeline, and algorithms.
-
-1. Types (includes)
-- Supervised (Relation: uses) — learning with labeled data.
-  - Regression (Relation: predicts) — predicts numeric values.
-  - Classification (Relation: labels) — assigns categories.
-- Unsupervised (Relation: finds) — discovering patterns without labels.
-  - Clustering (Relation: groups) — groups similar items.
-  - Dimensionality Reduction (Relation: reduces) — simplifies features.
-- Reinforcement (Relation: trains) — learning by interacting with an environment using rewards.
-
-2. Pipeline (comprises)
-- Data Collection (Relation: gathers) — gather raw data.
-- Preprocessing (Relation: cleans) — clean and prepare data.
-- Modeling (Relation: fits) — fit algorithms to data.
-- Evaluation (Relation: measures) — measure performance with metrics.
-- Deployment (Relation: serves) — serve the trained model to users.
-
-3. Algorithms (provide)
-- Linear Models (Relation: fit) — simple and interpretable.
-- Decision Trees (Relation: split) — split data by features.
-- Neural Networks (Relation: approximate) — approximate complex functions.
-
-Final note
-- The short relation labels act like small arrow labels that summarize how nodes relate.
-""".strip()
-
-    # Build user content for the real request
-    user_content = "Here is the mindmap JSON:\n\n"
-    user_content += json.dumps(body.mindmap, ensure_ascii=False, indent=2)
-
-    if body.question:
-        user_content += "\n\nUser question:\n" + body.question
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-
-        # few-shot example 1 (minimal)
-        {"role": "user", "content": example_user_1},
-        {"role": "assistant", "content": example_answer_1},
-
-        # few-shot example 2 (minimal)
-        {"role": "user", "content": example_user_2},
-        {"role": "assistant", "content": example_answer_2},
-
-        # few-shot example 3 (bigger / wider)
-        {"role": "user", "content": example_user_3},
-        {"role": "assistant", "content": example_answer_3},
-
-        # real request
-        {"role": "user", "content": user_content},
-    ]
-
-    explanation = await _call_llm(
+    explanation, answered_by = await _call_llm_answered(
         model=body.model,
         api_key=API_KEY,
         messages=messages,
         max_tokens=body.max_tokens,
         temperature=body.temperature,
+        template=MINDMAP_EXPLAIN,
     )
 
+    # a fallback model's reply is not the requested model's to cache
+    if cache_key is not None and explanation and answered_by == body.model:
+        await llm_cache.set(cache_key, explanation)
+
     return {"explanation": explanation}
 
 # --- new LLM endpoint ---
@@ -659,3 +1001,49 @@ app.include_router(llm_router, prefix="/llm")
 @app.get("/health")
 def health():
     return {"status": "ok", "easyocr_langs": _LANGS, "easyocr_gpu": _use_gpu}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profiles/{name}")
+def get_profile(name: str, request: Request):
+    """
+    A stored profile in folded-stack format, for profiling callers only.
+    """
+    if not profile_store.authorised(request.scope.get("headers", [])):
+        raise HTTPException(status_code=404, detail="Not found")
+    folded = profile_store.load(name)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return PlainTextResponse(folded)
+
+
+@app.get("/ready")
+def ready(component: str | None = None):
+    """
+    Per-component readiness. Answers 503 unless every requested component
+    (all of them, or just ?component=ocr / ?component=llm) is ready.
+    """
+    components = {
+        "ocr": {
+            "ready": ocr_pool.ready,
+            "status": ocr_pool.status,
+            "error": ocr_pool.error,
+            "workers": ocr_pool.workers,
+        },
+        "llm": provider_status(),
+    }
+
+    if component is not None:
+        if component not in components:
+            raise HTTPException(status_code=404, detail=f"Unknown component: {component}")
+        components = {component: components[component]}
+
+    is_ready = all(c["ready"] for c in components.values())
+    return JSONResponse(
+        {"ready": is_ready, "components": components},
+        status_code=200 if is_ready else 503,
+    )
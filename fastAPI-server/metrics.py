@@ -0,0 +1,276 @@
+# metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Minimal Prometheus-style metrics, rendered in the text exposition format.
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], float]]:
+        with self._lock:
+            return [(self.name, key, v) for key, v in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        """
+        Read the value from fn when metrics are rendered, instead of keeping
+        it up to date on the hot path (queue depths, pool sizes).
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def samples(self):
+        out = super().samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                out.append((self.name, key, float(fn())))
+            except Exception:
+                continue
+        return out
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            # index of the first bucket with value <= bound (len(buckets) = +Inf)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, **labels) -> float:
+        series = self._series.get(self._key(labels))
+        return sum(series[:-1]) if series else 0.0
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative = 0.0
+                for bound, n in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    out.append((f"{self.name}_bucket", key + (le,), cumulative))
+                out.append((f"{self.name}_sum", key, series[-1]))
+                out.append((f"{self.name}_count", key, cumulative))
+        return out
+
+
+REGISTRY: List[_Metric] = []
+
+
+# SHARED METRICS
+STAGE_SECONDS = Histogram(
+    "stage_seconds",
+    "Time spent per processing stage (upload_read, pdf_open, pdf_page_text, ocr_readtext, llm_call, json_extract, ...).",
+    ("stage",),
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Requests by route template, method and status (errors are status >= 400).",
+    ("route", "method", "status"),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Request latency by route template, until the response (streamed ones included) is sent.",
+    ("route", "method"),
+)
+HTTP_IN_FLIGHT = Gauge("http_in_flight", "Requests currently being handled.")
+
+
+# stage -> seconds for the request being handled (see RequestMetricsMiddleware)
+_request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_stages", default=None)
+
+
+def request_stage(stage: str, seconds: float):
+    """
+    Add time to the current request's Server-Timing breakdown only.
+    """
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def observe_stage(stage: str, seconds: float):
+    """
+    Record a stage in stage_seconds and in the current request's breakdown.
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    request_stage(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str, request: bool = True):
+    """
+    Record the time spent in the block as a stage (see observe_stage).
+    request=False leaves the request breakdown alone, for work done in
+    shared background tasks on behalf of several requests.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if request:
+            request_stage(stage, seconds)
+
+
+def server_timing(stages: Dict[str, float], total: float) -> str:
+    """
+    Server-Timing header value: one entry per stage, then the total, in ms.
+    """
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class RequestMetricsMiddleware:
+    """
+    Counts requests and records their latency per route template (so
+    /items/1 and /items/2 share a series; unknown paths are "unmatched").
+    Also puts the start time in the request state ("request_started") for
+    stages measured from the start of the request, and with server_timing
+    adds a Server-Timing header with the stages the request went through
+    (those finished by the time a streamed response starts, for streams).
+    Pages from timing_allow_origins may read those timings through the
+    browser's Resource Timing API (Timing-Allow-Origin header).
+    """
+
+    def __init__(self, app, server_timing: bool = True, timing_allow_origins: Sequence[str] = ()):
+        self.app = app
+        self.server_timing = server_timing
+        self._timing_allow_origin = ", ".join(timing_allow_origins).encode()
+        self._static_paths = None
+
+    def _template(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        # answered before routing (e.g. by admission control): known static paths keep their name
+        if self._static_paths is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._static_paths = {r.path for r in routes if "{" not in getattr(r, "path", "{")}
+        path = scope.get("path", "")
+        return path if path in self._static_paths else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        scope.setdefault("state", {})["request_started"] = start
+        status = 500
+        stages: Dict[str, float] = {}
+        token = _request_stages.set(stages)
+        HTTP_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    value = server_timing(stages, time.perf_counter() - start)
+                    headers = [*message.get("headers", []), (b"server-timing", value.encode())]
+                    if self._timing_allow_origin:
+                        headers.append((b"timing-allow-origin", self._timing_allow_origin))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stages.reset(token)
+            HTTP_IN_FLIGHT.dec()
+            template = self._template(scope)
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(route=template, method=method, status=str(status))
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route=template, method=method)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (n, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def render() -> str:
+    """
+    All registered metrics in the Prometheus text format.
+    """
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, v in metric.samples():
+            names = metric.labelnames + ("le",) if len(key) > len(metric.labelnames) else metric.labelnames
+            lines.append(f"{name}{_format_labels(names, key)} {v:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,200 @@
+# mindmap_tree.py
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import Counter
+
+MINDMAP_FIXES = Counter(
+    "mindmap_tree_fixes_total",
+    "Changes made while normalising generated mindmaps, by kind.",
+    ("kind",),
+)
+
+# Keys LLMs use instead of "label"
+_LABEL_KEYS = ("label", "name", "title", "text")
+
+
+class TreeUnusable(Exception):
+    """The reply has no usable root node; the mindmap has to be regenerated."""
+
+
+class UniqueIds:
+    """
+    Hands out node ids the way normalise_tree does: the wanted id when it
+    is a non-empty string or number not used yet, otherwise one made from
+    the parent's id and the child's position ("root" for the root), with
+    "-2", "-3"... appended until it is unused. The stream parser uses the
+    same rule so streamed node ids match the final tree.
+    """
+
+    def __init__(self):
+        self.seen = set()
+
+    def take(self, wanted: Any, parent_id: Optional[str], index: int) -> Tuple[str, bool]:
+        """
+        Returns the id and whether it differs from the wanted one.
+        """
+        if isinstance(wanted, (str, int)) and not isinstance(wanted, bool) and str(wanted).strip():
+            candidate = str(wanted).strip()
+            if candidate not in self.seen:
+                self.seen.add(candidate)
+                return candidate, False
+        base = f"{parent_id}-{index + 1}" if parent_id is not None else "root"
+        candidate, n = base, 1
+        while candidate in self.seen:
+            n += 1
+            candidate = f"{base}-{n}"
+        self.seen.add(candidate)
+        return candidate, True
+
+
+def _label_of(node: Dict[str, Any]) -> Optional[str]:
+    for key in _LABEL_KEYS:
+        value = node.get(key)
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            label = " ".join(str(value).split())
+            if label:
+                return label
+    return None
+
+
+def _trim(label: str, max_chars: int) -> Tuple[str, bool]:
+    if len(label) <= max_chars:
+        return label, False
+    return label[: max_chars - 1].rstrip() + "…", True
+
+
+def node_label(node: Dict[str, Any], max_label_chars: int) -> Optional[str]:
+    """
+    The label normalise_tree gives a node (trimmed), or None when it has
+    none and is dropped.
+    """
+    label = _label_of(node)
+    return None if label is None else _trim(label, max_label_chars)[0]
+
+
+def node_relation(node: Dict[str, Any]) -> Optional[str]:
+    """
+    A child's relation with its whitespace collapsed, or None when it is
+    not a string (normalise_tree fills in "").
+    """
+    relation = node.get("relation")
+    return " ".join(relation.split()) if isinstance(relation, str) else None
+
+
+def normalise_tree(
+    tree: Any,
+    max_depth: int = 6,
+    max_children: int = 12,
+    max_nodes: int = 300,
+    max_label_chars: int = 120,
+) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """
+    Clean up a generated mindmap so the canvas can always draw it.
+
+    Walks the tree once, breadth first with an explicit queue (no
+    recursion, linear in the number of nodes), and builds a new tree in
+    which every node has a unique string id, a label, a relation (children
+    only) and a children list. Along the way it:
+
+    - turns bare strings in a children list into leaf nodes, takes the
+      label from "name"/"title"/"text" when "label" is missing and drops
+      children that have no label at all
+    - reassigns missing or duplicate ids from the parent's id
+    - trims labels to max_label_chars
+    - drops nodes deeper than max_depth (the root is depth 0), children
+      past max_children per node and, since the walk is breadth first,
+      the deepest nodes once max_nodes is reached
+
+    Returns the new tree and a count of fixes by kind. Raises TreeUnusable
+    when the root is not an object with a label.
+    """
+    if not isinstance(tree, dict):
+        raise TreeUnusable("Mindmap is not a JSON object.")
+    root_label = _label_of(tree)
+    if root_label is None:
+        raise TreeUnusable("Mindmap root has no label.")
+
+    fixes: Dict[str, int] = {}
+
+    def fix(kind: str, n: int = 1):
+        fixes[kind] = fixes.get(kind, 0) + n
+
+    ids = UniqueIds()
+
+    def unique_id(wanted: Any, parent_id: Optional[str], index: int) -> str:
+        new_id, reassigned = ids.take(wanted, parent_id, index)
+        if reassigned:
+            fix("id_reassigned")
+        return new_id
+
+    label, trimmed = _trim(root_label, max_label_chars)
+    if trimmed:
+        fix("label_trimmed")
+    out_root: Dict[str, Any] = {"id": unique_id(tree.get("id"), None, 0), "label": label, "children": []}
+    if "label" not in tree:
+        fix("label_filled")
+
+    count = 1
+    # (source node, normalised node, depth)
+    queue = deque([(tree, out_root, 0)])
+
+    while queue:
+        source, node, depth = queue.popleft()
+
+        children = source.get("children")
+        if not isinstance(children, list):
+            fix("children_filled")
+            continue
+        if not children:
+            continue
+
+        if depth >= max_depth:
+            fix("dropped_depth", len(children))
+            continue
+        if len(children) > max_children:
+            fix("dropped_fan_out", len(children) - max_children)
+            children = children[:max_children]
+
+        out_children: List[Dict[str, Any]] = node["children"]
+        for index, child in enumerate(children):
+            if count >= max_nodes:
+                fix("dropped_node_limit", len(children) - index)
+                break
+
+            if isinstance(child, str):
+                child = {"label": child}
+                fix("leaf_from_string")
+            if not isinstance(child, dict):
+                fix("dropped_invalid")
+                continue
+
+            child_label = _label_of(child)
+            if child_label is None:
+                fix("dropped_invalid")
+                continue
+            if "label" not in child:
+                fix("label_filled")
+            child_label, trimmed = _trim(child_label, max_label_chars)
+            if trimmed:
+                fix("label_trimmed")
+
+            relation = node_relation(child)
+            if relation is None:
+                relation = ""
+                fix("relation_filled")
+
+            out_child = {
+                "id": unique_id(child.get("id"), node["id"], index),
+                "label": child_label,
+                "relation": relation,
+                "children": [],
+            }
+            out_children.append(out_child)
+            count += 1
+            queue.append((child, out_child, depth + 1))
+
+    for kind, n in fixes.items():
+        MINDMAP_FIXES.inc(n, kind=kind)
+
+    return out_root, fixes
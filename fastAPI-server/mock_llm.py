@@ -0,0 +1,354 @@
+# mock_llm.py
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from metrics import Counter
+
+# The "mock" model prefix (e.g. "mock-mindmap") answers in-process without
+# any network call, for load tests and local development. Off unless
+# MOCK_LLM_ENABLED=1, so a deployment never serves canned replies by accident.
+MOCK_LLM_ENABLED = os.environ.get("MOCK_LLM_ENABLED", "0") == "1"
+
+# Time to the first token: log-normal around MOCK_LLM_LATENCY_MS (its median),
+# with MOCK_LLM_LATENCY_SIGMA as the shape (0 = always the median; 0.5 gives
+# a p99 of about 3x the median, like a busy provider). Tokens then arrive at
+# MOCK_LLM_TOKENS_PER_SECOND (0 = all at once), streamed or not.
+MOCK_LLM_LATENCY_MS = float(os.environ.get("MOCK_LLM_LATENCY_MS", "800"))
+MOCK_LLM_LATENCY_SIGMA = float(os.environ.get("MOCK_LLM_LATENCY_SIGMA", "0.5"))
+MOCK_LLM_TOKENS_PER_SECOND = float(os.environ.get("MOCK_LLM_TOKENS_PER_SECOND", "80"))
+
+# Injected failures, as fractions of calls: 500 errors, and 429 rate limits
+# carrying a Retry-After of MOCK_LLM_RETRY_AFTER_SECONDS (empty = no header).
+MOCK_LLM_ERROR_RATE = float(os.environ.get("MOCK_LLM_ERROR_RATE", "0"))
+MOCK_LLM_RATE_LIMIT_RATE = float(os.environ.get("MOCK_LLM_RATE_LIMIT_RATE", "0"))
+MOCK_LLM_RETRY_AFTER_SECONDS = os.environ.get("MOCK_LLM_RETRY_AFTER_SECONDS", "1").strip()
+
+# Replies: generated mindmaps have MOCK_LLM_NODES nodes. MOCK_LLM_REPLIES
+# names a JSON file of canned replies instead, keyed "mindmap", "explain"
+# and "default" (strings, where {topic} is filled in, or for "mindmap" also
+# a tree object); kinds missing from the file are generated.
+MOCK_LLM_NODES = int(os.environ.get("MOCK_LLM_NODES", "12"))
+MOCK_LLM_REPLIES = os.environ.get("MOCK_LLM_REPLIES", "")
+
+# The "local" model prefix talks to any OpenAI-compatible server at this
+# URL (vLLM, llama.cpp, Ollama, or `python mock_llm.py`), sending the model
+# name after "local/" (e.g. "local/llama3"). Empty = prefix not available.
+LOCAL_LLM_BASE_URL = os.environ.get("LOCAL_LLM_BASE_URL", "")
+
+MOCK_LLM_CALLS = Counter("mock_llm_calls_total", "Calls answered by the mock LLM, by outcome.", ("outcome",))
+
+_WORDS = (
+    "overview structure process input output cause effect example principle method "
+    "component stage result factor pattern model system function property limit"
+).split()
+
+# about 4 characters to a token, like the tokenizers of the real providers
+_CHARS_PER_TOKEN = 4
+
+
+class MockLLMError(Exception):
+    """An injected provider error; looks like an SDK status error to resilience.classify."""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class MockMessage:
+    def __init__(self, content: str, usage_metadata: Optional[Dict[str, int]] = None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+# REPLIES
+def _content(message) -> str:
+    if isinstance(message, dict):
+        return str(message.get("content", ""))
+    if isinstance(message, (tuple, list)) and len(message) == 2:
+        return str(message[1])
+    return str(getattr(message, "content", message))
+
+
+def _topic(request: str) -> str:
+    # the request templates put the topic after their first blank line
+    head, _, rest = request.partition("\n\n")
+    text = " ".join((rest or head).split())
+    return text[:60].rstrip() or "Topic"
+
+
+def _mindmap(topic: str, nodes: int, rng: random.Random) -> Dict[str, Any]:
+    """
+    A tree of `nodes` nodes, up to four children per node, breadth first.
+    """
+    root = {"id": "root", "label": topic, "children": []}
+    parents = [root]
+    for i in range(1, max(nodes, 1)):
+        parent = parents[(i - 1) // 4]
+        child = {
+            "id": f"n{i}",
+            "label": " ".join(rng.choice(_WORDS).capitalize() if j == 0 else rng.choice(_WORDS) for j in range(2)),
+            "relation": rng.choice(("contains", "uses", "leads to", "is a")),
+            "children": [],
+        }
+        parent["children"].append(child)
+        parents.append(child)
+    return root
+
+
+def _explanation(request: str) -> str:
+    tree_json, _, question = request.partition("\n\nUser question:\n")
+    try:
+        tree = json.loads(tree_json.split("\n\n", 1)[-1])
+    except ValueError:
+        tree = {}
+    if not isinstance(tree, dict):
+        tree = {}
+
+    label = tree.get("label", "this topic")
+    branches = [c.get("label", "") for c in tree.get("children", []) if isinstance(c, dict)]
+    parts = [f"This mindmap is about {label}."]
+    if branches:
+        parts.append(f"It branches into {', '.join(branches[:-1]) + ' and ' if len(branches) > 1 else ''}{branches[-1]}.")
+    for branch in branches:
+        parts.append(f"{branch} shows one part of {label} and how it connects to the rest.")
+    if question.strip():
+        parts.append(f"As for your question ({question.strip()}): look at the branch closest to it first.")
+    return " ".join(parts)
+
+
+class MockChatModel:
+    """
+    Chat model that answers without a provider: mindmap requests with a
+    fenced JSON tree, explain requests with prose about the tree it was
+    given, anything else with filler text, each cut to max_tokens. Latency,
+    token rate and injected 500 / 429 errors follow the MOCK_LLM_* settings
+    (or the arguments). Has the invoke / ainvoke / astream interface of a
+    LangChain chat model, with usage_metadata on the replies.
+    """
+
+    def __init__(
+        self,
+        model: str = "mock",
+        max_tokens: int = 512,
+        latency_ms: float = None,
+        latency_sigma: float = None,
+        tokens_per_second: float = None,
+        error_rate: float = None,
+        rate_limit_rate: float = None,
+        nodes: int = None,
+        replies: Optional[Dict[str, Any]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.latency_ms = MOCK_LLM_LATENCY_MS if latency_ms is None else latency_ms
+        self.latency_sigma = MOCK_LLM_LATENCY_SIGMA if latency_sigma is None else latency_sigma
+        self.tokens_per_second = MOCK_LLM_TOKENS_PER_SECOND if tokens_per_second is None else tokens_per_second
+        self.error_rate = MOCK_LLM_ERROR_RATE if error_rate is None else error_rate
+        self.rate_limit_rate = MOCK_LLM_RATE_LIMIT_RATE if rate_limit_rate is None else rate_limit_rate
+        self.nodes = MOCK_LLM_NODES if nodes is None else nodes
+        self.replies = _load_replies(MOCK_LLM_REPLIES) if replies is None else replies
+        self.rng = random.Random(seed)
+
+    def with_max_tokens(self, max_tokens: int) -> "MockChatModel":
+        clone = copy.copy(self)
+        clone.max_tokens = max_tokens
+        return clone
+
+    # what happens to one call
+    def _first_token_delay(self) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000
+        return self.latency_ms * math.exp(self.rng.gauss(0, self.latency_sigma)) / 1000
+
+    def _token_delay(self, chars: int) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return chars / _CHARS_PER_TOKEN / self.tokens_per_second
+
+    def _check_failure(self):
+        draw = self.rng.random()
+        if draw < self.rate_limit_rate:
+            MOCK_LLM_CALLS.inc(outcome="429")
+            retry_after = float(MOCK_LLM_RETRY_AFTER_SECONDS) if MOCK_LLM_RETRY_AFTER_SECONDS else None
+            raise MockLLMError("Rate limit reached (mock)", 429, retry_after)
+        if draw < self.rate_limit_rate + self.error_rate:
+            MOCK_LLM_CALLS.inc(outcome="500")
+            raise MockLLMError("Internal server error (mock)", 500)
+        MOCK_LLM_CALLS.inc(outcome="ok")
+
+    def reply(self, messages) -> str:
+        request = _content(messages[-1]) if messages else ""
+        topic = _topic(request)
+
+        if request.startswith("Create a mindmap"):
+            canned = self.replies.get("mindmap")
+            tree = _mindmap(topic, self.nodes, self.rng) if canned is None else canned
+            text = tree.replace("{topic}", topic) if isinstance(tree, str) else (
+                "```json\n" + json.dumps(tree, ensure_ascii=False) + "\n```"
+            )
+        elif request.startswith("Here is the mindmap JSON"):
+            canned = self.replies.get("explain")
+            text = _explanation(request) if canned is None else canned.replace("{topic}", topic)
+        else:
+            canned = self.replies.get("default")
+            filler = " ".join(self.rng.choice(_WORDS) for _ in range(self.max_tokens))
+            text = f"Mock reply about {topic}: {filler}." if canned is None else canned.replace("{topic}", topic)
+
+        # like a real model, a reply longer than max_tokens is cut off
+        return text[: self.max_tokens * _CHARS_PER_TOKEN]
+
+    def usage(self, messages, reply: str) -> Dict[str, int]:
+        prompt = sum(len(_content(m)) for m in messages) // _CHARS_PER_TOKEN
+        completion = math.ceil(len(reply) / _CHARS_PER_TOKEN)
+        return {"input_tokens": prompt, "output_tokens": completion, "total_tokens": prompt + completion}
+
+    # LangChain chat model interface
+    def invoke(self, messages) -> MockMessage:
+        time.sleep(self._first_token_delay())
+        self._check_failure()
+        reply = self.reply(messages)
+        time.sleep(self._token_delay(len(reply)))
+        return MockMessage(reply, self.usage(messages, reply))
+
+    async def ainvoke(self, messages) -> MockMessage:
+        await asyncio.sleep(self._first_token_delay())
+        self._check_failure()
+        reply = self.reply(messages)
+        await asyncio.sleep(self._token_delay(len(reply)))
+        return MockMessage(reply, self.usage(messages, reply))
+
+    async def astream(self, messages):
+        await asyncio.sleep(self._first_token_delay())
+        self._check_failure()
+        reply = self.reply(messages)
+
+        # a few tokens per chunk, as the providers send them
+        step = 4 * _CHARS_PER_TOKEN
+        for i in range(0, len(reply), step):
+            if i:
+                await asyncio.sleep(self._token_delay(step))
+            yield MockMessage(reply[i : i + step])
+        yield MockMessage("", self.usage(messages, reply))
+
+
+def _load_replies(path: str) -> Dict[str, Any]:
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def local_model_name(model: str) -> str:
+    """
+    Name to send to the LOCAL_LLM_BASE_URL server for a "local..." model.
+    """
+    name = model[len("local"):].lstrip("/-:")
+    return name or "mock"
+
+
+# OPENAI-COMPATIBLE SERVER
+def create_app(llm: Optional[MockChatModel] = None) -> FastAPI:
+    """
+    Stand-alone OpenAI-compatible server around MockChatModel
+    (/v1/chat/completions, streamed or not, and /v1/models), for load
+    tests that should go through a real HTTP client and connection pool.
+    max_tokens in a request overrides the model's.
+    """
+    app = FastAPI(title="Mock LLM")
+    base = llm or MockChatModel()
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": base.model, "object": "model", "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", base.model)
+        llm_ = base.with_max_tokens(body.get("max_tokens") or base.max_tokens)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            chunks = llm_.astream(messages)
+            try:
+                first = await chunks.__anext__()
+            except MockLLMError as e:
+                return _error_response(e)
+            return StreamingResponse(
+                _sse_chunks(first, chunks, completion_id, created, model, messages, llm_),
+                media_type="text/event-stream",
+            )
+
+        try:
+            resp = await llm_.ainvoke(messages)
+        except MockLLMError as e:
+            return _error_response(e)
+
+        usage = resp.usage_metadata
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": resp.content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": usage["input_tokens"],
+                "completion_tokens": usage["output_tokens"],
+                "total_tokens": usage["total_tokens"],
+            },
+        }
+
+    return app
+
+
+async def _sse_chunks(first, chunks, completion_id, created, model, messages, llm):
+    def event(delta: dict, finish_reason=None) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    yield event({"role": "assistant", "content": first.content})
+    async for chunk in chunks:
+        if chunk.content:
+            yield event({"content": chunk.content})
+    yield event({}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+def _error_response(e: MockLLMError) -> JSONResponse:
+    headers = {} if e.retry_after is None else {"Retry-After": str(math.ceil(e.retry_after))}
+    kind = "rate_limit_exceeded" if e.status_code == 429 else "server_error"
+    return JSONResponse(
+        {"error": {"message": str(e), "type": kind, "code": kind}}, status_code=e.status_code, headers=headers
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server (settings: MOCK_LLM_*).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    uvicorn.run(create_app(), host=args.host, port=args.port)
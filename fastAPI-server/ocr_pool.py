@@ -0,0 +1,442 @@
+# ocr_pool.py
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import Counter, timed
+
+OCR_POOL_REBUILDS = Counter("ocr_pool_rebuilds_total", "OCR process pools replaced after a worker process died.")
+
+
+class OCRQueueFull(Exception):
+    """Raised when the OCR pool already holds as many jobs as it is allowed to queue."""
+
+
+# WORKER PROCESS SIDE
+# Every worker process keeps its own reader, loaded once by the initializer.
+_worker_reader = None
+
+
+def _init_worker(langs: List[str], gpu: bool, torch_threads: int):
+    global _worker_reader
+
+    import torch
+
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+
+    import easyocr
+
+    _worker_reader = easyocr.Reader(langs, gpu=gpu)
+
+
+def _worker_readtext(arr: np.ndarray) -> List[str]:
+    return _worker_reader.readtext(arr, detail=0)
+
+
+def _worker_readtext_batch(arrs: List[np.ndarray]) -> List[List[str]]:
+    return _readtext_batch(_worker_reader, arrs)
+
+
+def _warm_up_image() -> np.ndarray:
+    """
+    White strip with a row of dark glyph-like blocks, so a warm-up pass goes
+    through both the detector and the recognizer.
+    """
+    img = np.full((64, 256, 3), 255, dtype=np.uint8)
+    for x in range(16, 240, 24):
+        img[20:44, x : x + 14] = 0
+        img[28:36, x + 4 : x + 10] = 255
+    return img
+
+
+# BATCHED RECOGNITION
+# Crops handed to the recognizer per forward pass when a batch is run.
+_RECOGNIZER_BATCH_SIZE = 16
+
+# An image is only padded into a group when it fills at least this much of
+# the group's canvas; otherwise detection would mostly run on padding.
+_MIN_CANVAS_FILL = 0.5
+
+
+def _group_for_batch(arrs: List[np.ndarray]) -> List[Tuple[List[int], Tuple[int, int]]]:
+    """
+    Split images into groups that can share one padded canvas.
+    Returns (indices, (height, width)) per group, largest images first.
+    """
+    def area(i: int) -> int:
+        return arrs[i].shape[0] * arrs[i].shape[1]
+
+    groups: List[Tuple[List[int], Tuple[int, int]]] = []
+    for i in sorted(range(len(arrs)), key=area, reverse=True):
+        h, w = arrs[i].shape[:2]
+        for g, (members, (gh, gw)) in enumerate(groups):
+            ch, cw = max(gh, h), max(gw, w)
+            if min(area(j) for j in members + [i]) >= _MIN_CANVAS_FILL * ch * cw:
+                groups[g] = (members + [i], (ch, cw))
+                break
+        else:
+            groups.append(([i], (h, w)))
+
+    return groups
+
+
+def _pad_to(arr: np.ndarray, height: int, width: int) -> np.ndarray:
+    h, w = arr.shape[:2]
+    if (h, w) == (height, width):
+        return arr
+    pad = [(0, height - h), (0, width - w)] + [(0, 0)] * (arr.ndim - 2)
+    return np.pad(arr, pad, mode="constant", constant_values=255)
+
+
+def _readtext_batch(reader: Any, arrs: List[np.ndarray]) -> List[List[str]]:
+    """
+    OCR several images with as few detector/recognizer passes as possible.
+    Similar-sized images are padded to a shared canvas (white, bottom/right)
+    and sent through readtext_batched; lone images use plain readtext.
+    """
+    results: List[List[str]] = [[] for _ in arrs]
+
+    for members, (height, width) in _group_for_batch(arrs):
+        if len(members) == 1:
+            i = members[0]
+            results[i] = reader.readtext(arrs[i], detail=0)
+            continue
+
+        batch = [_pad_to(arrs[i], height, width) for i in members]
+        out = reader.readtext_batched(batch, detail=0, batch_size=_RECOGNIZER_BATCH_SIZE)
+        for i, lines in zip(members, out):
+            results[i] = lines
+
+    return results
+
+
+# POOL
+class OCRPool:
+    """
+    Runs EasyOCR off the event loop.
+
+    With workers > 0 every job is sent to a process pool where each process
+    holds its own easyocr.Reader. With workers == 0 a single reader lives in
+    this process and jobs run on the default thread executor (useful for
+    development and tests).
+
+    A failed load (model download, broken initializer) is retried in the
+    background after retry_delay seconds, doubling up to max_retry_delay,
+    and by the next request; a job that succeeds marks the pool ready.
+    """
+
+    def __init__(
+        self,
+        langs: List[str],
+        gpu: bool = False,
+        workers: int = 1,
+        torch_threads: int = 1,
+        max_queue: int = 16,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+    ):
+        self.langs = langs
+        self.gpu = gpu
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.max_queue = max_queue
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self.reader: Any = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+        # stopped -> loading -> warming -> ready (or failed, see error)
+        self.status = "stopped"
+        self.error: Optional[str] = None
+        self._loading: Optional[asyncio.Task] = None
+        # the load attempt in progress, shared by the background load and requests
+        self._attempt: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None or self.reader is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self.started:
+            return
+
+        if self.workers > 0:
+            # spawn keeps torch / model state of the parent out of the workers
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.langs, self.gpu, self.torch_threads),
+            )
+        else:
+            import easyocr
+
+            self.reader = easyocr.Reader(self.langs, gpu=self.gpu)
+
+    def load_in_background(self) -> asyncio.Task:
+        """
+        Load the model(s) and warm them up without blocking the event loop,
+        retrying with backoff until it works.
+        """
+        if self._loading is None:
+            self._loading = asyncio.get_running_loop().create_task(self._load())
+        return self._loading
+
+    async def _load(self):
+        delay = self.retry_delay
+        while not await self._load_attempt():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def _load_attempt(self) -> asyncio.Task:
+        if self._attempt is None or self._attempt.done():
+            self._attempt = asyncio.get_running_loop().create_task(self._load_once())
+        return self._attempt
+
+    async def _load_once(self) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            self.status = "loading"
+            # in-process mode builds the reader here, so keep it off the loop
+            await loop.run_in_executor(None, self.start)
+
+            self.status = "warming"
+            await self.warm_up()
+
+            self.status = "ready"
+            self.error = None
+            return True
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            # start from scratch next time (a broken initializer breaks the pool)
+            self._stop_workers()
+            return False
+
+    async def warm_up(self):
+        """
+        Run one dummy inference per worker so the first real request does
+        not pay for lazy model initialisation.
+        """
+        loop = asyncio.get_running_loop()
+        img = _warm_up_image()
+
+        if self._executor is not None:
+            # the workers are spawned (and load their reader) on first submit
+            await asyncio.gather(
+                *(loop.run_in_executor(self._executor, _worker_readtext, img) for _ in range(self.workers))
+            )
+        else:
+            reader = self.reader
+            await loop.run_in_executor(None, lambda: reader.readtext(img, detail=0))
+
+    async def _ensure_started(self):
+        if self.started:
+            return
+        # join the load in progress, or load now (never on the event loop)
+        await asyncio.shield(self._load_attempt())
+        if not self.started:
+            raise RuntimeError(f"OCR model failed to load: {self.error}")
+
+    def _stop_workers(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self.reader = None
+
+    def shutdown(self):
+        for task in (self._loading, self._attempt):
+            if task is not None:
+                task.cancel()
+        self._loading = self._attempt = None
+        self._stop_workers()
+        self.status = "stopped"
+
+    async def readtext(self, arr: np.ndarray) -> List[str]:
+        """
+        Run OCR on a decoded RGB image and return the detected lines.
+        Raises OCRQueueFull when the pool is saturated instead of queueing forever.
+        """
+        return await self._run(
+            "ocr_readtext", _worker_readtext, arr, lambda reader: reader.readtext(arr, detail=0)
+        )
+
+    async def readtext_batch(self, arrs: List[np.ndarray]) -> List[List[str]]:
+        """
+        Run OCR on several images as a single pool job (see _readtext_batch).
+        """
+        return await self._run(
+            "ocr_readtext_batch", _worker_readtext_batch, arrs, lambda reader: _readtext_batch(reader, arrs)
+        )
+
+    async def _run(self, stage: str, worker_fn: Callable, arg: Any, inline_fn: Callable):
+        await self._ensure_started()
+
+        # checked after startup: requests that waited for the model all count
+        if self._pending >= max(self.workers, 1) + self.max_queue:
+            raise OCRQueueFull("OCR queue is full")
+
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            with timed(stage, request=False):
+                executor = self._executor
+                if executor is None:
+                    reader = self.reader
+                    result = await loop.run_in_executor(None, lambda: inline_fn(reader))
+                else:
+                    try:
+                        result = await loop.run_in_executor(executor, worker_fn, arg)
+                    except BrokenProcessPool:
+                        self._rebuild(executor)
+                        raise
+        finally:
+            self._pending -= 1
+
+        if self.status == "failed":
+            # OCR works again (e.g. the warm-up failed but real jobs do not)
+            self.status = "ready"
+            self.error = None
+        return result
+
+    def _rebuild(self, broken: ProcessPoolExecutor):
+        """
+        Replace a process pool whose worker died (e.g. killed for memory);
+        a broken pool fails every later job. The job that hit it still fails,
+        since it may be what killed the worker.
+        """
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+        OCR_POOL_REBUILDS.inc()
+
+
+# BATCHER
+class OCRBatcher:
+    """
+    Collects images that arrive close together and OCRs them as one batch.
+
+    A batch is closed when it reaches max_batch_size or when max_wait seconds
+    have passed since its first image. At most one batch per pool worker runs
+    at a time, so while the workers are busy new images pile up and the next
+    batch fills without waiting. max_batch_size=1 turns batching off.
+    """
+
+    def __init__(self, pool: OCRPool, max_batch_size: int = 8, max_wait: float = 0.005):
+        self.pool = pool
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: set = set()
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._dispatcher is not None and not self._dispatcher.done():
+            return
+
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max(self.pool.workers, 1))
+        self._dispatcher = loop.create_task(self._dispatch())
+
+    async def readtext(self, arr: np.ndarray) -> List[str]:
+        """
+        Queue an image for the next batch and wait for its OCR lines.
+        """
+        self._ensure_running()
+
+        if self._queue.qsize() >= self.pool.max_queue:
+            raise OCRQueueFull("OCR queue is full")
+
+        fut = self._loop.create_future()
+        self._queue.put_nowait((arr, fut))
+        return await fut
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # requests whose client went away while queued
+        return [(arr, fut) for arr, fut in batch if not fut.done()]
+
+    async def _dispatch(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = self._loop.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        try:
+            if len(batch) == 1:
+                results = [await self.pool.readtext(batch[0][0])]
+            else:
+                results = await self.pool.readtext_batch([arr for arr, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (_, fut), lines in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(lines)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in list(self._running):
+            task.cancel()
+        self._loop = None
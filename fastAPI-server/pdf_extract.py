@@ -0,0 +1,336 @@
+# pdf_extract.py
+import asyncio
+import contextvars
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from metrics import Counter, observe_stage
+
+PDF_POOL_REBUILDS = Counter("pdf_pool_rebuilds_total", "PDF process pools replaced after a worker process died.")
+
+
+class PDFTooLarge(Exception):
+    """Raised as soon as a document is known to exceed the page or text limits."""
+
+
+class PDFOpenError(Exception):
+    """The upload could not be opened as a PDF."""
+
+
+class PDFPoolBroken(Exception):
+    """A PDF worker process died, and again on a fresh pool; not the upload's fault."""
+
+
+def parse_page_range(spec: Optional[str], page_count: int) -> List[int]:
+    """
+    Turn a 1-based page selection such as "3", "1-5", "10-" or "1-3,7"
+    into 0-based page indexes, clipped to the document.
+    """
+    if spec is None or not spec.strip():
+        return list(range(page_count))
+
+    selected: List[int] = []
+    seen = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+
+        if "-" in part:
+            start_s, end_s = part.split("-", 1)
+            start = int(start_s) if start_s.strip() else 1
+            end = int(end_s) if end_s.strip() else page_count
+        else:
+            start = end = int(part)
+
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: {part}")
+
+        for i in range(start - 1, min(end, page_count)):
+            if i not in seen:
+                seen.add(i)
+                selected.append(i)
+
+    if not selected:
+        raise ValueError("Page range selects no pages.")
+
+    return selected
+
+
+def _page_text(page) -> str:
+    try:
+        text = page.get_text("text")
+    except Exception:
+        text = page.get_text()
+    return text.strip()
+
+
+def iter_page_text(doc, pages: List[int], timings: Optional[List[float]] = None) -> Iterator[str]:
+    """
+    Yield the stripped text of each selected page, one page at a time,
+    appending the seconds spent on each page to timings if given.
+    """
+    for i in pages:
+        start = time.perf_counter()
+        text = _page_text(doc.load_page(i))
+        if timings is not None:
+            timings.append(time.perf_counter() - start)
+        yield text
+
+
+def _record_timings(open_seconds: Optional[float], page_seconds: List[float]):
+    # measured where the work ran (possibly a worker process), recorded here
+    if open_seconds is not None:
+        observe_stage("pdf_open", open_seconds)
+    for seconds in page_seconds:
+        observe_stage("pdf_page_text", seconds)
+
+
+def extract_text(
+    doc, pages: List[int], max_chars: int, max_pages: int, timings: Optional[List[float]] = None
+) -> str:
+    """
+    Join the text of the selected pages with blank lines, stopping with
+    PDFTooLarge as soon as the page count or the running text length is
+    over its limit, so oversized documents are never fully extracted.
+    """
+    if len(pages) > max_pages:
+        raise PDFTooLarge(f"Document has too many pages ({len(pages)} > {max_pages}).")
+
+    parts: List[str] = []
+    length = 0
+    for text in iter_page_text(doc, pages, timings):
+        if not text:
+            continue
+        length += len(text) + (2 if parts else 0)
+        if length > max_chars:
+            raise PDFTooLarge("File content too large.")
+        parts.append(text)
+
+    return "\n\n".join(parts)
+
+
+# WORKER SIDE
+# Chunks of the same document usually land on the same worker; keep the
+# last opened document around instead of re-parsing it for every chunk.
+_worker_doc: Tuple[Optional[str], object] = (None, None)
+
+
+def _open_shared(shm_name: str, size: int) -> Tuple[object, Optional[float]]:
+    """
+    The shared document and the seconds fitz.open took (None if it was
+    already open in this worker).
+    """
+    global _worker_doc
+
+    if _worker_doc[0] == shm_name:
+        return _worker_doc[1], None
+
+    # the parent owns (and unlinks) the segment; workers only read it
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    start = time.perf_counter()
+    try:
+        doc = fitz.open(stream=data, filetype="pdf")
+    except Exception as e:
+        raise PDFOpenError(str(e))
+    _worker_doc = (shm_name, doc)
+    return doc, time.perf_counter() - start
+
+
+def _worker_page_count(shm_name: str, size: int) -> Tuple[int, Optional[float]]:
+    doc, open_seconds = _open_shared(shm_name, size)
+    return doc.page_count, open_seconds
+
+
+def _worker_extract_pages(
+    shm_name: str, size: int, pages: List[int], max_chars: int
+) -> Tuple[List[str], bool, Optional[float], List[float]]:
+    """
+    Text of the given pages. Stops early and reports over=True once this
+    chunk alone is over max_chars, since the whole document then is too.
+    Also returns the open and per-page timings for the parent to record.
+    """
+    doc, open_seconds = _open_shared(shm_name, size)
+
+    texts: List[str] = []
+    timings: List[float] = []
+    length = 0
+    for text in iter_page_text(doc, pages, timings):
+        texts.append(text)
+        length += len(text)
+        if length > max_chars:
+            return texts, True, open_seconds, timings
+    return texts, False, open_seconds, timings
+
+
+def _extract_document(data: bytes, page_spec: Optional[str], max_chars: int, max_pages: int) -> str:
+    """
+    Open, select pages and extract in one go (single-process path).
+    """
+    start = time.perf_counter()
+    try:
+        doc = fitz.open(stream=data, filetype="pdf")
+    except Exception as e:
+        raise PDFOpenError(str(e))
+    open_seconds = time.perf_counter() - start
+
+    timings: List[float] = []
+    try:
+        selected = parse_page_range(page_spec, doc.page_count)
+        return extract_text(doc, selected, max_chars, max_pages, timings)
+    finally:
+        _record_timings(open_seconds, timings)
+
+
+def _split_chunks(pages: List[int], n: int) -> List[List[int]]:
+    """
+    Split pages into at most n contiguous, evenly sized chunks.
+    """
+    n = max(1, min(n, len(pages)))
+    size, extra = divmod(len(pages), n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(pages[start:end])
+        start = end
+    return chunks
+
+
+# POOL
+class PDFPool:
+    """
+    Runs PyMuPDF off the event loop.
+
+    With workers > 0 the document is copied once into shared memory and
+    worker processes open it from there. Selections of at least
+    parallel_min_pages pages are split into contiguous chunks, one per
+    worker, and the page texts are reassembled in order. With workers == 0
+    the whole extraction runs on the default thread executor.
+    """
+
+    def __init__(self, workers: int = 2, parallel_min_pages: int = 16):
+        self.workers = workers
+        self.parallel_min_pages = parallel_min_pages
+        self._executor: Optional[Executor] = None
+        # extractions submitted and not finished yet
+        self.pending = 0
+
+    def start(self):
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _rebuild(self, broken: Executor):
+        """
+        Replace a process pool whose worker died (e.g. killed for memory);
+        a broken pool fails every later job.
+        """
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+        PDF_POOL_REBUILDS.inc()
+
+    async def extract(self, data: bytes, page_spec: Optional[str], max_chars: int, max_pages: int) -> str:
+        """
+        Extracted text of the selected pages.
+        Raises PDFOpenError, ValueError (bad page range), PDFTooLarge or
+        PDFPoolBroken. A document that hits a broken pool is tried once
+        more on a fresh one, since the worker usually died of something
+        else (an earlier job, the OOM killer).
+        """
+        loop = asyncio.get_running_loop()
+
+        self.pending += 1
+        try:
+            if self.workers <= 0:
+                # in the caller's context, so the timings reach its request breakdown
+                run = contextvars.copy_context().run
+                return await loop.run_in_executor(None, run, _extract_document, data, page_spec, max_chars, max_pages)
+
+            self.start()
+            shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            try:
+                shm.buf[: len(data)] = data
+                for retry in (True, False):
+                    executor = self._executor
+                    try:
+                        return await self._extract_shared(
+                            executor, shm.name, len(data), page_spec, max_chars, max_pages
+                        )
+                    except BrokenProcessPool as e:
+                        self._rebuild(executor)
+                        if not retry:
+                            raise PDFPoolBroken(str(e))
+            finally:
+                shm.close()
+                shm.unlink()
+        finally:
+            self.pending -= 1
+
+    async def _extract_shared(
+        self, executor: Executor, shm_name: str, size: int, page_spec: Optional[str], max_chars: int, max_pages: int
+    ) -> str:
+        loop = asyncio.get_running_loop()
+
+        # the worker raises PDFOpenError itself; anything else is the pool's problem
+        page_count, open_seconds = await loop.run_in_executor(executor, _worker_page_count, shm_name, size)
+        _record_timings(open_seconds, [])
+
+        selected = parse_page_range(page_spec, page_count)
+        if len(selected) > max_pages:
+            raise PDFTooLarge(f"Document has too many pages ({len(selected)} > {max_pages}).")
+
+        if len(selected) < self.parallel_min_pages:
+            chunks = [selected]
+        else:
+            chunks = _split_chunks(selected, self.workers)
+
+        futures = [
+            loop.run_in_executor(executor, _worker_extract_pages, shm_name, size, chunk, max_chars)
+            for chunk in chunks
+        ]
+        try:
+            # any single chunk over the limit settles it; don't wait for the rest
+            for fut in asyncio.as_completed(futures):
+                _, over, open_seconds, page_seconds = await fut
+                _record_timings(open_seconds, page_seconds)
+                if over:
+                    raise PDFTooLarge("File content too large.")
+            results = [fut.result() for fut in futures]
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+        parts: List[str] = []
+        length = 0
+        for texts, *_ in results:
+            for text in texts:
+                if not text:
+                    continue
+                length += len(text) + (2 if parts else 0)
+                if length > max_chars:
+                    raise PDFTooLarge("File content too large.")
+                parts.append(text)
+
+        return "\n\n".join(parts)
@@ -0,0 +1,170 @@
+# profiling.py
+import asyncio
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as Tally
+from typing import Optional
+
+from metrics import Counter
+
+PROFILES = Counter("profiles_total", "Requests run under the sampling profiler, by result.", ("result",))
+
+# names of stored profiles, as handed out in the X-Profile header
+PROFILE_NAME = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}\.folded$")
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread each `interval` seconds from
+    a background thread and tallies them in the folded format flame graph
+    tools read ("thread;outer;...;inner count"). No tracing hooks, so the
+    profiled code runs at full speed between samples. Worker processes
+    (OCR, PDF) are not sampled; their executor threads show as waiting.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 100):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Tally = Tally()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+
+class ProfileStore:
+    """
+    Who may profile (callers sending X-Profile-Token equal to `token`; no
+    token, nobody) and where profiles go: `directory`, keeping only the
+    newest max_files.
+    """
+
+    def __init__(self, token: Optional[str], directory: str, max_files: int = 100):
+        self.token = token.encode() if token else None
+        self.directory = directory
+        self.max_files = max_files
+
+    @property
+    def enabled(self) -> bool:
+        return self.token is not None
+
+    def authorised(self, headers) -> bool:
+        if self.token is None:
+            return False
+        for name, value in headers:
+            if name == b"x-profile-token":
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    def save(self, name: str, folded: str):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), "w") as f:
+            f.write(folded)
+
+        stored = sorted(n for n in os.listdir(self.directory) if PROFILE_NAME.match(n))
+        for old in stored[: max(0, len(stored) - self.max_files)]:
+            os.remove(os.path.join(self.directory, old))
+
+    def load(self, name: str) -> Optional[str]:
+        """
+        A stored profile by the name from its X-Profile header, if it exists.
+        """
+        if not PROFILE_NAME.match(name):
+            return None
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class ProfileMiddleware:
+    """
+    Runs a request under SamplingProfiler when it carries "X-Profile: 1"
+    from a caller the store authorises (others are served normally). The
+    profile covers the whole response, streamed bodies included, and every
+    thread in the process, so concurrent requests show up too. It is saved
+    under the name sent back in the X-Profile response header ("busy" when
+    another request is being profiled; one at a time).
+    """
+
+    def __init__(self, app, store: ProfileStore, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.store.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = scope.get("headers", [])
+        wanted = any(name == b"x-profile" and value == b"1" for name, value in headers)
+        if not wanted or not self.store.authorised(headers):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._busy.acquire(blocking=False):
+            PROFILES.inc(result="busy")
+            await self.app(scope, receive, _with_header(send, b"busy"))
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, _with_header(send, name.encode()))
+        finally:
+            try:
+                # joining the sampler and writing the file block; keep them off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self._finish, profiler, name)
+            finally:
+                self._busy.release()
+
+    def _finish(self, profiler: SamplingProfiler, name: str):
+        profiler.stop()
+        try:
+            self.store.save(name, profiler.folded())
+            PROFILES.inc(result="stored")
+        except OSError:
+            PROFILES.inc(result="error")
+
+
+def _with_header(send, value: bytes):
+    async def send_wrapper(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": [*message.get("headers", []), (b"x-profile", value)]}
+        await send(message)
+
+    return send_wrapper
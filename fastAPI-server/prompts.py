@@ -0,0 +1,472 @@
+# prompts.py
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import Counter, Gauge, Histogram
+
+PROMPT_REQUESTS = Counter("prompt_template_requests_total", "LLM calls made from a prompt template.", ("template",))
+PROMPT_INPUT_TOKENS = Counter(
+    "prompt_template_input_tokens_total",
+    "Prompt tokens of calls made from a template, as reported by the provider.",
+    ("template",),
+)
+PROMPT_CACHED_TOKENS = Counter(
+    "prompt_template_cached_tokens_total",
+    "Prompt tokens the provider served from its prefix cache (billed at the cached rate or not at all).",
+    ("template",),
+)
+PROMPT_PREFIX_CHARS = Gauge("prompt_template_prefix_chars", "Size of the static message prefix of a template.", ("template",))
+PROMPT_SECONDS = Histogram(
+    "prompt_template_seconds",
+    "LLM call latency per template, by whether the provider reported a prefix cache hit.",
+    ("template", "prefix_cache"),
+)
+
+
+def cached_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    Prompt tokens served from the provider's prefix cache, or None when the
+    usage does not say. Understands LangChain's usage_metadata as well as
+    raw OpenAI and DeepSeek usage blocks.
+    """
+    if not usage:
+        return None
+    details = usage.get("input_token_details")
+    if isinstance(details, dict) and "cache_read" in details:
+        return details["cache_read"]
+    details = usage.get("prompt_tokens_details")
+    if isinstance(details, dict) and "cached_tokens" in details:
+        return details["cached_tokens"]
+    if "prompt_cache_hit_tokens" in usage:
+        return usage["prompt_cache_hit_tokens"]
+    return None
+
+
+class PromptTemplate:
+    """
+    A prompt whose system message and few-shot examples are built once at
+    import. Every call sends this byte-identical prefix first and only the
+    request-specific user message last, which is the layout the providers'
+    automatic prefix caches (OpenAI, DeepSeek, Groq, Gemini implicit
+    caching) need to reuse the prefix instead of processing it again.
+    """
+
+    def __init__(self, name: str, prefix: List[Dict[str, str]]):
+        self.name = name
+        self.prefix: Tuple[Dict[str, str], ...] = tuple(prefix)
+        self.prefix_chars = sum(len(m["content"]) for m in self.prefix)
+        # changes whenever the prompt is edited, so cached replies to the old prompt stop matching
+        self.fingerprint = hashlib.sha256(json.dumps(self.prefix, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        PROMPT_PREFIX_CHARS.set(self.prefix_chars, template=name)
+
+    def messages(self, user_content: str) -> List[Dict[str, str]]:
+        return [*self.prefix, {"role": "user", "content": user_content}]
+
+    def record(self, usage: Optional[Dict[str, Any]], seconds: float):
+        """
+        Account one call made from this template: prompt and cached tokens
+        (the saving) and latency split by prefix cache hit / miss.
+        """
+        PROMPT_REQUESTS.inc(template=self.name)
+
+        usage = usage or {}
+        input_tokens = usage.get("input_tokens", usage.get("prompt_tokens"))
+        if isinstance(input_tokens, (int, float)):
+            PROMPT_INPUT_TOKENS.inc(input_tokens, template=self.name)
+
+        cached = cached_tokens(usage)
+        if cached:
+            PROMPT_CACHED_TOKENS.inc(cached, template=self.name)
+        state = "unknown" if cached is None else ("hit" if cached else "miss")
+        PROMPT_SECONDS.observe(seconds, template=self.name, prefix_cache=state)
+
+
+# MINDMAP GENERATE
+def _mindmap_generate_prefix() -> List[Dict[str, str]]:
+    system_prompt = """
+You are a mindmap generator for an educational app.
+
+You ALWAYS answer with ONLY valid JSON (no markdown, no comments, no backticks).
+
+Target schema (tree):
+
+{
+  "id": "root",
+  "label": string,
+  "children": [
+    {
+      "id": string,
+      "label": string,
+      "relation": string,   # 1–2 word arrow label describing relationship from parent to child
+      "children": [
+        { "id": string, "label": string, "relation": string, "children": [] }
+      ]
+    }
+  ]
+}
+
+Before you answer:
+1. Silently think step by step about:
+   - What is the main topic?
+   - 4–8 key subtopics.
+   - 1–4 concise details for each subtopic.
+   - For each child node choose a 1–2 word relationship label (e.g., "uses", "contains", "is a", "helps", "requires", "explains").
+2. Organize them into 2–3 levels of depth (root → subtopics → details).
+3. Then output ONLY the final JSON.
+""".strip()
+
+    # --- Few-shot examples (two examples) ---
+    example_topic_1 = "Basics of Computer Networks"
+
+    example_assistant_1 = {
+        "id": "root",
+        "label": "Computer Networks",
+        "children": [
+            {
+                "id": "n1",
+                "label": "Key Concepts",
+                "relation": "covers",
+                "children": [
+                    { "id": "n1a", "label": "Nodes (hosts, routers, switches)", "relation": "are", "children": [] },
+                    { "id": "n1b", "label": "Links (wired, wireless)", "relation": "connect", "children": [] }
+                ]
+            },
+            {
+                "id": "n2",
+                "label": "Layers (OSI view)",
+                "relation": "organizes",
+                "children": [
+                    { "id": "n2a", "label": "Physical + Data Link", "relation": "include", "children": [] },
+                    { "id": "n2b", "label": "Network (IP)", "relation": "routes", "children": [] },
+                    { "id": "n2c", "label": "Transport (TCP/UDP)", "relation": "ensures", "children": [] }
+                ]
+            }
+        ]
+    }
+
+    example_topic_2 = "Introduction to Machine Learning"
+
+    # Bigger / wider example for second few-shot
+    example_assistant_2 = {
+        "id": "root",
+        "label": "Machine Learning",
+        "children": [
+            {
+                "id": "m1",
+                "label": "Learning Types",
+                "relation": "includes",
+                "children": [
+                    { "id": "m1a", "label": "Supervised Learning", "relation": "uses", "children": [
+                        { "id": "m1a1", "label": "Regression", "relation": "predicts", "children": [] },
+                        { "id": "m1a2", "label": "Classification", "relation": "labels", "children": [] }
+                    ]},
+                    { "id": "m1b", "label": "Unsupervised Learning", "relation": "finds", "children": [
+                        { "id": "m1b1", "label": "Clustering", "relation": "groups", "children": [] },
+                        { "id": "m1b2", "label": "Dimensionality Reduction", "relation": "reduces", "children": [] }
+                    ]},
+                    { "id": "m1c", "label": "Reinforcement Learning", "relation": "trains", "children": [
+                        { "id": "m1c1", "label": "Agent-Environment", "relation": "interacts", "children": [] }
+                    ]}
+                ]
+            },
+            {
+                "id": "m2",
+                "label": "Algorithms",
+                "relation": "provides",
+                "children": [
+                    { "id": "m2a", "label": "Linear Models (Linear/Logistic)", "relation": "fit", "children": [] },
+                    { "id": "m2b", "label": "Tree-based (Decision Trees, RF)", "relation": "split", "children": [] },
+                    { "id": "m2c", "label": "SVM", "relation": "separates", "children": [] },
+                    { "id": "m2d", "label": "Neural Networks", "relation": "approximate", "children": [] }
+                ]
+            },
+            {
+                "id": "m3",
+                "label": "Model Evaluation",
+                "relation": "measures",
+                "children": [
+                    { "id": "m3a", "label": "Metrics (Accuracy, RMSE)", "relation": "use", "children": [] },
+                    { "id": "m3b", "label": "Validation (Cross-val)", "relation": "prevents", "children": [] },
+                    { "id": "m3c", "label": "Bias-Variance Tradeoff", "relation": "balances", "children": [] }
+                ]
+            },
+            {
+                "id": "m4",
+                "label": "Data",
+                "relation": "requires",
+                "children": [
+                    { "id": "m4a", "label": "Feature Engineering", "relation": "creates", "children": [] },
+                    { "id": "m4b", "label": "Data Cleaning", "relation": "fixes", "children": [] },
+                    { "id": "m4c", "label": "Datasets (Train/Test/Val)", "relation": "split", "children": [] }
+                ]
+            },
+            {
+                "id": "m5",
+                "label": "Deployment",
+                "relation": "enables",
+                "children": [
+                    { "id": "m5a", "label": "Model Serving", "relation": "delivers", "children": [] },
+                    { "id": "m5b", "label": "Monitoring", "relation": "tracks", "children": [] },
+                    { "id": "m5c", "label": "Versioning", "relation": "controls", "children": [] }
+                ]
+            }
+        ]
+    }
+
+    example_user_msg_1 = f"Create a mindmap in the required JSON tree schema for this topic:\n\n{example_topic_1}"
+    example_user_msg_2 = f"Create a mindmap in the required JSON tree schema for this topic:\n\n{example_topic_2}"
+
+    return [
+        {"role": "system", "content": system_prompt},
+
+        # few-shot pair 1
+        {"role": "user", "content": example_user_msg_1},
+        {"role": "assistant", "content": json.dumps(example_assistant_1, ensure_ascii=False)},
+
+        # few-shot pair 2 (larger/wider example)
+        {"role": "user", "content": example_user_msg_2},
+        {"role": "assistant", "content": json.dumps(example_assistant_2, ensure_ascii=False)},
+    ]
+
+
+def mindmap_generate_request(topic: str) -> str:
+    return f"""
+Create a mindmap in the required JSON tree schema for this topic or content:
+
+{topic}
+""".strip()
+
+
+# MINDMAP EXPLAIN
+def _mindmap_explain_prefix() -> List[Dict[str, str]]:
+    system_prompt = """
+You are a tutor who explains mindmaps in a clear, friendly way.
+
+Mindmap schema (tree):
+
+{
+  "id": "root",
+  "label": string,
+  "children": [
+    {
+      "id": string,
+      "label": string,
+      "relation": string,    # OPTIONAL: a 1-2 word arrow label describing relationship from parent to this child
+      "children": [ ... node schema recursively ... ]
+    }
+  ]
+}
+
+Before answering:
+1. Silently analyze the tree: root topic, main branches, relationships (the "relation" field on children), and important leaves.
+2. Plan a logical explanation: overview → main branches → key details. When a child node has a "relation" field, briefly incorporate that 1–2 word relationship into the explanation (for example: "Layer X — routes network traffic").
+3. Then write the explanation as plain text. Do NOT use Markdown, headings, bold, italics, bullets using asterisks, or other Markdown markers (no '#', '*', '```', or '**'). Use simple paragraphs and plain hyphenated lists where helpful.
+4. Use simple language, as if teaching a student.
+
+Do NOT modify the given JSON. Only explain it.
+""".strip()
+
+    # --- Few-shot examples (three examples: two minimal, one bigger/wider) ---
+    # Example 1 (minimal)
+    example_mindmap_1 = {
+        "id": "root",
+        "label": "HTTP Basics",
+        "children": [
+            {
+                "id": "h1",
+                "label": "Request-Response",
+                "relation": "follows",
+                "children": []
+            },
+            {
+                "id": "h2",
+                "label": "Methods",
+                "relation": "include",
+                "children": [
+                    {"id": "h2a", "label": "GET", "relation": "retrieves", "children": []},
+                    {"id": "h2b", "label": "POST", "relation": "submits", "children": []}
+                ]
+            }
+        ]
+    }
+    example_question_1 = "Explain this as if I'm new to web development."
+    example_user_1 = (
+        "Here is the mindmap JSON:\n\n"
+        + json.dumps(example_mindmap_1, ensure_ascii=False, indent=2)
+        + "\n\nUser question:\n"
+        + example_question_1
+    )
+    example_answer_1 = """
+Overview
+
+This mindmap is about HTTP Basics, the core idea behind web communication.
+
+Request-Response
+- HTTP works as a request-response model: the client sends a request and the server replies. (Relation: follows)
+
+Methods
+- The Methods branch lists common HTTP methods. (Relation: include)
+- GET — used to retrieve data from the server. (Relation: retrieves)
+- POST — used to submit data to the server (for example, form submissions). (Relation: submits)
+
+Quick tip
+- Remember: GET is for reading, POST is for sending or creating.
+""".strip()
+
+    # Example 2 (minimal)
+    example_mindmap_2 = {
+        "id": "root",
+        "label": "Git Basics",
+        "children": [
+            {
+                "id": "g1",
+                "label": "Workflow",
+                "relation": "follows",
+                "children": [
+                    {"id": "g1a", "label": "Clone", "relation": "creates", "children": []},
+                    {"id": "g1b", "label": "Commit", "relation": "records", "children": []},
+                    {"id": "g1c", "label": "Push", "relation": "sends", "children": []}
+                ]
+            }
+        ]
+    }
+    example_question_2 = "Explain this to a beginner who has never used version control."
+    example_user_2 = (
+        "Here is the mindmap JSON:\n\n"
+        + json.dumps(example_mindmap_2, ensure_ascii=False, indent=2)
+        + "\n\nUser question:\n"
+        + example_question_2
+    )
+    example_answer_2 = """
+Overview
+
+This mindmap covers Git Basics, a common version control workflow.
+
+Workflow
+- The Workflow node outlines typical steps. (Relation: follows)
+- Clone — creates a local copy of a repository from a remote. (Relation: creates)
+- Commit — records your changes locally with a message. (Relation: records)
+- Push — sends commits from your local repo to the remote repository. (Relation: sends)
+
+Quick tip
+- Think of clone → commit → push as: copy, save locally, then upload.
+""".strip()
+
+    # Example 3 (bigger / wider)
+    example_mindmap_3 = {
+        "id": "root",
+        "label": "Machine Learning Overview",
+        "children": [
+            {
+                "id": "m1",
+                "label": "Types",
+                "relation": "includes",
+                "children": [
+                    {"id": "m1a", "label": "Supervised", "relation": "uses", "children": [
+                        {"id": "m1a1", "label": "Regression", "relation": "predicts", "children": []},
+                        {"id": "m1a2", "label": "Classification", "relation": "labels", "children": []}
+                    ]},
+                    {"id": "m1b", "label": "Unsupervised", "relation": "finds", "children": [
+                        {"id": "m1b1", "label": "Clustering", "relation": "groups", "children": []},
+                        {"id": "m1b2", "label": "Dimensionality Reduction", "relation": "reduces", "children": []}
+                    ]},
+                    {"id": "m1c", "label": "Reinforcement", "relation": "trains", "children": []}
+                ]
+            },
+            {
+                "id": "m2",
+                "label": "Pipeline",
+                "relation": "comprises",
+                "children": [
+                    {"id": "m2a", "label": "Data Collection", "relation": "gathers", "children": []},
+                    {"id": "m2b", "label": "Preprocessing", "relation": "cleans", "children": []},
+                    {"id": "m2c", "label": "Modeling", "relation": "fits", "children": []},
+                    {"id": "m2d", "label": "Evaluation", "relation": "measures", "children": []},
+                    {"id": "m2e", "label": "Deployment", "relation": "serves", "children": []}
+                ]
+            },
+            {
+                "id": "m3",
+                "label": "Algorithms",
+                "relation": "provide",
+                "children": [
+                    {"id": "m3a", "label": "Linear Models", "relation": "fit", "children": []},
+                    {"id": "m3b", "label": "Decision Trees", "relation": "split", "children": []},
+                    {"id": "m3c", "label": "Neural Networks", "relation": "approximate", "children": []}
+                ]
+            }
+        ]
+    }
+    example_question_3 = "Explain this as an overview for someone learning ML for the first time."
+    example_user_3 = (
+        "Here is the mindmap JSON:\n\n"
+        + json.dumps(example_mindmap_3, ensure_ascii=False, indent=2)
+        + "\n\nUser question:\n"
+        + example_question_3
+    )
+    example_answer_3 = """
+Overview
+
+This mindmap gives a broad overview of Machine Learning, covering types, pipeline, and algorithms.
+
+1. Types (includes)
+- Supervised (Relation: uses) — learning with labeled data.
+  - Regression (Relation: predicts) — predicts numeric values.
+  - Classification (Relation: labels) — assigns categories.
+- Unsupervised (Relation: finds) — discovering patterns without labels.
+  - Clustering (Relation: groups) — groups similar items.
+  - Dimensionality Reduction (Relation: reduces) — simplifies features.
+- Reinforcement (Relation: trains) — learning by interacting with an environment using rewards.
+
+2. Pipeline (comprises)
+- Data Collection (Relation: gathers) — gather raw data.
+- Preprocessing (Relation: cleans) — clean and prepare data.
+- Modeling (Relation: fits) — fit algorithms to data.
+- Evaluation (Relation: measures) — measure performance with metrics.
+- Deployment (Relation: serves) — serve the trained model to users.
+
+3. Algorithms (provide)
+- Linear Models (Relation: fit) — simple and interpretable.
+- Decision Trees (Relation: split) — split data by features.
+- Neural Networks (Relation: approximate) — approximate complex functions.
+
+Final note
+- The short relation labels act like small arrow labels that summarize how nodes relate.
+""".strip()
+
+    return [
+        {"role": "system", "content": system_prompt},
+
+        # few-shot example 1 (minimal)
+        {"role": "user", "content": example_user_1},
+        {"role": "assistant", "content": example_answer_1},
+
+        # few-shot example 2 (minimal)
+        {"role": "user", "content": example_user_2},
+        {"role": "assistant", "content": example_answer_2},
+
+        # few-shot example 3 (bigger / wider)
+        {"role": "user", "content": example_user_3},
+        {"role": "assistant", "content": example_answer_3},
+    ]
+
+
+def mindmap_explain_request(mindmap, question: Optional[str]) -> str:
+    # the frontend sends the tree as an object; already-serialised JSON is used as-is
+    user_content = "Here is the mindmap JSON:\n\n"
+    if isinstance(mindmap, str):
+        user_content += mindmap
+    else:
+        user_content += json.dumps(mindmap, ensure_ascii=False, indent=2)
+
+    if question:
+        user_content += "\n\nUser question:\n" + question
+    return user_content
+
+
+# REGISTRY (built once, at import)
+MINDMAP_GENERATE = PromptTemplate("mindmap_generate", _mindmap_generate_prefix())
+MINDMAP_EXPLAIN = PromptTemplate("mindmap_explain", _mindmap_explain_prefix())
+
+TEMPLATES = {t.name: t for t in (MINDMAP_GENERATE, MINDMAP_EXPLAIN)}
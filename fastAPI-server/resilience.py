@@ -0,0 +1,371 @@
+# resilience.py
+import asyncio
+import email.utils
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import Counter, Gauge
+
+# Retries per model: attempts (1 = no retry), jittered exponential backoff
+# and the longest Retry-After we are willing to sleep for before moving
+# on to the next model in the fallback chain instead.
+LLM_RETRY_ATTEMPTS = int(os.environ.get("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.environ.get("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.environ.get("LLM_RETRY_MAX_SECONDS", "8"))
+LLM_RETRY_MAX_AFTER_SECONDS = float(os.environ.get("LLM_RETRY_MAX_AFTER_SECONDS", "10"))
+LLM_RETRY_DEADLINE_SECONDS = float(os.environ.get("LLM_RETRY_DEADLINE_SECONDS", "60"))
+
+# Ordered fallback chain: comma-separated model names starting with a
+# prefix get_llm knows (llm_endpoint.PROVIDERS), tried in order
+# once the requested model has failed with retryable errors. Each uses
+# <PROVIDER>_API_KEY from the environment; the caller's key is only reused
+# for models of the caller's own provider, others without a key are skipped.
+LLM_FALLBACK_MODELS = [m.strip() for m in os.environ.get("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+
+# Circuit breakers: after this many consecutive retryable failures a
+# provider takes no traffic for LLM_BREAKER_RESET_SECONDS, then a single
+# trial call decides whether it is closed again.
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Hedging: if a call has not returned after LLM_HEDGE_AFTER_MS (a number,
+# or "p95" for the provider's observed p95 latency), a second request goes
+# to the same model ("same") or the next model in the chain ("fallback").
+# Empty disables hedging. At most LLM_HEDGE_BUDGET of recent calls hedge.
+LLM_HEDGE_AFTER_MS = os.environ.get("LLM_HEDGE_AFTER_MS", "").strip().lower()
+LLM_HEDGE_TARGET = os.environ.get("LLM_HEDGE_TARGET", "fallback")
+LLM_HEDGE_BUDGET = float(os.environ.get("LLM_HEDGE_BUDGET", "0.05"))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a retryable error.", ("provider", "reason"))
+LLM_FALLBACKS = Counter("llm_fallbacks_total", "Requests answered by a fallback model.", ("provider",))
+LLM_BREAKER_STATE = Gauge("llm_breaker_open", "1 while a provider's circuit breaker is open.", ("provider",))
+LLM_BREAKER_REJECTED = Counter("llm_breaker_rejected_total", "Calls skipped because the circuit breaker was open.", ("provider",))
+LLM_CALLS = Counter("llm_hedge_eligible_total", "LLM calls that could have been hedged.", ("provider",))
+LLM_HEDGES = Counter("llm_hedges_total", "Hedge requests sent (hedge rate = this / llm_hedge_eligible_total).", ("provider",))
+LLM_HEDGE_WINS = Counter("llm_hedge_wins_total", "Hedged calls by which request answered first.", ("provider", "winner"))
+
+_RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+class ProviderUnavailable(Exception):
+    """Every model in the chain failed with retryable errors or is switched off."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMTarget(NamedTuple):
+    model: str
+    provider: str
+    call: Callable[[], Awaitable[Any]]
+
+
+# ERROR CLASSIFICATION
+def _status_code(exc: BaseException) -> Optional[int]:
+    for obj in (exc, getattr(exc, "response", None)):
+        for attr in ("status_code", "code", "status"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+        if headers is not None:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        # HTTP-date form
+        return max(0.0, email.utils.parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(exc: BaseException) -> Tuple[Optional[str], Optional[float]]:
+    """
+    (reason, retry_after) for a retryable error, (None, None) otherwise.
+    Rate limits, overload, 5xx, timeouts and dropped connections are
+    retryable; other client errors are not and fail the request as before.
+    """
+    reason = getattr(exc, "retry_reason", None)
+    if isinstance(reason, str):
+        # errors of our own that declare themselves retryable (llm_endpoint.LLMBusy)
+        return reason, _retry_after(exc)
+
+    status = _status_code(exc)
+    if status is not None:
+        if status in _RETRYABLE_STATUS:
+            return str(status), _retry_after(exc)
+        return None, None
+
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return "timeout" if "Timeout" in type(exc).__name__ else "connection", None
+    # httpx / provider SDK transport errors, without importing every SDK
+    name = type(exc).__name__
+    if "Timeout" in name:
+        return "timeout", None
+    if "Connect" in name or "RemoteProtocol" in name or name == "ReadError":
+        return "connection", None
+    return None, None
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff for the given retry (0-based).
+    """
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+# CIRCUIT BREAKERS
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker: closed -> open after failure_threshold
+    retryable failures, open -> half-open after reset_seconds, where one
+    trial call closes it again (success) or re-opens it (failure).
+    """
+
+    def __init__(self, provider: str, failure_threshold: int, reset_seconds: float):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        LLM_BREAKER_STATE.set(0, provider=self.provider)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            LLM_BREAKER_STATE.set(1, provider=self.provider)
+        self.trial_running = False
+
+    def release(self):
+        """
+        The call ended without telling us anything (cancelled, or failed
+        for a non-provider reason); let another trial call through.
+        """
+        self.trial_running = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker(provider: str) -> CircuitBreaker:
+    b = _breakers.get(provider)
+    if b is None:
+        b = _breakers[provider] = CircuitBreaker(provider, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+    return b
+
+
+# HEDGING
+class Hedger:
+    """
+    Decides when to hedge: after a fixed delay or the provider's observed
+    p95 latency, and only while hedges stay under budget (a fraction of the
+    last `window` calls).
+    """
+
+    def __init__(self, after_ms: str, budget: float, window: int = 200):
+        self.after_ms = after_ms
+        self.budget = budget
+        self._decisions: deque = deque(maxlen=window)
+        self._latencies: Dict[str, deque] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.after_ms) and self.budget > 0
+
+    def observe(self, provider: str, seconds: float):
+        samples = self._latencies.get(provider)
+        if samples is None:
+            samples = self._latencies[provider] = deque(maxlen=500)
+        samples.append(seconds)
+
+    def delay(self, provider: str) -> Optional[float]:
+        if self.after_ms == "p95":
+            samples = self._latencies.get(provider)
+            if samples is None or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return float(self.after_ms) / 1000.0
+
+    def record_call(self, hedged: bool):
+        self._decisions.append(hedged)
+
+    def within_budget(self) -> bool:
+        if not self._decisions:
+            return self.budget > 0
+        return (sum(self._decisions) + 1) / (len(self._decisions) + 1) <= self.budget
+
+
+hedger = Hedger(LLM_HEDGE_AFTER_MS, LLM_HEDGE_BUDGET)
+
+
+async def _guarded(target: LLMTarget) -> Any:
+    """
+    One call to a target, feeding its circuit breaker and latency samples.
+    """
+    b = breaker(target.provider)
+    started = time.perf_counter()
+    try:
+        resp = await target.call()
+    except asyncio.CancelledError:
+        b.release()
+        raise
+    except Exception as e:
+        reason, _ = classify(e)
+        if reason is not None and reason != "busy":
+            b.record_failure()
+        else:
+            b.release()
+        raise
+    b.record_success()
+    hedger.observe(target.provider, time.perf_counter() - started)
+    return resp
+
+
+async def _call_hedged(target: LLMTarget, alternates: List[LLMTarget]) -> Tuple[Any, LLMTarget]:
+    if not hedger.enabled:
+        return await _guarded(target), target
+
+    LLM_CALLS.inc(provider=target.provider)
+    delay = hedger.delay(target.provider)
+    primary = asyncio.ensure_future(_guarded(target))
+    if delay is None:
+        hedger.record_call(False)
+        return await primary, target
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    if done or not hedger.within_budget():
+        hedger.record_call(False)
+        return await primary, target
+
+    hedge_target = target
+    if LLM_HEDGE_TARGET == "fallback":
+        hedge_target = next((t for t in alternates if breaker(t.provider).allow()), target)
+
+    hedger.record_call(True)
+    LLM_HEDGES.inc(provider=target.provider)
+    hedge = asyncio.ensure_future(_guarded(hedge_target))
+    owners = {primary: ("primary", target), hedge: ("hedge", hedge_target)}
+
+    pending = set(owners)
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner, winner_target = owners[task]
+                    LLM_HEDGE_WINS.inc(provider=target.provider, winner=winner)
+                    return task.result(), winner_target
+                if first_error is None or task is primary:
+                    first_error = task.exception()
+    finally:
+        # the slower request is cancelled as soon as one has answered
+        for task in pending:
+            task.cancel()
+
+    raise first_error
+
+
+# RESILIENT CALL
+async def call_resilient(targets: List[LLMTarget]) -> Tuple[Any, LLMTarget]:
+    """
+    Call the first target, retrying retryable errors with jittered
+    exponential backoff (or the server's Retry-After, if it is short
+    enough), then move down the fallback chain. Providers whose circuit
+    breaker is open are skipped. Non-retryable errors are raised at once;
+    when the chain is exhausted, ProviderUnavailable carries the shortest
+    Retry-After seen. Returns the response and the target that produced it.
+    """
+    deadline = time.monotonic() + LLM_RETRY_DEADLINE_SECONDS
+    retry_after_hint: Optional[float] = None
+    last_error: Optional[BaseException] = None
+
+    for index, target in enumerate(targets):
+        b = breaker(target.provider)
+        if not b.allow():
+            LLM_BREAKER_REJECTED.inc(provider=target.provider)
+            retry_after_hint = _shortest(retry_after_hint, b.retry_in())
+            continue
+
+        for attempt in range(max(1, LLM_RETRY_ATTEMPTS)):
+            try:
+                resp, used = await _call_hedged(target, targets[index + 1:])
+                if index > 0 or used is not target:
+                    LLM_FALLBACKS.inc(provider=used.provider)
+                return resp, used
+            except Exception as e:
+                reason, retry_after = classify(e)
+                if reason is None:
+                    raise
+                last_error = e
+                retry_after_hint = _shortest(retry_after_hint, retry_after)
+
+                if reason == "busy" or attempt + 1 >= LLM_RETRY_ATTEMPTS:
+                    break  # our own queue for this provider is full; do not wait on it
+                if not breaker(target.provider).allow():
+                    break
+                if retry_after is not None and retry_after > LLM_RETRY_MAX_AFTER_SECONDS:
+                    break  # the provider asked for a long pause; try the next model
+                wait = max(retry_after or 0.0, backoff_delay(attempt))
+                if time.monotonic() + wait > deadline:
+                    break
+                LLM_RETRIES.inc(provider=target.provider, reason=reason)
+                await asyncio.sleep(wait)
+
+    message = f"All LLM providers failed: {last_error}" if last_error else "All LLM providers are unavailable."
+    raise ProviderUnavailable(message, retry_after_hint)
+
+
+def _shortest(current: Optional[float], new: Optional[float]) -> Optional[float]:
+    if new is None:
+        return current
+    return new if current is None else min(current, new)
@@ -0,0 +1,56 @@
+# singleflight.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from metrics import Counter, Gauge
+
+SINGLEFLIGHT_CALLS = Counter(
+    "singleflight_calls_total",
+    "Calls through a single-flight group: role=leader ran the work, role=follower shared a leader's result.",
+    ("group", "role"),
+)
+SINGLEFLIGHT_IN_FLIGHT = Gauge("singleflight_in_flight", "Distinct keys currently being computed.", ("group",))
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key onto one execution.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs wait for that task and get the same result or exception.
+    The task is shielded, so a caller that goes away (client disconnect)
+    does not cancel the call the others are waiting for. Nothing is kept
+    once the task finishes; caching results is up to the caller.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        entry = self._calls.get(key)
+
+        # a task from another event loop cannot be awaited here
+        if entry is not None and entry[0] is loop and not entry[1].done():
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role="follower")
+            return await asyncio.shield(entry[1])
+
+        SINGLEFLIGHT_CALLS.inc(group=self.name, role="leader")
+        task = loop.create_task(fn())
+        self._calls[key] = (loop, task)
+        SINGLEFLIGHT_IN_FLIGHT.inc(group=self.name)
+        task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Future):
+        SINGLEFLIGHT_IN_FLIGHT.dec(group=self.name)
+        entry = self._calls.get(key)
+        if entry is not None and entry[1] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark the exception as retrieved even if every waiter has gone
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,289 @@
+# tree_stream.py
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from mindmap_tree import UniqueIds, node_label, node_relation
+
+_WHITESPACE = " \t\r\n"
+_STRING_STOP = re.compile(r'["\\]')
+_LITERAL_END = re.compile(r'[\s,\]}]')
+
+
+class StreamParseError(Exception):
+    """The streamed reply is not valid JSON."""
+
+
+class _Frame:
+    __slots__ = (
+        "is_object", "value", "key", "expect", "is_node", "emitted", "parent_id", "is_children", "index",
+        "depth", "dropped",
+    )
+
+    def __init__(
+        self, is_object: bool, value, is_node=False, parent_id=None, is_children=False, index=0, depth=0, dropped=False
+    ):
+        self.is_object = is_object
+        self.value = value
+        self.key: Optional[str] = None
+        self.expect = "first"
+        self.is_node = is_node
+        self.emitted = False
+        self.parent_id = parent_id
+        self.is_children = is_children
+        self.index = index
+        # depth of the node (of the owning node, for a children array)
+        self.depth = depth
+        # inside a subtree normalise_tree drops; nothing in it is reported
+        self.dropped = dropped
+
+
+class TreeStreamParser:
+    """
+    Incremental parser for a mindmap tree produced token by token.
+
+    feed() takes the next piece of the LLM reply and returns the nodes that
+    became known in it, as {"id", "label", "relation", "parent_id"} dicts.
+    A node is reported once its "children" array starts, or when the node
+    object closes if its id or label was not known by then. With "children"
+    as the last field, as in our schema, parents are reported before their
+    children.
+
+    Reported nodes look like normalise_tree's output for the same limits:
+    labels are trimmed, relations filled in, and nodes it would drop (no
+    label, past max_children or max_depth, over max_nodes) are not
+    reported. Missing and duplicate ids are replaced by the same rule
+    (UniqueIds) and written back into the assembled tree, so the
+    normalised result keeps the reported ids. max_nodes is counted in
+    reply order, while normalise_tree keeps the shallowest nodes; that and
+    other fixes only it makes show up in its fix counts.
+
+    Anything before the first "{" (prose, a ```json fence) and anything
+    after the root object is ignored. Raises StreamParseError on input that
+    cannot be JSON; the caller can still fall back to parsing the full text.
+    """
+
+    def __init__(self, max_depth: int = 6, max_children: int = 12, max_nodes: int = 300, max_label_chars: int = 120):
+        self.max_depth = max_depth
+        self.max_children = max_children
+        self.max_nodes = max_nodes
+        self.max_label_chars = max_label_chars
+        self.reported = 0
+        self.root: Any = None
+        self.done = False
+        self._started = False
+        self._stack: List[_Frame] = []
+        self._ids = UniqueIds()
+        # pending string / literal token: (kind, chunks, escaped)
+        self._token: Optional[str] = None
+        self._chunks: List[str] = []
+        self._escaped = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        nodes: List[Dict[str, Any]] = []
+        i, n = 0, len(text)
+
+        while i < n and not self.done:
+            if self._token == "string":
+                i = self._read_string(text, i)
+                continue
+            if self._token == "literal":
+                i = self._read_literal(text, i)
+                continue
+
+            ch = text[i]
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    continue
+                i += 1
+                continue
+
+            if ch in _WHITESPACE:
+                i += 1
+            elif ch == "{":
+                self._open(True, nodes)
+                i += 1
+            elif ch == "[":
+                self._open(False, nodes)
+                i += 1
+            elif ch == "}" or ch == "]":
+                self._close(ch == "}", nodes)
+                i += 1
+            elif ch == ",":
+                top = self._top()
+                if top.expect != "comma":
+                    raise StreamParseError("Unexpected ','.")
+                top.expect = "key" if top.is_object else "value"
+                i += 1
+            elif ch == ":":
+                top = self._top()
+                if not top.is_object or top.expect != "colon":
+                    raise StreamParseError("Unexpected ':'.")
+                top.expect = "value"
+                i += 1
+            elif ch == '"':
+                self._token, self._chunks, self._escaped = "string", [], False
+                i += 1
+            else:
+                self._expect_value()
+                self._token, self._chunks = "literal", []
+
+        return nodes
+
+    def result(self) -> Any:
+        """
+        The fully assembled tree (only meaningful once done is True).
+        """
+        return self.root
+
+    # TOKENS
+    def _read_string(self, text: str, i: int) -> int:
+        n = len(text)
+        while i < n:
+            if self._escaped:
+                self._chunks.append(text[i])
+                self._escaped = False
+                i += 1
+                continue
+            m = _STRING_STOP.search(text, i)
+            if m is None:
+                self._chunks.append(text[i:])
+                return n
+            j = m.start()
+            self._chunks.append(text[i:j])
+            if text[j] == "\\":
+                self._chunks.append("\\")
+                self._escaped = True
+                i = j + 1
+                continue
+
+            raw = "".join(self._chunks)
+            self._token = None
+            try:
+                value = json.loads('"' + raw + '"')
+            except ValueError as e:
+                raise StreamParseError(str(e))
+            self._string_done(value)
+            return j + 1
+        return n
+
+    def _read_literal(self, text: str, i: int) -> int:
+        m = _LITERAL_END.search(text, i)
+        if m is None:
+            self._chunks.append(text[i:])
+            return len(text)
+        self._chunks.append(text[i:m.start()])
+        raw = "".join(self._chunks)
+        self._token = None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            raise StreamParseError(f"Invalid literal {raw!r}.")
+        self._put(value)
+        return m.start()
+
+    # STRUCTURE
+    def _top(self) -> _Frame:
+        if not self._stack:
+            raise StreamParseError("Unexpected character after the root value.")
+        return self._stack[-1]
+
+    def _expect_value(self):
+        if not self._stack:
+            return
+        top = self._stack[-1]
+        if top.is_object and top.expect != "value":
+            raise StreamParseError("Expected an object key.")
+        if not top.is_object and top.expect not in ("first", "value"):
+            raise StreamParseError("Expected ',' or ']'.")
+
+    def _string_done(self, value: str):
+        top = self._stack[-1] if self._stack else None
+        if top is not None and top.is_object and top.expect in ("first", "key"):
+            top.key = value
+            top.expect = "colon"
+        else:
+            self._put(value)
+
+    def _put(self, value):
+        self._expect_value()
+        top = self._stack[-1]
+        if top.is_object:
+            top.value[top.key] = value
+            top.key = None
+        else:
+            top.value.append(value)
+        top.expect = "comma"
+
+    def _open(self, is_object: bool, nodes: List[Dict[str, Any]]):
+        self._expect_value()
+        parent = self._stack[-1] if self._stack else None
+        value: Any = {} if is_object else []
+
+        if is_object:
+            # the root and every object directly inside a node's "children" is a node
+            is_node = parent is None or parent.is_children
+            if parent is None:
+                frame = _Frame(True, value, is_node=True)
+            elif is_node:
+                index, depth = len(parent.value), parent.depth + 1
+                dropped = parent.dropped or index >= self.max_children or depth > self.max_depth
+                frame = _Frame(
+                    True, value, is_node=True, parent_id=parent.parent_id, index=index, depth=depth, dropped=dropped
+                )
+            else:
+                frame = _Frame(True, value, depth=parent.depth, dropped=parent.dropped)
+        else:
+            is_children = parent is not None and parent.is_object and parent.is_node and parent.key == "children"
+            if is_children and "id" in parent.value and node_label(parent.value, self.max_label_chars) is not None:
+                self._emit(parent, nodes)
+            owner_id = parent.value.get("id") if is_children else None
+            frame = _Frame(
+                False,
+                value,
+                parent_id=owner_id,
+                is_children=is_children,
+                depth=parent.depth if parent else 0,
+                dropped=parent.dropped if parent else False,
+            )
+
+        if parent is None:
+            self.root = value
+        elif parent.is_object:
+            parent.value[parent.key] = value
+            parent.key = None
+        else:
+            parent.value.append(value)
+
+        self._stack.append(frame)
+
+    def _close(self, is_object: bool, nodes: List[Dict[str, Any]]):
+        top = self._top()
+        if top.is_object != is_object or top.expect not in ("first", "comma"):
+            raise StreamParseError("Unexpected '%s'." % ("}" if is_object else "]"))
+        if top.is_node:
+            self._emit(top, nodes)
+
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1].expect = "comma"
+        else:
+            self.done = True
+
+    def _emit(self, frame: _Frame, nodes: List[Dict[str, Any]]):
+        if frame.emitted or frame.dropped:
+            return
+        label = node_label(frame.value, self.max_label_chars)
+        if label is None or self.reported >= self.max_nodes:
+            return
+        frame.emitted = True
+        self.reported += 1
+
+        frame.value["id"] = self._ids.take(frame.value.get("id"), frame.parent_id, frame.index)[0]
+        relation = None
+        if frame.depth > 0:
+            relation = node_relation(frame.value)
+            if relation is None:
+                relation = ""
+        nodes.append({"id": frame.value["id"], "label": label, "relation": relation, "parent_id": frame.parent_id})
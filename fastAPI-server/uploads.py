@@ -0,0 +1,128 @@
+# uploads.py
+import io
+import mmap
+import os
+from typing import Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from metrics import Gauge
+
+UPLOAD_BUFFERED_BYTES = Gauge(
+    "upload_buffered_bytes",
+    "Bytes of uploads currently held by handlers, in memory or mapped from spooled temp files.",
+    ("tier",),
+)
+
+
+# REQUEST BODY CAP
+class UploadLimitMiddleware:
+    """
+    Caps the request body of upload routes while it is being received.
+
+    A declared content-length over the cap is rejected before anything is
+    read. Otherwise the body is counted chunk by chunk (this also covers
+    chunked uploads that send no content-length) and the request fails with
+    413 as soon as the cap is crossed, before the rest is spooled.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    response = JSONResponse({"detail": "File too large"}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # re-raised as-is by FastAPI's body parsing -> 413
+                    raise HTTPException(status_code=413, detail="File too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# UPLOADED FILE
+class Upload:
+    """
+    One uploaded file, ready for fitz / PIL without another copy.
+
+    Small files (still inside Starlette's in-memory spool) are read into a
+    single bytes object. Files that were spooled to disk are mapped
+    read-only, so they never have to be loaded into the heap.
+    """
+
+    def __init__(self, data, size: int, file=None, mapping: Optional[mmap.mmap] = None):
+        self.data = data
+        self.size = size
+        self._file = file
+        self._mmap = mapping
+
+    @property
+    def on_disk(self) -> bool:
+        return self._mmap is not None
+
+    def stream(self):
+        """
+        Seekable file object over the upload (for PIL.Image.open).
+        """
+        if self._file is not None:
+            self._file.seek(0)
+            return self._file
+        return io.BytesIO(self.data)
+
+    def close(self):
+        if self.data is None:
+            return
+        UPLOAD_BUFFERED_BYTES.dec(self.size, tier="disk" if self.on_disk else "memory")
+        if self._mmap is not None:
+            self.data.release()
+            self._mmap.close()
+        self.data = None
+
+
+async def read_upload(file: UploadFile, limit: int) -> Upload:
+    """
+    Check the stored size of an uploaded file against limit and expose its
+    bytes as an Upload. Raises HTTPException(413) when it is too large.
+    """
+    f = file.file
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+
+    if size > limit:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    # same check Starlette's UploadFile uses for SpooledTemporaryFile
+    on_disk = getattr(f, "_rolled", True) and size > 0
+    if on_disk:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, io.UnsupportedOperation):
+            on_disk = False
+
+    if on_disk:
+        upload = Upload(memoryview(mapping), size, file=f, mapping=mapping)
+    else:
+        upload = Upload(await file.read(), size)
+
+    UPLOAD_BUFFERED_BYTES.inc(size, tier="disk" if on_disk else "memory")
+    return upload
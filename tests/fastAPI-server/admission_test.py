@@ -0,0 +1,134 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import admission  # noqa: E402
+from admission import AdmissionMiddleware, EndpointClass, TokenBuckets  # noqa: E402
+
+
+def endpoint_class(**overrides):
+    settings = dict(rate=0, burst=0, max_in_flight=0, max_queue=0, max_wait=1.0)
+    settings.update(overrides)
+    return EndpointClass("test", **settings)
+
+
+def make_app(cls):
+    app = FastAPI()
+
+    @app.post("/work")
+    async def work(request: Request):
+        body = await request.json()
+        return {"echo": body}
+
+    @app.get("/free")
+    def free():
+        return {"ok": True}
+
+    app.add_middleware(AdmissionMiddleware, routes={"/work": cls})
+    return TestClient(app)
+
+
+def test_token_bucket_allows_burst_then_waits(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    buckets = TokenBuckets(rate=2, burst=3)
+
+    assert [buckets.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a") == pytest.approx(0.5)
+    # other clients have their own bucket
+    assert buckets.take("b") == 0.0
+
+    now[0] += 0.5
+    assert buckets.take("a") == 0.0
+
+
+def test_token_buckets_keep_recent_clients_only():
+    buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+    for key in ("a", "b", "c"):
+        buckets.take(key)
+    assert list(buckets._buckets) == ["b", "c"]
+
+
+def test_client_key_is_the_address_not_the_api_key():
+    ip = "ip:1.2.3.4"
+    assert admission.client_key({"headers": [(b"x-api-key", b"secret")], "client": ("1.2.3.4", 1)}) == ip
+    assert admission.client_key({"headers": [(b"authorization", b"Bearer other")], "client": ("1.2.3.4", 2)}) == ip
+    assert admission.client_key({"headers": []}) == "ip:unknown"
+
+
+def test_in_flight_slots_queue_in_order():
+    cls = endpoint_class(max_in_flight=1, max_queue=2, max_wait=1.0)
+    order = []
+
+    async def job(name):
+        assert await cls.acquire() is None
+        order.append(name)
+        await asyncio.sleep(0.01)
+        cls.release()
+
+    async def run():
+        await asyncio.gather(job("a"), job("b"), job("c"))
+
+    asyncio.run(run())
+    assert order == ["a", "b", "c"]
+    assert cls.in_flight == 0
+
+
+def test_full_queue_and_long_wait_are_rejected():
+    cls = endpoint_class(max_in_flight=1, max_queue=1, max_wait=0.02)
+
+    async def run():
+        assert await cls.acquire() is None
+        waiting = asyncio.ensure_future(cls.acquire())
+        await asyncio.sleep(0)
+        full = await cls.acquire()
+        timed_out = await waiting
+        return full, timed_out
+
+    assert asyncio.run(run()) == ("queue_full", "queue_timeout")
+    assert cls.in_flight == 1
+
+
+def test_middleware_answers_429_over_rate():
+    client = make_app(endpoint_class(rate=0.5, burst=2))
+
+    codes = [client.post("/work", json={"n": i}).status_code for i in range(3)]
+    r = client.post("/work", json={})
+
+    assert codes == [200, 200, 429]
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
+    # other routes are not limited
+    assert client.get("/free").status_code == 200
+
+
+def test_middleware_rotated_keys_share_one_bucket():
+    client = make_app(endpoint_class(rate=0.5, burst=1))
+
+    assert client.post("/work", json={"api_key": "a"}, headers={"X-API-Key": "a"}).status_code == 200
+    # a new key per request does not buy a new bucket
+    assert client.post("/work", json={"api_key": "b"}, headers={"X-API-Key": "b"}).status_code == 429
+    assert client.post("/work", json={}, headers={"Authorization": "Bearer c"}).status_code == 429
+
+
+def test_middleware_sheds_when_busy():
+    cls = endpoint_class(max_in_flight=1, max_queue=0)
+    client = make_app(cls)
+    cls.in_flight = 1  # somebody else holds the only slot
+
+    r = client.post("/work", json={})
+
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+    assert admission.ADMISSION_REJECTED.value(endpoint_class="test", reason="queue_full") >= 1
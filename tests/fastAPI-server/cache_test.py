@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import cache  # noqa: E402
+
+
+def test_content_key_depends_on_bytes_and_settings():
+    k = cache.content_key(b"abc", "pdf", "text")
+    assert k == cache.content_key(b"abc", "pdf", "text")
+    assert k != cache.content_key(b"abd", "pdf", "text")
+    assert k != cache.content_key(b"abc", "image", ["en"])
+
+
+def test_memory_lru_bounded_by_bytes():
+    lru = cache.MemoryLRU(max_bytes=10)
+    assert lru.set("a", b"1234") == 0
+    assert lru.set("b", b"1234") == 0
+    lru.get("a")  # a is now most recently used
+    assert lru.set("c", b"1234") == 1
+    assert lru.get("b") is None
+    assert lru.get("a") == b"1234" and lru.get("c") == b"1234"
+    assert lru.bytes == 8
+
+    # larger than the whole cache: not stored
+    assert lru.set("big", b"x" * 11) == 0
+    assert lru.get("big") is None
+
+
+def test_result_cache_disk_tier_shared_and_counted(tmp_path):
+    db = str(tmp_path / "cache.sqlite3")
+    first = cache.ResultCache("t-disk", max_bytes=1024, db_path=db, db_max_bytes=1024)
+    second = cache.ResultCache("t-disk", max_bytes=1024, db_path=db, db_max_bytes=1024)
+
+    async def run():
+        assert await first.get("k") is None
+        await first.set("k", {"text": "hello"})
+        # another worker sees it through the SQLite file
+        return await second.get("k")
+
+    assert asyncio.run(run()) == {"text": "hello"}
+    assert cache.CACHE_MISSES.value(cache="t-disk") == 1
+    assert cache.CACHE_HITS.value(cache="t-disk", tier="disk") == 1
+
+
+def test_sqlite_store_evicts_least_recently_used(tmp_path):
+    store = cache.SQLiteStore(str(tmp_path / "c.sqlite3"), max_bytes=10)
+    store.set("a", b"12345")
+    store.set("b", b"12345")
+    assert store.set("c", b"12345") == 1
+    assert store.get("a") is None
+    assert store.get("c") == b"12345"
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+
+    result_cache = cache.ResultCache("t-ttl", max_bytes=1024, db_path=str(tmp_path / "t.sqlite3"), db_max_bytes=1024, ttl=60)
+
+    async def run():
+        await result_cache.set("k", "v")
+        now[0] += 59
+        fresh = await result_cache.get("k")
+        now[0] += 2
+        result_cache.memory.clear()  # a restart: only the SQLite tier is left
+        return fresh, await result_cache.get("k")
+
+    assert asyncio.run(run()) == ("v", None)
+
+
+def test_memory_lru_expired_entry_is_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+
+    lru = cache.MemoryLRU(max_bytes=100)
+    lru.set("a", b"1234", expires=1010.0)
+    assert lru.get("a") == b"1234"
+    now[0] = 1010.0
+    assert lru.get("a") is None
+    assert lru.bytes == 0 and len(lru) == 0
+
+
+def test_sqlite_store_adds_expiry_column_to_old_files(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+    conn.execute("INSERT INTO cache VALUES ('k', x'01', 1, 0)")
+    conn.commit()
+    conn.close()
+
+    store = cache.SQLiteStore(path, max_bytes=100)
+    assert store.get("k") == b"\x01"
@@ -0,0 +1,92 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from json_extract import find_json, strip_trailing_commas  # noqa: E402
+
+with open(os.path.join(TESTS_DIR, "data", "llm_json_replies.json"), encoding="utf-8") as f:
+    CORPUS = json.load(f)
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=[c["name"] for c in CORPUS])
+def test_corpus(case):
+    found = find_json(case["reply"], repair=True)
+    if case["expected"] is None:
+        assert found is None
+    else:
+        value, text = found
+        assert value == case["expected"]
+        assert json.loads(text) == value
+
+
+def test_without_repair_trailing_commas_are_rejected():
+    assert find_json('{"a": [1, 2,]}') is None
+    assert find_json('{"a": [1, 2,]}', repair=True)[0] == {"a": [1, 2]}
+
+
+def test_strip_trailing_commas_leaves_strings_alone():
+    assert strip_trailing_commas('{"a": ",}", "b": [1,],}') == '{"a": ",}", "b": [1]}'
+
+
+def test_finds_arrays_when_asked():
+    assert find_json("list: [1, 2] and {\"a\": 1}", starts="[{")[0] == [1, 2]
+
+
+def test_broken_root_is_not_replaced_by_a_child():
+    reply = (
+        '{"id": "root", "label": "Topic", "children": [\n'
+        '  # the first branch\n'
+        '  {"id": "n0", "label": "Branch", "children": []}\n'
+        "]}"
+    )
+    assert find_json(reply, repair=True) is None
+    assert find_json(reply) is None
+
+
+def test_braces_in_prose_are_stepped_over():
+    reply = 'Use {placeholders} or {"broken": } like this: {"id": "root", "children": []}'
+    assert find_json(reply, repair=True)[0] == {"id": "root", "children": []}
+
+
+def test_unrepairable_truncated_reply_gives_up_without_rescanning():
+    # only the outer value is bracket-matched, not every brace inside it
+    reply = '{"id": "root", "children": [' + '{"id": "n", "label": "x" # , ' * 2000
+    assert find_json(reply, repair=True) is None
+
+
+def _mutations(text, rng):
+    yield text[: rng.randrange(len(text) + 1)]  # truncated anywhere
+    i = rng.randrange(len(text) + 1)
+    yield text[:i] + rng.choice("{}[],\":\\ ") + text[i:]  # stray character
+    yield "".join(c for c in text if rng.random() > 0.02)  # dropped characters
+    yield rng.choice(["```json\n", "Sure! {x} ", "", "}{"]) + text + rng.choice(["\n```", " {", "", "]"])
+
+
+def test_fuzz_never_raises_and_returns_valid_json():
+    rng = random.Random(1234)
+    seeds = [case["reply"] for case in CORPUS if case["reply"]]
+
+    for _ in range(300):
+        for mutated in _mutations(rng.choice(seeds), rng):
+            found = find_json(mutated, repair=True)
+            if found is not None:
+                value, text = found
+                assert json.loads(text) == value
+
+
+def test_fuzz_truncated_tree_keeps_root():
+    reply = next(c["reply"] for c in CORPUS if c["name"] == "plain")
+    first_comma = reply.index(",")
+    for cut in range(first_comma + 1, len(reply)):
+        value, _ = find_json(reply[:cut], repair=True)
+        assert value["id"] == "root"
@@ -4,6 +4,9 @@ import types
 import io
 import json
 import asyncio
+import signal
+import threading
+import time
 import numpy as np
 import pytest
 from fastapi.testclient import TestClient
@@ -18,6 +21,10 @@ SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
 if SRC_DIR not in sys.path:
     sys.path.insert(0, SRC_DIR)
 
+# Run OCR and PDF parsing in-process so the fakes below are used (no worker processes)
+os.environ.setdefault("OCR_WORKERS", "0")
+os.environ.setdefault("PDF_WORKERS", "0")
+
 # Fake heavy deps BEFORE importing main / llm_endpoint
 
 
@@ -48,19 +55,39 @@ fake_PIL = types.ModuleType("PIL")
 fake_Image_mod = types.ModuleType("PIL.Image")
 
 
-def _fake_image_open(stream):
-    class Dummy:
-        def convert(self, mode):
-            # Something numpy.array can accept
-            return np.zeros((2, 2, 3), dtype=np.uint8)
+class DummyImage:
+    """Just enough of a PIL image for the pre-processing pipeline"""
+
+    def __init__(self, size=(4, 4), mode="RGB", format=None):
+        self.size = size
+        self.mode = mode
+        self.format = format
+        self.drafted = None
+
+    def draft(self, mode, size):
+        self.drafted = size
 
-    return Dummy()
+    def convert(self, mode):
+        return DummyImage(self.size, mode, self.format)
 
+    def resize(self, size, resample=None, reducing_gap=None):
+        return DummyImage(size, self.mode, self.format)
 
-fake_Image_mod.open = _fake_image_open
+    def __array__(self, dtype=None, copy=None):
+        w, h = self.size
+        shape = (h, w) if self.mode == "L" else (h, w, 3)
+        return np.zeros(shape, dtype=np.uint8)
+
+
+fake_Image_mod.open = lambda stream: DummyImage()
+fake_Image_mod.BILINEAR = 2
+fake_ImageOps_mod = types.ModuleType("PIL.ImageOps")
+fake_ImageOps_mod.autocontrast = lambda img, cutoff=0: img
 fake_PIL.Image = fake_Image_mod
+fake_PIL.ImageOps = fake_ImageOps_mod
 sys.modules["PIL"] = fake_PIL
 sys.modules["PIL.Image"] = fake_Image_mod
+sys.modules["PIL.ImageOps"] = fake_ImageOps_mod
 
 # Fake langchain_* so llm_endpoint imports cleanly even without real deps
 class _DummyLLMBase:
@@ -83,11 +110,26 @@ sys.modules["langchain_google_genai"] = fake_gemini
 # Import app modules (after fakes)
 
 import importlib
+import importlib.machinery
 
 main = importlib.import_module("main")
 llm_endpoint = importlib.import_module("llm_endpoint")
+pdf_extract = importlib.import_module("pdf_extract")
+image_preprocess = importlib.import_module("image_preprocess")
 
 client = TestClient(main.app)
+main.ocr_pool.start()
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    # tests reuse the same fake upload bytes with different fake parsers
+    main.extract_cache.clear()
+    main.llm_cache.clear()
+    # and many requests from the same test client
+    for cls in main.ADMISSION.values():
+        cls.buckets.clear()
+    yield
 
 # Helpers
 
@@ -102,9 +144,15 @@ class DummyPage:
 class DummyDoc:
     def __init__(self, pages_texts):
         self._pages = [DummyPage(t) for t in pages_texts]
+        self.loaded = []
+
+    @property
+    def page_count(self):
+        return len(self._pages)
 
-    def __iter__(self):
-        return iter(self._pages)
+    def load_page(self, i):
+        self.loaded.append(i)
+        return self._pages[i]
 
 
 class DummyLLMSync:
@@ -136,14 +184,134 @@ def test_health():
     assert "easyocr_langs" in data
     assert "easyocr_gpu" in data
 
+
+
+def test_ready_reports_components(monkeypatch):
+    for name in ("GROQ", "OPENAI", "DEEPSEEK", "MOCK", "LOCAL"):
+        monkeypatch.delenv(f"{name}_API_KEY", raising=False)
+    monkeypatch.setenv("GEMINI_API_KEY", "key")
+    monkeypatch.setattr(main.ocr_pool, "status", "loading")
+
+    r = client.get("/ready")
+    assert r.status_code == 503
+    j = r.json()
+    assert j["ready"] is False
+    assert j["components"]["ocr"]["status"] == "loading"
+    assert j["components"]["llm"]["ready"] is True
+    providers = j["components"]["llm"]["providers"]
+    # each provider is judged by its own key, not the Gemini one
+    assert providers["gemini"] == {"api_key_configured": True}
+    assert providers["groq"] == {"api_key_configured": False}
+    assert providers["mock"]["api_key_configured"] is True
+
+    # LLM traffic can go to this instance while OCR is still warming up
+    r = client.get("/ready", params={"component": "llm"})
+    assert r.status_code == 200
+
+    monkeypatch.setattr(main.ocr_pool, "status", "ready")
+    r = client.get("/ready")
+    assert r.status_code == 200
+    assert r.json()["ready"] is True
+
+    assert client.get("/ready", params={"component": "nope"}).status_code == 404
+
+    monkeypatch.delenv("GEMINI_API_KEY")
+    assert client.get("/ready", params={"component": "llm"}).status_code == 503
+
+
+def test_ocr_pool_background_load_and_warm_up(monkeypatch):
+    warmed = []
+
+    class WarmReader:
+        def __init__(self, langs, gpu=False):
+            pass
+
+        def readtext(self, arr, detail=0):
+            warmed.append(arr.shape)
+            return []
+
+    monkeypatch.setattr(fake_easyocr_mod, "Reader", WarmReader)
+    pool = main.OCRPool(["en"], workers=0)
+
+    async def run():
+        await pool.load_in_background()
+
+    asyncio.run(run())
+    assert pool.ready and pool.status == "ready"
+    assert warmed == [(64, 256, 3)]
+
+    pool.shutdown()
+    assert pool.status == "stopped"
+
+
+def test_ocr_pool_background_load_failure_is_retried(monkeypatch):
+    attempts = []
+
+    def flaky_reader(langs, gpu=False):
+        attempts.append(threading.get_ident())
+        if len(attempts) < 3:
+            raise RuntimeError("no model")
+        return _FakeReader(langs, gpu)
+
+    monkeypatch.setattr(fake_easyocr_mod, "Reader", flaky_reader)
+    pool = main.OCRPool(["en"], workers=0, retry_delay=0.001)
+    seen = []
+
+    async def run():
+        task = pool.load_in_background()
+        while not task.done():
+            seen.append((pool.status, pool.error))
+            await asyncio.sleep(0)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert ("failed", "no model") in seen
+    assert pool.status == "ready" and pool.error is None
+    # the reader is always built off the event loop
+    assert len(attempts) == 3 and loop_thread not in attempts
+
+
+def test_ocr_pool_request_reloads_after_a_failure_off_the_loop(monkeypatch):
+    attempts = []
+
+    def flaky_reader(langs, gpu=False):
+        attempts.append(threading.get_ident())
+        if len(attempts) == 1:
+            raise RuntimeError("no model")
+        return _FakeReader(langs, gpu)
+
+    monkeypatch.setattr(fake_easyocr_mod, "Reader", flaky_reader)
+    pool = main.OCRPool(["en"], workers=0)
+    img = np.zeros((2, 2, 3), dtype=np.uint8)
+
+    async def run():
+        with pytest.raises(RuntimeError, match="no model"):
+            await pool.readtext(img)
+        assert pool.status == "failed"
+        assert await pool.readtext(img) == []
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert pool.status == "ready"
+    assert loop_thread not in attempts
+
+
+def test_ocr_pool_successful_job_clears_a_failed_status():
+    pool = main.OCRPool(["en"], workers=0)
+    pool.start()
+    # e.g. the warm-up failed, but real images go through
+    pool.status, pool.error = "failed", "warm-up failed"
+
+    asyncio.run(pool.readtext(np.zeros((2, 2, 3), dtype=np.uint8)))
+    assert pool.ready and pool.error is None
+
     
 # /extract-pdf tests
 
 def test_extract_pdf_success(monkeypatch):
     # Use DummyDoc with two pages
-    monkeypatch.setattr(main, "fitz", main.fitz)
     monkeypatch.setattr(
-        main.fitz, "open", lambda stream, filetype=None: DummyDoc(["Page 1", "Page 2"])
+        pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["Page 1", "Page 2"])
     )
 
     pdf_bytes = b"%PDF-FAKE\n"
@@ -155,11 +323,63 @@ def test_extract_pdf_success(monkeypatch):
     assert "Page 1" in j["text"] and "Page 2" in j["text"]
 
 
+def test_metrics_report_routes_and_stages(monkeypatch):
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["Page 1", "Page 2"]))
+
+    files = {"file": ("m.pdf", io.BytesIO(b"%PDF-METRICS\n"), "application/pdf")}
+    assert client.post("/extract-pdf", files=files).status_code == 200
+    assert client.get("/nowhere/42").status_code == 404
+
+    text = client.get("/metrics").text
+    assert 'http_requests_total{route="/extract-pdf",method="POST",status="200"}' in text
+    assert 'http_requests_total{route="unmatched",method="GET",status="404"}' in text
+    assert 'http_request_seconds_count{route="/extract-pdf",method="POST"}' in text
+    for stage in ("upload_read", "pdf_open", "pdf_page_text"):
+        assert f'stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'executor_pending{executor="pdf"} 0' in text
+
+
+def test_server_timing_header_breaks_down_stages(monkeypatch):
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["Page 1"]))
+
+    files = {"file": ("t.pdf", io.BytesIO(b"%PDF-TIMING\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files)
+
+    entries = dict(e.split(";dur=") for e in r.headers["server-timing"].split(", "))
+    assert {"upload_read", "pdf_open", "pdf_page_text", "total"} <= set(entries)
+    assert all(float(ms) >= 0 for ms in entries.values())
+    assert float(entries["total"]) >= float(entries["upload_read"])
+
+
+def test_timing_headers_readable_by_the_frontend():
+    origin = {"Origin": "http://localhost:3000"}
+    r = client.get("/health", headers=origin)
+
+    assert r.headers["timing-allow-origin"] == "http://localhost:3000, https://manaska.vercel.app"
+    assert {"server-timing", "x-profile"} <= set(r.headers["access-control-expose-headers"].lower().split(", "))
+
+
+def test_profiling_for_trusted_callers(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.profile_store, "token", b"trusted")
+    monkeypatch.setattr(main.profile_store, "directory", str(tmp_path))
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["Page 1"]))
+
+    files = {"file": ("p.pdf", io.BytesIO(b"%PDF-PROFILE\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files, headers={"X-Profile": "1", "X-Profile-Token": "trusted"})
+    assert r.status_code == 200
+    name = r.headers["x-profile"]
+
+    assert client.get(f"/debug/profiles/{name}").status_code == 404
+    profile = client.get(f"/debug/profiles/{name}", headers={"X-Profile-Token": "trusted"})
+    assert profile.status_code == 200
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in profile.text.splitlines())
+
+
 def test_extract_pdf_too_large_content(monkeypatch):
     # Content > 3000 chars should 413
     large_text = "x" * 4000
     monkeypatch.setattr(
-        main.fitz, "open", lambda stream, filetype=None: DummyDoc([large_text])
+        pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc([large_text])
     )
     pdf_bytes = b"%PDF-FAKE\n"
     files = {"file": ("big.pdf", io.BytesIO(pdf_bytes), "application/pdf")}
@@ -167,6 +387,147 @@ def test_extract_pdf_too_large_content(monkeypatch):
     assert r.status_code == 413
 
 
+def test_extract_pdf_stops_at_text_limit(monkeypatch):
+    doc = DummyDoc(["x" * 1000] * 150)
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: doc)
+
+    files = {"file": ("book.pdf", io.BytesIO(b"%PDF-BOOK\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files)
+    assert r.status_code == 413
+    # 2 pages fit, the 3rd crosses the limit; the rest is never read
+    assert doc.loaded == [0, 1, 2]
+
+
+def test_extract_pdf_page_count_checked_first(monkeypatch):
+    doc = DummyDoc(["p"] * (main.MAX_PDF_PAGES + 1))
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: doc)
+
+    files = {"file": ("long.pdf", io.BytesIO(b"%PDF-LONG\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files)
+    assert r.status_code == 413
+    assert "too many pages" in r.json()["detail"]
+    assert doc.loaded == []
+
+
+def test_extract_pdf_cache_follows_the_limits(monkeypatch):
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["p"] * 10))
+    monkeypatch.setattr(main, "MAX_PDF_PAGES", 5)
+
+    files = {"file": ("ten.pdf", io.BytesIO(b"%PDF-TEN\n"), "application/pdf")}
+    assert client.post("/extract-pdf", files=files).status_code == 413
+
+    # a raised limit is not answered with the "too many pages" cached under the old one
+    monkeypatch.setattr(main, "MAX_PDF_PAGES", 20)
+    files = {"file": ("ten.pdf", io.BytesIO(b"%PDF-TEN\n"), "application/pdf")}
+    assert client.post("/extract-pdf", files=files).status_code == 200
+
+
+def test_extract_pdf_page_range(monkeypatch):
+    doc = DummyDoc([f"Page {i}" for i in range(1, 11)] + ["x" * 5000])
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: doc)
+
+    files = {"file": ("part.pdf", io.BytesIO(b"%PDF-PART\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files, params={"pages": "2-3, 9"})
+    assert r.status_code == 200
+    assert r.json()["text"] == "Page 2\n\nPage 3\n\nPage 9"
+
+    files = {"file": ("part.pdf", io.BytesIO(b"%PDF-PART\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files, params={"pages": "5-2"})
+    assert r.status_code == 400
+
+
+def test_parse_page_range():
+    parse = importlib.import_module("pdf_extract").parse_page_range
+    assert parse(None, 3) == [0, 1, 2]
+    assert parse("2", 3) == [1]
+    assert parse("2-", 4) == [1, 2, 3]
+    assert parse("-2,2,9", 4) == [0, 1]
+    with pytest.raises(ValueError):
+        parse("9", 3)
+    with pytest.raises(ValueError):
+        parse("a-b", 3)
+
+
+def test_pdf_pool_parallel_chunks_reassembled_in_order(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    doc = DummyDoc([f"Page {i}" for i in range(1, 21)])
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: doc)
+    monkeypatch.setattr(pdf_extract, "_worker_doc", (None, None))
+
+    pool = pdf_extract.PDFPool(workers=3, parallel_min_pages=4)
+    # threads stand in for worker processes; same shared-memory hand-off
+    pool._executor = ThreadPoolExecutor(max_workers=3)
+    try:
+        text = asyncio.run(pool.extract(b"%PDF-PARALLEL\n", "2-", 10_000, 100))
+        assert text == "\n\n".join(f"Page {i}" for i in range(2, 21))
+
+        with pytest.raises(pdf_extract.PDFTooLarge):
+            asyncio.run(pool.extract(b"%PDF-PARALLEL\n", None, 20, 100))
+    finally:
+        pool.shutdown()
+
+
+def _minimal_pdf(text):
+    # a real one-page PDF (PyMuPDF rebuilds the missing xref table)
+    content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+        b" /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = b"%PDF-1.4\n"
+    for i, body in enumerate(objects, 1):
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    return out + b"trailer\n<< /Root 1 0 R >>\n%%EOF\n"
+
+
+def test_pdf_pool_recovers_from_a_killed_worker():
+    # real worker processes, so they need the real PyMuPDF (only faked in this process)
+    if importlib.machinery.PathFinder.find_spec("fitz") is None:
+        pytest.skip("PyMuPDF is not installed")
+
+    pool = pdf_extract.PDFPool(workers=1)
+    data = _minimal_pdf("Hello worker")
+
+    def extract():
+        return asyncio.run(pool.extract(data, None, 10_000, 100))
+
+    try:
+        assert extract() == "Hello worker"
+        broken = pool._executor
+        for pid in list(broken._processes):
+            os.kill(pid, signal.SIGKILL)
+
+        # the request that finds the pool broken is run again on a fresh one
+        assert extract() == "Hello worker"
+        assert pool._executor is not broken
+    finally:
+        pool.shutdown()
+
+
+def test_pdf_pool_failure_is_503_not_a_bad_upload(monkeypatch):
+
+    async def broken(data, page_spec, max_chars, max_pages):
+        raise pdf_extract.PDFPoolBroken("A child process terminated abruptly")
+
+    monkeypatch.setattr(main.pdf_pool, "extract", broken)
+
+    files = {"file": ("t.pdf", io.BytesIO(b"%PDF-BROKEN-POOL\n"), "application/pdf")}
+    r = client.post("/extract-pdf", files=files)
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+
+def test_pdf_split_chunks():
+    split = importlib.import_module("pdf_extract")._split_chunks
+    assert split(list(range(7)), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert split([4, 5], 8) == [[4], [5]]
+
+
 def test_extract_pdf_invalid_content_type():
     files = {"file": ("test.txt", io.BytesIO(b"hello"), "text/plain")}
     r = client.post("/extract-pdf", files=files)
@@ -182,13 +543,58 @@ def test_extract_pdf_too_large_header():
     assert r.status_code == 413
 
 
+def _multipart_chunks(filename, content_type, payload, chunk_size=64 * 1024):
+    boundary = "testboundary"
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    for i in range(0, len(payload), chunk_size):
+        yield payload[i : i + chunk_size]
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def test_extract_pdf_chunked_upload_without_length_capped(monkeypatch):
+    opened = []
+    monkeypatch.setattr(
+        pdf_extract.fitz, "open", lambda stream, filetype=None: opened.append(1) or DummyDoc(["x"])
+    )
+
+    payload = b"%PDF" + b"0" * (main.MAX_FILE_SIZE + 1)
+    r = client.post(
+        "/extract-pdf",
+        content=_multipart_chunks("big.pdf", "application/pdf", payload),
+        headers={"content-type": "multipart/form-data; boundary=testboundary"},
+    )
+    assert r.status_code == 413
+    assert opened == []
+
+
+def test_extract_pdf_large_upload_is_memory_mapped(monkeypatch):
+    seen = []
+
+    def fake_open(stream, filetype=None):
+        seen.append((type(stream), bytes(stream[:5]), len(stream)))
+        return DummyDoc(["mapped"])
+
+    monkeypatch.setattr(pdf_extract.fitz, "open", fake_open)
+
+    payload = b"%PDF-" + b"1" * (main.UPLOAD_SPOOL_MAX_SIZE + 10)
+    files = {"file": ("large.pdf", io.BytesIO(payload), "application/pdf")}
+    r = client.post("/extract-pdf", files=files)
+    assert r.status_code == 200
+    assert r.json()["text"] == "mapped"
+    assert seen == [(memoryview, b"%PDF-", len(payload))]
+    assert importlib.import_module("uploads").UPLOAD_BUFFERED_BYTES.value(tier="disk") == 0
+
+
 def test_extract_pdf_open_error(monkeypatch):
-    monkeypatch.setattr(main, "fitz", main.fitz)
 
     def _bad_open(stream, filetype=None):
         raise Exception("bad pdf")
 
-    monkeypatch.setattr(main.fitz, "open", _bad_open)
+    monkeypatch.setattr(pdf_extract.fitz, "open", _bad_open)
 
     pdf_bytes = b"%PDF-FAKE\n"
     files = {"file": ("bad.pdf", io.BytesIO(pdf_bytes), "application/pdf")}
@@ -206,12 +612,13 @@ def test_extract_pdf_get_text_fallback(monkeypatch):
             return "fallback text"
 
     class FallbackDoc:
-        def __iter__(self):
-            return iter([FallbackPage()])
+        page_count = 1
+
+        def load_page(self, i):
+            return FallbackPage()
 
-    monkeypatch.setattr(main, "fitz", main.fitz)
     monkeypatch.setattr(
-        main.fitz, "open", lambda stream, filetype=None: FallbackDoc()
+        pdf_extract.fitz, "open", lambda stream, filetype=None: FallbackDoc()
     )
 
     pdf_bytes = b"%PDF-FAKE\n"
@@ -221,21 +628,36 @@ def test_extract_pdf_get_text_fallback(monkeypatch):
     assert "fallback text" in r.json()["text"]
 
 
+def test_extract_pdf_cache_hit_skips_parsing(monkeypatch):
+    opened = []
+
+    def counting_open(stream, filetype=None):
+        opened.append(stream)
+        return DummyDoc(["Cached page"])
+
+    monkeypatch.setattr(pdf_extract.fitz, "open", counting_open)
+
+    files = {"file": ("a.pdf", io.BytesIO(b"%PDF-SAME\n"), "application/pdf")}
+    r1 = client.post("/extract-pdf", files=files)
+    files = {"file": ("b.pdf", io.BytesIO(b"%PDF-SAME\n"), "application/pdf")}
+    r2 = client.post("/extract-pdf", files=files)
+
+    assert r1.status_code == r2.status_code == 200
+    assert r2.json() == {"filename": "b.pdf", "text": "Cached page"}
+    assert len(opened) == 1
+    assert "cache_hits_total" in client.get("/metrics").text
+
+
 # /extract-image tests
 
 
 def test_extract_image_success(monkeypatch):
     # Monkeypatch PIL.Image.open to return a small RGB image
-    class DummyImage:
-        def convert(self, mode):
-            return np.zeros((4, 4, 3), dtype=np.uint8)
-
-    monkeypatch.setattr(main, "Image", main.Image)
-    monkeypatch.setattr(main.Image, "open", lambda stream: DummyImage())
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: DummyImage())
 
     # EasyOCR result
     monkeypatch.setattr(
-        main.reader, "readtext", lambda arr, detail=0: ["Hello", "World"]
+        main.ocr_pool.reader, "readtext", lambda arr, detail=0: ["Hello", "World"]
     )
 
     img_bytes = b"\x89PNG\r\n\x1a\nFAKE"
@@ -248,14 +670,10 @@ def test_extract_image_success(monkeypatch):
 
 
 def test_extract_image_too_large_text(monkeypatch):
-    class DummyImage:
-        def convert(self, mode):
-            return np.zeros((2, 2, 3), dtype=np.uint8)
-
-    monkeypatch.setattr(main.Image, "open", lambda stream: DummyImage())
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: DummyImage())
 
     long_list = ["x" * 200] * 6  # 1200 chars
-    monkeypatch.setattr(main.reader, "readtext", lambda arr, detail=0: long_list)
+    monkeypatch.setattr(main.ocr_pool.reader, "readtext", lambda arr, detail=0: long_list)
 
     img_bytes = b"FAKEIMAGE"
     files = {"file": ("bigtext.png", io.BytesIO(img_bytes), "image/png")}
@@ -263,6 +681,30 @@ def test_extract_image_too_large_text(monkeypatch):
     assert r.status_code == 413
 
 
+def test_preprocess_image_downscales_jpeg_via_draft(monkeypatch):
+    preprocess = importlib.import_module("image_preprocess").preprocess_image
+    photo = DummyImage(size=(4000, 3000), format="JPEG")
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: photo)
+
+    arr, timings = preprocess(io.BytesIO(b"jpeg"), max_long_edge=1000, grayscale=True)
+
+    assert photo.drafted == (1000, 750)
+    assert arr.shape == (750, 1000)
+    assert set(timings) == {"open", "decode", "resize", "to_array"}
+
+
+def test_extract_image_decompression_bomb_rejected(monkeypatch):
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: DummyImage(size=(20000, 20000)))
+    monkeypatch.setattr(
+        main.ocr_pool.reader, "readtext", lambda arr, detail=0: pytest.fail("must not OCR")
+    )
+
+    files = {"file": ("bomb.png", io.BytesIO(b"bomb"), "image/png")}
+    r = client.post("/extract-image", files=files)
+    assert r.status_code == 413
+    assert "too many pixels" in r.json()["detail"]
+
+
 def test_extract_image_invalid_content_type():
     img_bytes = b"notimage"
     files = {"file": ("test.pdf", io.BytesIO(img_bytes), "application/pdf")}
@@ -283,8 +725,7 @@ def test_extract_image_open_error(monkeypatch):
     def _bad_open(stream):
         raise Exception("broken")
 
-    monkeypatch.setattr(main, "Image", main.Image)
-    monkeypatch.setattr(main.Image, "open", _bad_open)
+    monkeypatch.setattr(image_preprocess.Image, "open", _bad_open)
 
     img_bytes = b"fake"
     files = {"file": ("img.png", io.BytesIO(img_bytes), "image/png")}
@@ -294,17 +735,12 @@ def test_extract_image_open_error(monkeypatch):
 
 
 def test_extract_image_ocr_error(monkeypatch):
-    class DummyImage:
-        def convert(self, mode):
-            return np.zeros((2, 2, 3), dtype=np.uint8)
-
-    monkeypatch.setattr(main, "Image", main.Image)
-    monkeypatch.setattr(main.Image, "open", lambda stream: DummyImage())
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: DummyImage())
 
     def _bad_read(arr, detail=0):
         raise Exception("ocr fail")
 
-    monkeypatch.setattr(main.reader, "readtext", _bad_read)
+    monkeypatch.setattr(main.ocr_pool.reader, "readtext", _bad_read)
 
     img_bytes = b"fake"
     files = {"file": ("img.png", io.BytesIO(img_bytes), "image/png")}
@@ -313,6 +749,184 @@ def test_extract_image_ocr_error(monkeypatch):
     assert "OCR failed" in r.json()["detail"]
 
 
+def test_extract_image_ocr_queue_full(monkeypatch):
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: DummyImage())
+    monkeypatch.setattr(main.ocr_pool, "max_queue", 0)
+    monkeypatch.setattr(main.ocr_pool, "_pending", 1)
+
+    files = {"file": ("img.png", io.BytesIO(b"fake"), "image/png")}
+    r = client.post("/extract-image", files=files)
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+
+# /extract/batch tests
+
+
+def test_extract_batch_streams_result_per_file(monkeypatch):
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["Page 1", "Page 2"]))
+    monkeypatch.setattr(image_preprocess.Image, "open", lambda stream: DummyImage())
+    monkeypatch.setattr(main.ocr_pool.reader, "readtext", lambda arr, detail=0: ["Hello", "World"])
+    monkeypatch.setattr(main, "MAX_FILE_SIZE", 32)
+
+    files = [
+        ("files", ("a.pdf", io.BytesIO(b"%PDF-BATCH-A\n"), "application/pdf")),
+        ("files", ("b.png", io.BytesIO(b"\x89PNG-BATCH-B"), "image/png")),
+        ("files", ("c.txt", io.BytesIO(b"plain text"), "text/plain")),
+        ("files", ("d.png", io.BytesIO(b"x" * 64), "image/png")),
+    ]
+    r = client.post("/extract/batch", files=files)
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(r.text)
+    assert [name for name, _ in events] == ["file"] * 4 + ["done"]
+
+    results = {data["index"]: data for _, data in events[:-1]}
+    assert results[0]["kind"] == "pdf" and "Page 1" in results[0]["text"]
+    assert results[1] == {"index": 1, "filename": "b.png", "kind": "image", "status": 200, "text": "Hello\nWorld"}
+    assert results[2]["status"] == 400 and "text" not in results[2]
+    assert results[3]["status"] == 413 and results[3]["error"] == "File too large"
+    assert events[-1][1]["files"] == 4 and events[-1][1]["errors"] == 2
+
+
+def test_extract_batch_caps_total_text(monkeypatch):
+    monkeypatch.setattr(pdf_extract.fitz, "open", lambda stream, filetype=None: DummyDoc(["x" * 30]))
+    monkeypatch.setattr(main, "BATCH_MAX_TEXT_CHARS", 50)
+
+    files = [("files", (f"{i}.pdf", io.BytesIO(f"%PDF-CAP-{i}".encode()), "application/pdf")) for i in range(2)]
+    events = _sse_events(client.post("/extract/batch", files=files).text)
+
+    statuses = sorted(data["status"] for name, data in events if name == "file")
+    assert statuses == [200, 413]
+    assert events[-1] == ("done", {"files": 2, "errors": 1, "text_chars": 30})
+
+
+def test_extract_batch_too_many_files(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_FILES", 1)
+
+    files = [("files", (f"{i}.pdf", io.BytesIO(b"%PDF"), "application/pdf")) for i in range(2)]
+    r = client.post("/extract/batch", files=files)
+    assert r.status_code == 413
+
+
+def test_ocr_pool_inline_readtext():
+    pool = main.OCRPool(["en"], workers=0)
+    assert not pool.started
+
+    result = asyncio.run(pool.readtext(np.zeros((2, 2, 3), dtype=np.uint8)))
+    assert result == []
+    assert pool.started and pool.pending == 0
+
+    pool.shutdown()
+    assert not pool.started
+
+
+def test_ocr_pool_queue_limit_counts_requests_that_waited_for_startup(monkeypatch):
+    class SlowReader:
+        def __init__(self, langs, gpu=False):
+            time.sleep(0.01)
+
+        def readtext(self, arr, detail=0):
+            time.sleep(0.05)
+            return ["line"]
+
+    monkeypatch.setattr(fake_easyocr_mod, "Reader", SlowReader)
+    pool = main.OCRPool(["en"], workers=0, max_queue=0)
+
+    async def run():
+        img = np.zeros((2, 2, 3), dtype=np.uint8)
+        return await asyncio.gather(pool.readtext(img), pool.readtext(img), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert ["line"] in results
+    assert any(isinstance(r, main.OCRQueueFull) for r in results)
+
+
+def test_ocr_pool_rebuilds_a_broken_process_pool(monkeypatch):
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    ocr_pool = importlib.import_module("ocr_pool")
+    executors = []
+
+    class FakeExecutor:
+        def __init__(self, **kwargs):
+            self.broken = not executors
+            self.shut_down = False
+            executors.append(self)
+
+        def submit(self, fn, arg):
+            if self.broken:
+                raise BrokenProcessPool("a worker died")
+            fut = Future()
+            fut.set_result(["line"])
+            return fut
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.shut_down = True
+
+    monkeypatch.setattr(ocr_pool, "ProcessPoolExecutor", FakeExecutor)
+    pool = ocr_pool.OCRPool(["en"], workers=1)
+    pool.start()
+    img = np.zeros((2, 2, 3), dtype=np.uint8)
+
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(pool.readtext(img))
+    assert executors[0].shut_down and pool._executor is executors[1]
+
+    # later jobs go to the new pool
+    assert asyncio.run(pool.readtext(img)) == ["line"]
+    assert pool.pending == 0
+
+
+def test_ocr_batcher_batches_concurrent_images():
+    calls = []
+
+    class BatchReader:
+        def readtext(self, arr, detail=0):
+            calls.append(("single", arr.shape))
+            return ["single"]
+
+        def readtext_batched(self, arrs, detail=0, batch_size=1):
+            calls.append(("batched", [a.shape for a in arrs]))
+            return [[f"img{i}"] for i in range(len(arrs))]
+
+    pool = main.OCRPool(["en"], workers=0)
+    pool.reader = BatchReader()
+    batcher = main.OCRBatcher(pool, max_batch_size=4, max_wait=0.05)
+
+    async def run():
+        imgs = [
+            np.zeros((10, 10, 3), dtype=np.uint8),
+            np.zeros((8, 10, 3), dtype=np.uint8),
+            np.zeros((10, 9, 3), dtype=np.uint8),
+        ]
+        out = await asyncio.gather(*(batcher.readtext(a) for a in imgs))
+        batcher.shutdown()
+        return out
+
+    results = asyncio.run(run())
+    # one batched pass, every image padded to the shared 10x10 canvas
+    assert calls == [("batched", [(10, 10, 3)] * 3)]
+    assert sorted(r[0] for r in results) == ["img0", "img1", "img2"]
+
+
+def test_ocr_group_for_batch_keeps_small_images_apart():
+    ocr_pool = importlib.import_module("ocr_pool")
+    arrs = [
+        np.zeros((100, 100, 3), dtype=np.uint8),
+        np.zeros((10, 10, 3), dtype=np.uint8),
+        np.zeros((90, 100, 3), dtype=np.uint8),
+    ]
+    groups = ocr_pool._group_for_batch(arrs)
+    assert groups == [([0, 2], (100, 100)), ([1], (10, 10))]
+
+    padded = ocr_pool._pad_to(arrs[2], 100, 100)
+    assert padded.shape == (100, 100, 3)
+    assert padded[95, 0, 0] == 255
+
+
 # /mindmap/generate tests
 
 
@@ -336,6 +950,93 @@ def test_mindmap_generate_success(monkeypatch):
     assert j["mindmap"]["label"] == "Test Topic"
 
 
+def test_mindmap_generate_with_mock_model(monkeypatch):
+    import mock_llm
+
+    monkeypatch.setattr(llm_endpoint, "_llm_clients", llm_endpoint.OrderedDict())
+    monkeypatch.setattr(llm_endpoint, "MOCK_LLM_ENABLED", True)
+    monkeypatch.setattr(mock_llm, "MOCK_LLM_LATENCY_MS", 0.0)
+    monkeypatch.setattr(mock_llm, "MOCK_LLM_TOKENS_PER_SECOND", 0.0)
+
+    payload = {"model": "mock-test", "api_key": "", "topic": "Rivers and lakes"}
+    r = client.post("/mindmap/generate", json=payload)
+
+    assert r.status_code == 200
+    mindmap = r.json()["mindmap"]
+    assert mindmap["label"] == "Rivers and lakes"
+    assert len(mindmap["children"]) == 4
+
+
+class TopicLLM:
+    """Answers every mindmap request with a tree named after its topic, after a short delay"""
+
+    def __init__(self):
+        self.running = 0
+        self.most_running = 0
+        self.calls = 0
+
+    async def invoke(self, messages):
+        self.calls += 1
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            self.running -= 1
+        topic = messages[-1]["content"].split("\n\n", 1)[1]
+        if topic == "broken":
+            return "no tree here"
+        return json.dumps({"id": "root", "label": topic, "children": []})
+
+
+def test_mindmap_generate_batch(monkeypatch):
+    llm = TopicLLM()
+    monkeypatch.setattr(main, "get_llm", lambda *args: llm)
+    monkeypatch.setattr(main, "MINDMAP_BATCH_CONCURRENCY", 3)
+
+    topics = [f"Topic {i}" for i in range(8)] + ["broken", "  ", "Topic 0"]
+    payload = {"model": "openai-test", "api_key": "sk-test", "topics": topics, "bypass_cache": True}
+    r = client.post("/mindmap/generate/batch", json=payload)
+
+    assert r.status_code == 200
+    body = r.json()
+    results = body["results"]
+    assert [res["index"] for res in results] == list(range(len(topics)))
+    assert [res["mindmap"]["label"] for res in results[:8]] == topics[:8]
+    assert results[8]["status"] == 500 and "mindmap" not in results[8]
+    assert results[9] == {"index": 9, "topic": "  ", "status": 400, "error": "Empty topic."}
+    assert results[10]["mindmap"]["label"] == "Topic 0"
+    assert body["errors"] == 2
+    # bounded, but concurrent
+    assert llm.most_running == 3
+
+
+def test_mindmap_generate_batch_stream(monkeypatch):
+    llm = TopicLLM()
+    monkeypatch.setattr(main, "get_llm", lambda *args: llm)
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topics": ["Batch A", "Batch B"], "stream": True}
+    events = _sse_events(client.post("/mindmap/generate/batch", json=payload).text)
+
+    assert [name for name, _ in events] == ["item", "item", "done"]
+    assert {data["mindmap"]["label"] for _, data in events[:2]} == {"Batch A", "Batch B"}
+    assert events[-1][1] == {"topics": 2, "errors": 0}
+
+    # generated trees are cached for the single endpoint too
+    single = client.post("/mindmap/generate", json={"model": "openai-test", "api_key": "sk-test", "topic": "Batch A"})
+    assert single.json()["mindmap"]["label"] == "Batch A"
+    assert llm.calls == 2
+
+
+def test_mindmap_generate_batch_rejects_bad_requests(monkeypatch):
+    monkeypatch.setattr(main, "MINDMAP_BATCH_MAX_TOPICS", 2)
+    payload = {"model": "openai-test", "api_key": "sk-test", "topics": ["a", "b", "c"]}
+    assert client.post("/mindmap/generate/batch", json=payload).status_code == 413
+
+    payload = {"model": "unknown-model", "api_key": "sk-test", "topics": ["a"]}
+    assert client.post("/mindmap/generate/batch", json=payload).status_code == 400
+
+
 def test_mindmap_generate_invalid_json_from_llm(monkeypatch):
     def fake_get_llm(model, api_key, temperature, max_tokens):
         return DummyLLMSync("this is not json and has no braces")
@@ -362,6 +1063,27 @@ def test_mindmap_generate_json_in_fence(monkeypatch):
     assert r.json()["mindmap"]["label"] == "From Fence"
 
 
+def test_mindmap_generate_normalises_tree(monkeypatch):
+    reply = {
+        "label": "Topic",
+        "children": [
+            {"id": "x", "label": "One"},
+            {"id": "x", "label": "Two", "relation": "has", "children": ["Leaf"]},
+        ],
+    }
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: DummyLLMSync(json.dumps(reply)))
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Anything"}
+    r = client.post("/mindmap/generate", json=payload)
+    assert r.status_code == 200
+    tree = r.json()["mindmap"]
+    assert tree["id"] == "root"
+    one, two = tree["children"]
+    assert one["relation"] == "" and one["children"] == []
+    assert two["id"] != "x"
+    assert two["children"][0]["label"] == "Leaf"
+
+
 def test_mindmap_generate_bad_structure(monkeypatch):
     bad = {"foo": "bar"}
 
@@ -376,6 +1098,205 @@ def test_mindmap_generate_bad_structure(monkeypatch):
     assert "unexpected structure" in r.json()["detail"]
 
 
+def test_mindmap_generate_stream(monkeypatch):
+    tree = {
+        "id": "root",
+        "label": "Topic",
+        "children": [{"id": "n1", "label": "Sub", "relation": "has", "children": []}],
+    }
+    text = "```json\n" + json.dumps(tree) + "\n```"
+
+    class StreamingLLM:
+        def invoke(self, messages):
+            raise AssertionError("should stream")
+
+        async def astream(self, messages):
+            for i in range(0, len(text), 5):
+                yield text[i:i + 5]
+
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: StreamingLLM())
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Anything", "stream": True}
+    r = client.post("/mindmap/generate", json=payload)
+    assert r.status_code == 200
+
+    events = _sse_events(r.text)
+    assert events[0] == ("node", {"id": "root", "label": "Topic", "relation": None, "parent_id": None})
+    assert events[1] == ("node", {"id": "n1", "label": "Sub", "relation": "has", "parent_id": "root"})
+    assert events[-1][0] == "done"
+    assert events[-1][1]["mindmap"] == tree
+
+
+def test_mindmap_generate_stream_ids_match_done(monkeypatch):
+    tree = {
+        "id": "root",
+        "label": "Topic",
+        "children": [
+            {"id": "n1", "label": "A", "relation": "has", "children": [
+                {"id": "n1", "label": "A1", "relation": "has", "children": []},
+            ]},
+            {"id": "n1", "label": "B", "relation": "has", "children": []},
+            {"label": "C", "relation": "has", "children": []},
+        ],
+    }
+    text = json.dumps(tree)
+
+    class StreamingLLM:
+        async def astream(self, messages):
+            for i in range(0, len(text), 7):
+                yield text[i:i + 7]
+
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: StreamingLLM())
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Anything", "stream": True}
+    events = _sse_events(client.post("/mindmap/generate", json=payload).text)
+
+    streamed = [(data["id"], data["parent_id"]) for name, data in events if name == "node"]
+    done = events[-1][1]
+    assert "replaces_nodes" not in done
+
+    final, queue = [], [(done["mindmap"], None)]
+    while queue:
+        node, parent_id = queue.pop()
+        final.append((node["id"], parent_id))
+        queue.extend((child, node["id"]) for child in reversed(node["children"]))
+    assert streamed == final
+    assert len(set(streamed)) == 5
+
+
+def _flatten(tree):
+    # (id, label, relation, parent_id) of every node, in reply order
+    out, queue = [], [(tree, None)]
+    while queue:
+        node, parent_id = queue.pop()
+        out.append((node["id"], node["label"], node.get("relation"), parent_id))
+        queue.extend((child, node["id"]) for child in reversed(node["children"]))
+    return out
+
+
+def test_mindmap_generate_stream_over_limits_matches_done(monkeypatch):
+    monkeypatch.setattr(main, "MINDMAP_MAX_CHILDREN", 12)
+    monkeypatch.setattr(main, "MINDMAP_MAX_DEPTH", 2)
+    monkeypatch.setattr(main, "MINDMAP_MAX_LABEL_CHARS", 20)
+
+    deep = {"id": "d1", "label": "D1", "relation": "r", "children": [
+        {"id": "d2", "label": "D2", "relation": "r", "children": [
+            {"id": "d3", "label": "too deep", "relation": "r", "children": []},
+        ]},
+    ]}
+    children = [{"id": f"n{i}", "label": f"N{i}", "relation": "r", "children": []} for i in range(15)]
+    children[0] = {"id": "n0", "label": "x" * 200, "children": [{"id": "bare", "children": []}]}
+    children[1] = deep
+    tree = {"id": "root", "label": "Topic", "children": children}
+    text = json.dumps(tree)
+
+    class StreamingLLM:
+        async def astream(self, messages):
+            for i in range(0, len(text), 9):
+                yield text[i:i + 9]
+
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: StreamingLLM())
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Anything", "stream": True}
+    events = _sse_events(client.post("/mindmap/generate", json=payload).text)
+
+    streamed = [(d["id"], d["label"], d["relation"], d["parent_id"]) for name, d in events if name == "node"]
+    done = events[-1][1]
+    # over fan-out, over depth and unlabeled nodes were fixed, so done says so
+    assert done["replaces_nodes"] is True
+    # ...but what was streamed is already the final tree
+    assert streamed == _flatten(done["mindmap"])
+    ids = {node[0] for node in streamed}
+    assert not ids & {"n12", "n13", "n14", "d3", "bare"}
+    assert streamed[1] == ("n0", "x" * 19 + "…", "", "root")
+
+
+def test_mindmap_generate_stream_bad_structure(monkeypatch):
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: DummyLLMSync('{"id": "root", "children": []}'))
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Anything", "stream": True}
+    r = client.post("/mindmap/generate", json=payload)
+    events = _sse_events(r.text)
+    assert events[-1] == ("error", {"detail": "Mindmap JSON has unexpected structure."})
+
+
+def test_mindmap_cache_follows_the_tree_limits(monkeypatch):
+    calls = []
+    tree = {"id": "root", "label": "Photosynthesis", "children": []}
+
+    def fake_get_llm(model, api_key, temperature, max_tokens):
+        calls.append(model)
+        return DummyLLMSync(json.dumps(tree))
+
+    monkeypatch.setattr(main, "get_llm", fake_get_llm)
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Photosynthesis"}
+    client.post("/mindmap/generate", json=payload)
+    client.post("/mindmap/generate", json=payload)
+    assert len(calls) == 1
+
+    # a tree cut to the old limits is not served under the new ones
+    monkeypatch.setattr(main, "MINDMAP_MAX_CHILDREN", 3)
+    client.post("/mindmap/generate", json=payload)
+    assert len(calls) == 2
+
+
+def test_mindmap_generate_response_cache(monkeypatch):
+    calls = []
+    tree = {"id": "root", "label": "Photosynthesis", "children": []}
+
+    def fake_get_llm(model, api_key, temperature, max_tokens):
+        calls.append(temperature)
+        return DummyLLMSync(json.dumps(tree))
+
+    monkeypatch.setattr(main, "get_llm", fake_get_llm)
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Photosynthesis"}
+    assert client.post("/mindmap/generate", json=payload).json() == {"mindmap": tree}
+    # same request up to whitespace and case: served from the cache
+    payload["topic"] = "  photosynthesis "
+    assert client.post("/mindmap/generate", json=payload).json() == {"mindmap": tree}
+    assert len(calls) == 1
+
+    # bypass goes to the LLM again
+    payload["bypass_cache"] = True
+    client.post("/mindmap/generate", json=payload)
+    assert len(calls) == 2
+
+    # too random to cache
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Photosynthesis", "temperature": 0.9}
+    client.post("/mindmap/generate", json=payload)
+    client.post("/mindmap/generate", json=payload)
+    assert calls[2:] == [0.9, 0.9]
+
+
+def test_mindmap_generate_invalid_reply_not_cached(monkeypatch):
+    replies = iter(['{"id": "root"}', '{"id": "root", "label": "X", "children": []}'])
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: DummyLLMSync(next(replies)))
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "topic": "Anything"}
+    assert client.post("/mindmap/generate", json=payload).status_code == 500
+    assert client.post("/mindmap/generate", json=payload).status_code == 200
+
+
+def test_mindmap_generate_rate_limited_per_client(monkeypatch):
+    from admission import TokenBuckets
+
+    monkeypatch.setattr(main.ADMISSION["llm"], "buckets", TokenBuckets(rate=0.01, burst=1))
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: DummyLLMSync('{"id": "root", "label": "T", "children": []}'))
+
+    payload = {"model": "openai-test", "api_key": "sk-one", "topic": "Anything"}
+    assert client.post("/mindmap/generate", json=payload).status_code == 200
+
+    r = client.post("/mindmap/generate", json=payload)
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
+
+    # another api_key from the same client shares the bucket
+    other = dict(payload, api_key="sk-two")
+    assert client.post("/mindmap/generate", json=other).status_code == 429
+
+
 # /mindmap/explain tests
 
 
@@ -400,6 +1321,23 @@ def test_mindmap_explain_success(monkeypatch):
     assert "explanation" in j and explanation_text in j["explanation"]
 
 
+def test_mindmap_explain_stream_without_astream(monkeypatch):
+    # clients without a streaming API still answer, as a single chunk
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: DummyLLMSync("Whole explanation."))
+
+    payload = {
+        "model": "openai-test",
+        "api_key": "sk-test",
+        "mindmap": '{"id": "root", "label": "X", "children": []}',
+        "stream": True,
+    }
+    r = client.post("/mindmap/explain", json=payload)
+    assert r.status_code == 200
+    events = _sse_events(r.text)
+    assert events[0] == ("token", {"text": "Whole explanation."})
+    assert events[-1][0] == "done"
+
+
 # /llm/invoke endpoint tests
 
 
@@ -428,6 +1366,82 @@ def test_llm_invoke_endpoint(monkeypatch):
     assert j["model"] == "openai-test"
 
 
+def _sse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_llm_invoke_stream(monkeypatch):
+    class Chunk:
+        def __init__(self, content, usage_metadata=None):
+            self.content = content
+            self.usage_metadata = usage_metadata
+
+    class StreamingLLM:
+        def invoke(self, messages):
+            raise AssertionError("streaming must not fall back to invoke")
+
+        async def astream(self, messages):
+            yield Chunk("Hel")
+            yield Chunk("lo")
+            yield Chunk("", {"input_tokens": 5, "output_tokens": 2, "total_tokens": 7})
+
+    monkeypatch.setattr(llm_endpoint, "get_llm", lambda *a, **k: StreamingLLM())
+
+    payload = {
+        "model": "openai-test",
+        "api_key": "sk-test",
+        "messages": [{"role": "user", "content": "Hello"}],
+        "stream": True,
+    }
+    r = client.post("/llm/invoke", json=payload)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+
+    events = _sse_events(r.text)
+    assert events[:2] == [("token", {"text": "Hel"}), ("token", {"text": "lo"})]
+    kind, done = events[-1]
+    assert kind == "done"
+    assert done["usage"] == {"input_tokens": 5, "output_tokens": 2, "total_tokens": 7}
+    assert done["timing"]["first_token_ms"] <= done["timing"]["total_ms"]
+
+
+def test_llm_invoke_stream_error_event(monkeypatch):
+    class FailingLLM:
+        def invoke(self, messages):
+            return "unused"
+
+        async def astream(self, messages):
+            yield "partial"
+            raise RuntimeError("connection dropped")
+
+    monkeypatch.setattr(llm_endpoint, "get_llm", lambda *a, **k: FailingLLM())
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "messages": [], "stream": True}
+    r = client.post("/llm/invoke", json=payload)
+    events = _sse_events(r.text)
+    assert events[0] == ("token", {"text": "partial"})
+    assert events[-1][0] == "error"
+    assert "connection dropped" in events[-1][1]["detail"]
+
+
+def test_llm_invoke_stream_busy_is_503(monkeypatch):
+    monkeypatch.setattr(llm_endpoint, "get_llm", lambda *a, **k: DummyLLMSync("x"))
+
+    def busy(*args):
+        raise llm_endpoint.LLMBusy("Too many pending requests for openai.")
+
+    monkeypatch.setattr(llm_endpoint, "stream_llm", busy)
+
+    payload = {"model": "openai-test", "api_key": "sk-test", "messages": [], "stream": True}
+    r = client.post("/llm/invoke", json=payload)
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+
 def test_llm_invoke_invalid_model(monkeypatch):
     def bad_get_llm(model, api_key, temperature, max_tokens):
         raise Exception("unsupported")
@@ -576,6 +1590,193 @@ def test_call_llm_invoke_error(monkeypatch):
     assert "LLM error: boom" in exc.value.detail
 
 
+def test_call_llm_coalesces_identical_requests(monkeypatch):
+    calls = []
+
+    class SlowLLM:
+        def invoke(self, messages):
+            raise AssertionError("async path expected")
+
+        async def ainvoke(self, messages):
+            calls.append(messages)
+            await asyncio.sleep(0.02)
+            return "shared reply"
+
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: SlowLLM())
+    same = [{"role": "user", "content": "same"}]
+    other = [{"role": "user", "content": "other"}]
+
+    async def run():
+        return await asyncio.gather(
+            *(main._call_llm("openai-test", "key", same) for _ in range(4)),
+            main._call_llm("openai-test", "key", other),
+        )
+
+    assert asyncio.run(run()) == ["shared reply"] * 5
+    assert len(calls) == 2
+
+
+def test_ainvoke_llm_prefers_native_async():
+    class LangChainLike:
+        def invoke(self, messages):
+            raise AssertionError("sync path must not be used")
+
+        async def ainvoke(self, messages):
+            return "native async"
+
+    out = asyncio.run(llm_endpoint.ainvoke_llm(LangChainLike(), [], "groq"))
+    assert out == "native async"
+
+
+def test_ainvoke_llm_bounded_per_provider(monkeypatch):
+    monkeypatch.setattr(llm_endpoint, "_limiters", {})
+    monkeypatch.setattr(llm_endpoint, "LLM_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(llm_endpoint, "LLM_MAX_WAITING", 1)
+
+    running = []
+    peak = []
+
+    class SlowLLM:
+        async def ainvoke(self, messages):
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.pop()
+            return "ok"
+
+    async def run():
+        calls = [llm_endpoint.ainvoke_llm(SlowLLM(), [], "test-provider") for _ in range(4)]
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(run())
+    # 2 run, 1 waits, the 4th is turned away instead of queueing
+    assert results.count("ok") == 3
+    assert sum(isinstance(r, llm_endpoint.LLMBusy) for r in results) == 1
+    assert max(peak) == 2
+
+
+def test_call_llm_busy_is_503(monkeypatch):
+    class BusyLLM:
+        def invoke(self, messages):
+            return "never"
+
+    async def busy(llm, messages, provider):
+        raise llm_endpoint.LLMBusy("Too many pending requests for other.")
+
+    monkeypatch.setattr(main, "get_llm", lambda *a, **k: BusyLLM())
+    monkeypatch.setattr(main, "ainvoke_llm", busy)
+
+    with pytest.raises(FastAPIHTTPException) as exc:
+        asyncio.run(main._call_llm("model", "key", []))
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "1"
+
+
+def test_call_llm_falls_back_to_next_model(monkeypatch):
+    import resilience
+
+    class Overloaded(Exception):
+        status_code = 503
+
+    class PrimaryLLM:
+        def invoke(self, messages):
+            raise Overloaded("overloaded")
+
+    class FallbackLLM:
+        def invoke(self, messages):
+            return "from gemini"
+
+    built = []
+
+    def fake_get_llm(model, api_key, temperature, max_tokens):
+        built.append((model, api_key))
+        return FallbackLLM() if model.startswith("gemini") else PrimaryLLM()
+
+    monkeypatch.setattr(main, "get_llm", fake_get_llm)
+    monkeypatch.setattr(main, "LLM_FALLBACK_MODELS", ["gemini-2.5-flash"])
+    monkeypatch.setenv("GEMINI_API_KEY", "gemini-key")
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0.0)
+
+    out = asyncio.run(main._call_llm("groq-llama", "key", [{"role": "user", "content": "hi"}]))
+
+    assert out == "from gemini"
+    assert built == [("groq-llama", "key"), ("gemini-2.5-flash", "gemini-key")]
+
+
+def test_fallback_replies_are_not_cached(monkeypatch):
+    import resilience
+
+    class Overloaded(Exception):
+        status_code = 503
+
+    calls = []
+
+    class PrimaryLLM:
+        def invoke(self, messages):
+            calls.append("groq")
+            raise Overloaded("overloaded")
+
+    class FallbackLLM:
+        def invoke(self, messages):
+            calls.append("gemini")
+            return "from gemini"
+
+    def fake_get_llm(model, api_key, temperature, max_tokens):
+        return FallbackLLM() if model.startswith("gemini") else PrimaryLLM()
+
+    monkeypatch.setattr(main, "get_llm", fake_get_llm)
+    monkeypatch.setattr(main, "LLM_FALLBACK_MODELS", ["gemini-2.5-flash"])
+    monkeypatch.setenv("GEMINI_API_KEY", "gemini-key")
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(resilience, "LLM_RETRY_ATTEMPTS", 1)
+
+    payload = {"model": "groq-llama", "api_key": "sk-test", "mindmap": {"id": "root", "label": "Cells", "children": []}}
+    for _ in range(2):
+        r = client.post("/mindmap/explain", json=payload)
+        assert r.json() == {"explanation": "from gemini"}
+
+    # the second request asked groq again instead of getting gemini's cached answer
+    assert calls == ["groq", "gemini", "groq", "gemini"]
+
+
+def test_call_llm_never_sends_a_key_to_another_provider(monkeypatch):
+    import resilience
+
+    class Overloaded(Exception):
+        status_code = 503
+
+    class FailingLLM:
+        def invoke(self, messages):
+            raise Overloaded("overloaded")
+
+    built = []
+
+    def fake_get_llm(model, api_key, temperature, max_tokens):
+        built.append((model, api_key))
+        return FailingLLM()
+
+    monkeypatch.setattr(main, "get_llm", fake_get_llm)
+    monkeypatch.setattr(main, "LLM_FALLBACK_MODELS", ["openai-gpt", "gemini-2.5-pro", "deepseek-chat"])
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "deepseek-key")
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(resilience, "LLM_RETRY_ATTEMPTS", 1)
+
+    with pytest.raises(FastAPIHTTPException):
+        asyncio.run(main._call_llm("gemini-2.5-flash", "gemini-key", [{"role": "user", "content": "hi"}]))
+
+    # openai has no key of its own and is skipped; gemini may reuse the caller's key
+    assert built == [
+        ("gemini-2.5-flash", "gemini-key"),
+        ("gemini-2.5-pro", "gemini-key"),
+        ("deepseek-chat", "deepseek-key"),
+    ]
+
+
 # Direct unit tests: llm_endpoint.get_llm and _extract_text
 
 
@@ -606,6 +1807,47 @@ def test_llm_get_llm_variants():
         llm_endpoint.get_llm("other-model", "sk", 0.1, 10)
 
 
+def test_get_llm_mock_and_local(monkeypatch):
+    monkeypatch.setattr(llm_endpoint, "_llm_clients", llm_endpoint.OrderedDict())
+
+    # both are off until configured
+    with pytest.raises(Exception, match="MOCK_LLM_ENABLED"):
+        llm_endpoint.get_llm("mock-fast", "", 0.2, 100)
+    with pytest.raises(Exception, match="LOCAL_LLM_BASE_URL"):
+        llm_endpoint.get_llm("local/llama3", "", 0.2, 100)
+
+    monkeypatch.setattr(llm_endpoint, "MOCK_LLM_ENABLED", True)
+    monkeypatch.setattr(llm_endpoint, "LOCAL_LLM_BASE_URL", "http://127.0.0.1:8001/v1")
+
+    mock = llm_endpoint.get_llm("mock-fast", "", 0.2, 100)
+    assert isinstance(mock, llm_endpoint.MockChatModel) and mock.max_tokens == 100
+
+    local = llm_endpoint.get_llm("local/llama3", "", 0.2, 100)
+    assert isinstance(local, llm_endpoint.ChatOpenAI)
+    assert local.kwargs["model"] == "llama3"
+    assert local.kwargs["openai_api_base"] == "http://127.0.0.1:8001/v1"
+
+
+def test_get_llm_reuses_clients_and_http_pool(monkeypatch):
+    monkeypatch.setattr(llm_endpoint, "_llm_clients", llm_endpoint.OrderedDict())
+    monkeypatch.setattr(llm_endpoint, "LLM_CLIENT_CACHE_SIZE", 2)
+
+    a = llm_endpoint.get_llm("groq-llama", "sk-a", 0.2, 100)
+    assert llm_endpoint.get_llm("groq-llama", "sk-a", 0.2, 100) is a
+    # different key or generation params -> different client, same HTTP pool
+    b = llm_endpoint.get_llm("groq-llama", "sk-b", 0.2, 100)
+    assert b is not a
+    assert b.kwargs["http_async_client"] is a.kwargs["http_async_client"]
+    assert b.kwargs["http_client"] is a.kwargs["http_client"]
+
+    llm_endpoint.get_llm("groq-llama", "sk-a", 0.5, 100)  # evicts a (least recently used)
+    assert llm_endpoint.get_llm("groq-llama", "sk-a", 0.2, 100) is not a
+    assert llm_endpoint.LLM_CLIENTS.value(provider="groq", result="evicted") >= 1
+
+    # the raw key is never part of the registry key
+    assert all("sk-a" not in map(str, key) for key in llm_endpoint._llm_clients)
+
+
 def test_extract_text_variants():
     et = llm_endpoint._extract_text
 
@@ -0,0 +1,68 @@
+import os
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import metrics  # noqa: E402
+
+
+def test_histogram_bucket_bounds_are_inclusive():
+    h = metrics.Histogram("t_bounds_seconds", "test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 1.0, 5.0):
+        h.observe(value)
+
+    samples = {(name, key): v for name, key, v in h.samples()}
+    assert samples[("t_bounds_seconds_bucket", ("0.1",))] == 2
+    assert samples[("t_bounds_seconds_bucket", ("1",))] == 4
+    assert samples[("t_bounds_seconds_bucket", ("+Inf",))] == 5
+    assert samples[("t_bounds_seconds_sum", ())] == 6.65
+    assert h.count() == 5
+
+
+def test_gauge_function_is_read_at_render():
+    depth = [3]
+    g = metrics.Gauge("t_queue_depth", "test", ("queue",))
+    g.set_function(lambda: depth[0], queue="a")
+
+    assert 't_queue_depth{queue="a"} 3' in metrics.render()
+    depth[0] = 7
+    assert 't_queue_depth{queue="a"} 7' in metrics.render()
+
+
+def test_timed_records_stage_even_on_error():
+    before = metrics.STAGE_SECONDS.count(stage="t_stage")
+    try:
+        with metrics.timed("t_stage"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert metrics.STAGE_SECONDS.count(stage="t_stage") == before + 1
+
+
+def test_request_middleware_labels_by_route_template():
+    app = FastAPI()
+
+    @app.get("/t-items/{item_id}")
+    def item(item_id: int):
+        return {"id": item_id}
+
+    app.add_middleware(metrics.RequestMetricsMiddleware)
+    client = TestClient(app)
+
+    for i in range(3):
+        client.get(f"/t-items/{i}")
+    client.get("/t-items/nope")
+
+    ok = metrics.HTTP_REQUESTS.value(route="/t-items/{item_id}", method="GET", status="200")
+    invalid = metrics.HTTP_REQUESTS.value(route="/t-items/{item_id}", method="GET", status="422")
+    assert (ok, invalid) == (3, 1)
+    assert metrics.HTTP_REQUEST_SECONDS.count(route="/t-items/{item_id}", method="GET") == 4
+    assert metrics.HTTP_IN_FLIGHT.value() == 0
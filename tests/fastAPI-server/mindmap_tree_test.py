@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from mindmap_tree import TreeUnusable, normalise_tree  # noqa: E402
+
+
+def test_fills_fields_and_fixes_ids():
+    tree = {
+        "label": "Root",
+        "children": [
+            {"id": "a", "label": "A", "relation": "has"},
+            {"id": "a", "name": "Second A", "children": ["bare leaf", 42, {"relation": "x"}]},
+        ],
+    }
+    out, fixes = normalise_tree(tree)
+
+    assert out["id"] == "root"
+    a, dup = out["children"]
+    assert a == {"id": "a", "label": "A", "relation": "has", "children": []}
+    assert dup["id"] == "root-2" and dup["label"] == "Second A" and dup["relation"] == ""
+    assert [c["label"] for c in dup["children"]] == ["bare leaf"]
+    assert dup["children"][0]["id"] == "root-2-1"
+
+    assert fixes["id_reassigned"] == 3
+    assert fixes["label_filled"] == 1
+    assert fixes["dropped_invalid"] == 2
+    assert fixes["leaf_from_string"] == 1
+
+
+def test_enforces_limits_and_trims_labels():
+    tree = {"id": "r", "label": "x" * 50, "children": [
+        {"id": f"c{i}", "label": f"C{i}", "relation": "r", "children": [
+            {"id": f"c{i}g", "label": "Grandchild", "relation": "r", "children": [
+                {"id": f"c{i}gg", "label": "Too deep", "relation": "r", "children": []},
+            ]},
+        ]}
+        for i in range(5)
+    ]}
+    out, fixes = normalise_tree(tree, max_depth=2, max_children=3, max_nodes=6, max_label_chars=10)
+
+    assert out["label"] == "xxxxxxxxx…"
+    assert [c["id"] for c in out["children"]] == ["c0", "c1", "c2"]
+    # breadth first: the node limit cuts the deepest level
+    assert [len(c["children"]) for c in out["children"]] == [1, 1, 0]
+    assert all(not g["children"] for c in out["children"] for g in c["children"])
+    assert fixes["dropped_fan_out"] == 2
+    assert fixes["dropped_node_limit"] == 1
+
+
+@pytest.mark.parametrize("bad", [None, [], "text", {"id": "root"}, {"id": "root", "label": "   "}])
+def test_unusable_root(bad):
+    with pytest.raises(TreeUnusable):
+        normalise_tree(bad)
+
+
+def test_large_and_deep_trees_without_recursion():
+    # a 20k-deep chain would overflow a recursive walker
+    chain = {"id": "n0", "label": "n0", "children": []}
+    node = chain
+    for i in range(1, 20000):
+        child = {"id": f"n{i}", "label": f"n{i}", "relation": "r", "children": []}
+        node["children"].append(child)
+        node = child
+    out, _ = normalise_tree(chain, max_depth=30000, max_nodes=30000)
+    assert out["children"][0]["id"] == "n1"
+
+    wide = {"id": "r", "label": "r", "children": [
+        {"id": f"c{i}", "label": "c", "relation": "r", "children": [
+            {"id": f"c{i}-{j}", "label": "g", "relation": "r", "children": []} for j in range(100)
+        ]}
+        for i in range(100)
+    ]}
+    start = time.perf_counter()
+    out, fixes = normalise_tree(wide, max_children=100, max_nodes=20000)
+    assert time.perf_counter() - start < 1.0
+    assert sum(len(c["children"]) for c in out["children"]) == 10000
+    assert not fixes
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import mock_llm  # noqa: E402
+import resilience  # noqa: E402
+from json_extract import find_json  # noqa: E402
+from mock_llm import MockChatModel, MockLLMError  # noqa: E402
+from prompts import mindmap_explain_request, mindmap_generate_request  # noqa: E402
+
+
+def instant(**overrides):
+    settings = dict(latency_ms=0, latency_sigma=0, tokens_per_second=0, error_rate=0, rate_limit_rate=0, seed=1)
+    settings.update(overrides)
+    return MockChatModel("mock-test", **settings)
+
+
+def user(content):
+    return [{"role": "system", "content": "prefix"}, {"role": "user", "content": content}]
+
+
+def test_mindmap_reply_is_a_tree_about_the_topic():
+    llm = instant(nodes=9)
+    resp = asyncio.run(llm.ainvoke(user(mindmap_generate_request("Plate tectonics"))))
+
+    tree = json.loads(find_json(resp.content)[1])
+    assert tree["label"] == "Plate tectonics"
+    assert len(tree["children"]) == 4
+    assert sum(len(c["children"]) for c in tree["children"]) == 4
+    assert resp.usage_metadata["output_tokens"] > 0
+
+
+def test_explain_reply_talks_about_the_branches():
+    tree = {"id": "root", "label": "Cells", "children": [{"id": "a", "label": "Nucleus", "children": []}]}
+    resp = instant().invoke(user(mindmap_explain_request(tree, "What is it?")))
+
+    assert "Cells" in resp.content and "Nucleus" in resp.content
+    assert "What is it?" in resp.content
+
+
+def test_canned_replies_and_max_tokens():
+    llm = instant(replies={"default": "About {topic}. " + "x" * 100}, max_tokens=5)
+    resp = llm.invoke(user("Summarise\n\nphotosynthesis"))
+
+    assert resp.content == "About photosynthesis"
+    assert resp.usage_metadata["output_tokens"] == 5
+
+
+def test_stream_sends_the_reply_in_chunks():
+    llm = instant()
+    messages = user(mindmap_generate_request("Volcanoes"))
+
+    async def collect():
+        return [chunk async for chunk in llm.astream(messages)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 2
+    tree = json.loads(find_json("".join(c.content for c in chunks))[1])
+    assert tree["label"] == "Volcanoes"
+    assert chunks[-1].usage_metadata["total_tokens"] > 0
+
+
+def test_injected_errors_are_retryable(monkeypatch):
+    monkeypatch.setattr(mock_llm, "MOCK_LLM_RETRY_AFTER_SECONDS", "2")
+
+    try:
+        instant(rate_limit_rate=1).invoke(user("hi"))
+    except MockLLMError as e:
+        assert resilience.classify(e) == ("429", 2.0)
+    else:
+        raise AssertionError("no 429 injected")
+
+    try:
+        instant(error_rate=1).invoke(user("hi"))
+    except MockLLMError as e:
+        assert resilience.classify(e) == ("500", None)
+    else:
+        raise AssertionError("no 500 injected")
+
+
+def test_openai_compatible_server():
+    client = TestClient(mock_llm.create_app(instant()))
+
+    r = client.post("/v1/chat/completions", json={"model": "m", "messages": user("Say\n\nhello"), "max_tokens": 3})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["choices"][0]["message"]["content"] == "Mock reply a"
+    assert body["usage"]["completion_tokens"] == 3
+
+    r = client.post("/v1/chat/completions", json={"model": "m", "messages": user("Say\n\nhello"), "stream": True})
+    events = [line[len("data: "):] for line in r.text.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    text = "".join(json.loads(e)["choices"][0]["delta"].get("content", "") for e in events[:-1])
+    assert text.startswith("Mock reply about hello:")
+
+    limited = TestClient(mock_llm.create_app(instant(rate_limit_rate=1)))
+    r = limited.post("/v1/chat/completions", json={"model": "m", "messages": user("hi")})
+    assert r.status_code == 429
+    assert r.headers["Retry-After"] == "1"
+    assert r.json()["error"]["type"] == "rate_limit_exceeded"
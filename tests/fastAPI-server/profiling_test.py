@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from profiling import PROFILE_NAME, ProfileMiddleware, ProfileStore, SamplingProfiler  # noqa: E402
+
+
+def busy_loop_for_profile(seconds):
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += 1
+    return n
+
+
+def make_client(store):
+    app = FastAPI()
+
+    @app.get("/work")
+    def work():
+        busy_loop_for_profile(0.05)
+        return {"ok": True}
+
+    app.add_middleware(ProfileMiddleware, store=store, interval=0.001)
+    return TestClient(app)
+
+
+def test_sampler_sees_the_hot_function():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_loop_for_profile(0.05)
+    profiler.stop()
+
+    folded = profiler.folded()
+    lines = folded.splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert "busy_loop_for_profile (profiling_test.py:" in folded
+    assert "sampling-profiler" not in folded
+
+
+def test_profile_requires_token(tmp_path):
+    client = make_client(ProfileStore("secret", str(tmp_path)))
+
+    assert "x-profile" not in client.get("/work", headers={"X-Profile": "1"}).headers
+    wrong = client.get("/work", headers={"X-Profile": "1", "X-Profile-Token": "guess"})
+    assert "x-profile" not in wrong.headers
+    assert os.listdir(tmp_path) == []
+
+
+def test_disabled_without_token(tmp_path):
+    client = make_client(ProfileStore(None, str(tmp_path)))
+
+    r = client.get("/work", headers={"X-Profile": "1", "X-Profile-Token": ""})
+    assert r.status_code == 200 and "x-profile" not in r.headers
+
+
+def test_profiled_request_is_stored(tmp_path):
+    store = ProfileStore("secret", str(tmp_path))
+    client = make_client(store)
+
+    r = client.get("/work", headers={"X-Profile": "1", "X-Profile-Token": "secret"})
+
+    assert r.status_code == 200
+    name = r.headers["x-profile"]
+    assert PROFILE_NAME.match(name)
+    assert "busy_loop_for_profile" in store.load(name)
+
+
+def test_profile_saved_off_the_event_loop(tmp_path):
+    store = ProfileStore("secret", str(tmp_path))
+    threads = {}
+    save = store.save
+
+    def recording_save(name, folded):
+        threads["save"] = threading.get_ident()
+        save(name, folded)
+
+    store.save = recording_save
+    app = FastAPI()
+
+    @app.get("/loop")
+    async def loop():
+        threads["loop"] = threading.get_ident()
+        return {"ok": True}
+
+    app.add_middleware(ProfileMiddleware, store=store, interval=0.001)
+    r = TestClient(app).get("/loop", headers={"X-Profile": "1", "X-Profile-Token": "secret"})
+
+    assert store.load(r.headers["x-profile"]) is not None
+    assert threads["save"] != threads["loop"]
+
+
+def test_store_keeps_newest_and_rejects_odd_names(tmp_path):
+    store = ProfileStore("secret", str(tmp_path), max_files=2)
+    names = [f"20260101-00000{i}-0000000{i}.folded" for i in range(3)]
+    for name in names:
+        store.save(name, "a;b 1\n")
+
+    assert sorted(os.listdir(tmp_path)) == names[1:]
+    assert store.load(names[0]) is None
+    assert store.load("../../etc/passwd") is None
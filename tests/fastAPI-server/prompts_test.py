@@ -0,0 +1,56 @@
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import prompts  # noqa: E402
+
+
+def test_prefix_is_shared_and_request_goes_last():
+    a = prompts.MINDMAP_GENERATE.messages(prompts.mindmap_generate_request("Topic A"))
+    b = prompts.MINDMAP_GENERATE.messages(prompts.mindmap_generate_request("Topic B"))
+
+    prefix = list(prompts.MINDMAP_GENERATE.prefix)
+    assert a[:-1] == prefix and b[:-1] == prefix
+    assert a[0]["role"] == "system"
+    assert a[-1] == {"role": "user", "content": a[-1]["content"]}
+    assert "Topic A" in a[-1]["content"]
+
+
+def test_explain_request_accepts_object_or_serialised_tree():
+    tree = {"id": "root", "label": "X", "children": []}
+    from_object = prompts.mindmap_explain_request(tree, "Why?")
+    assert '"label": "X"' in from_object
+    assert from_object.endswith("User question:\nWhy?")
+
+    raw = '{"id": "root"}'
+    assert prompts.mindmap_explain_request(raw, None) == "Here is the mindmap JSON:\n\n" + raw
+
+
+def test_cached_tokens_from_provider_usage():
+    assert prompts.cached_tokens({"input_tokens": 10, "input_token_details": {"cache_read": 8}}) == 8
+    assert prompts.cached_tokens({"prompt_tokens": 10, "prompt_tokens_details": {"cached_tokens": 4}}) == 4
+    assert prompts.cached_tokens({"prompt_cache_hit_tokens": 0}) == 0
+    assert prompts.cached_tokens({"input_tokens": 10}) is None
+    assert prompts.cached_tokens(None) is None
+
+
+def test_record_reports_savings_per_template():
+    template = prompts.PromptTemplate("test_template", [{"role": "system", "content": "abc"}])
+    assert prompts.PROMPT_PREFIX_CHARS.value(template="test_template") == 3
+
+    template.record({"input_tokens": 100, "input_token_details": {"cache_read": 80}}, 0.2)
+    template.record({"input_tokens": 100, "input_token_details": {"cache_read": 0}}, 0.9)
+    template.record(None, 0.5)
+
+    assert prompts.PROMPT_REQUESTS.value(template="test_template") == 3
+    assert prompts.PROMPT_INPUT_TOKENS.value(template="test_template") == 200
+    assert prompts.PROMPT_CACHED_TOKENS.value(template="test_template") == 80
+    assert prompts.PROMPT_SECONDS.count(template="test_template", prefix_cache="hit") == 1
+    assert prompts.PROMPT_SECONDS.count(template="test_template", prefix_cache="miss") == 1
+    assert prompts.PROMPT_SECONDS.count(template="test_template", prefix_cache="unknown") == 1
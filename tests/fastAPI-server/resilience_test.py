@@ -0,0 +1,222 @@
+import asyncio
+import os
+import sys
+import types
+
+import pytest
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import resilience  # noqa: E402
+from resilience import CircuitBreaker, Hedger, LLMTarget, ProviderUnavailable  # noqa: E402
+
+
+class StatusError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"status {status}")
+        self.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+
+
+@pytest.fixture(autouse=True)
+def _fresh_state(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "hedger", Hedger("", 0.0))
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(resilience, "LLM_RETRY_ATTEMPTS", 3)
+
+
+def target(model, provider, outcomes, calls=None, delay=0.0):
+    """Target whose calls return / raise the given outcomes in turn."""
+    outcomes = list(outcomes)
+
+    async def call():
+        if calls is not None:
+            calls.append(model)
+        if delay:
+            await asyncio.sleep(delay)
+        outcome = outcomes.pop(0) if len(outcomes) > 1 else outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return LLMTarget(model, provider, call)
+
+
+def test_classify_retryable_errors():
+    assert resilience.classify(StatusError(429, {"retry-after": "3"})) == ("429", 3.0)
+    assert resilience.classify(StatusError(503)) == ("503", None)
+    assert resilience.classify(asyncio.TimeoutError())[0] == "timeout"
+    assert resilience.classify(ConnectionResetError())[0] == "connection"
+
+    busy = type("LLMBusy", (Exception,), {"retry_reason": "busy", "retry_after": 1.0})
+    assert resilience.classify(busy()) == ("busy", 1.0)
+
+
+def test_classify_client_errors_are_not_retryable():
+    assert resilience.classify(StatusError(400)) == (None, None)
+    assert resilience.classify(StatusError(401)) == (None, None)
+    assert resilience.classify(RuntimeError("boom")) == (None, None)
+
+
+def test_retries_then_succeeds():
+    calls = []
+    t = target("groq-a", "groq", [StatusError(503), StatusError(429), "ok"], calls)
+
+    resp, used = asyncio.run(resilience.call_resilient([t]))
+
+    assert resp == "ok" and used is t
+    assert len(calls) == 3
+
+
+def test_non_retryable_error_raised_at_once():
+    calls = []
+    primary = target("groq-a", "groq", [RuntimeError("bad request")], calls)
+    fallback = target("gemini-b", "gemini", ["ok"], calls)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(resilience.call_resilient([primary, fallback]))
+    assert calls == ["groq-a"]
+
+
+def test_falls_back_when_retries_are_exhausted():
+    calls = []
+    primary = target("groq-a", "groq", [StatusError(503)], calls)
+    fallback = target("gemini-b", "gemini", ["from fallback"], calls)
+
+    resp, used = asyncio.run(resilience.call_resilient([primary, fallback]))
+
+    assert resp == "from fallback" and used is fallback
+    assert calls == ["groq-a"] * 3 + ["gemini-b"]
+
+
+def test_long_retry_after_moves_to_fallback_without_waiting(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_RETRY_MAX_AFTER_SECONDS", 5)
+    calls = []
+    primary = target("groq-a", "groq", [StatusError(429, {"Retry-After": "120"})], calls)
+    fallback = target("gemini-b", "gemini", ["ok"], calls)
+
+    resp, _ = asyncio.run(resilience.call_resilient([primary, fallback]))
+
+    assert resp == "ok"
+    assert calls == ["groq-a", "gemini-b"]
+
+
+def test_exhausted_chain_reports_retry_after(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_RETRY_ATTEMPTS", 1)
+    primary = target("groq-a", "groq", [StatusError(429, {"retry-after": "2"})])
+
+    with pytest.raises(ProviderUnavailable) as exc:
+        asyncio.run(resilience.call_resilient([primary]))
+    assert exc.value.retry_after == 2.0
+
+
+def test_busy_provider_is_not_retried_or_tripped():
+    busy = type("LLMBusy", (Exception,), {"retry_reason": "busy", "retry_after": 1.0})
+    calls = []
+    primary = target("groq-a", "groq", [busy("full")], calls)
+
+    with pytest.raises(ProviderUnavailable):
+        asyncio.run(resilience.call_resilient([primary]))
+    assert calls == ["groq-a"]
+    assert resilience.breaker("groq").failures == 0
+
+
+def test_breaker_opens_then_half_opens(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    b = CircuitBreaker("p", failure_threshold=2, reset_seconds=10)
+
+    b.record_failure()
+    assert b.state == "closed"
+    b.record_failure()
+    assert b.state == "open" and not b.allow()
+
+    now[0] += 10
+    assert b.state == "half_open"
+    assert b.allow()          # the trial call
+    assert not b.allow()      # nobody else while it runs
+    b.record_failure()
+    assert b.state == "open"
+
+    now[0] += 10
+    assert b.allow()
+    b.record_success()
+    assert b.state == "closed" and b.allow()
+
+
+def test_open_breaker_skips_provider(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_BREAKER_FAILURES", 2)
+    calls = []
+    primary = target("groq-a", "groq", [StatusError(502)], calls)
+    fallback = target("gemini-b", "gemini", ["ok"], calls)
+
+    asyncio.run(resilience.call_resilient([primary, fallback]))
+    assert calls == ["groq-a", "groq-a", "gemini-b"]
+
+    calls.clear()
+    asyncio.run(resilience.call_resilient([primary, fallback]))
+    assert calls == ["gemini-b"]
+
+
+def test_hedge_wins_and_cancels_slow_primary(monkeypatch):
+    monkeypatch.setattr(resilience, "hedger", Hedger("10", 1.0))
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "slow"
+
+    primary = LLMTarget("groq-a", "groq", slow)
+    fallback = target("gemini-b", "gemini", ["fast"])
+
+    async def run():
+        result = await resilience.call_resilient([primary, fallback])
+        await asyncio.sleep(0)
+        return result
+
+    resp, used = asyncio.run(run())
+
+    assert resp == "fast" and used is fallback
+    assert cancelled == [True]
+    assert resilience.LLM_HEDGE_WINS.value(provider="groq", winner="hedge") >= 1
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    monkeypatch.setattr(resilience, "hedger", Hedger("200", 1.0))
+    calls = []
+    primary = target("groq-a", "groq", ["quick"], calls)
+    fallback = target("gemini-b", "gemini", ["unused"], calls)
+
+    resp, _ = asyncio.run(resilience.call_resilient([primary, fallback]))
+
+    assert resp == "quick"
+    assert calls == ["groq-a"]
+
+
+def test_hedge_budget_caps_hedged_fraction():
+    h = Hedger("10", 0.25, window=8)
+    hedged = 0
+    for _ in range(40):
+        if h.within_budget():
+            hedged += 1
+            h.record_call(True)
+        else:
+            h.record_call(False)
+    assert 0 < hedged <= 40 * 0.25 + 1
+
+
+def test_p95_delay_needs_samples():
+    h = Hedger("p95", 0.1)
+    assert h.delay("groq") is None
+    for ms in range(1, 101):
+        h.observe("groq", ms / 1000)
+    assert h.delay("groq") == pytest.approx(0.096)
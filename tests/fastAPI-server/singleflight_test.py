@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import singleflight  # noqa: E402
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = singleflight.SingleFlight("t-share")
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert len(runs) == 1
+    assert flight.in_flight() == 0
+    assert singleflight.SINGLEFLIGHT_CALLS.value(group="t-share", role="leader") == 1
+    assert singleflight.SINGLEFLIGHT_CALLS.value(group="t-share", role="follower") == 4
+
+
+def test_error_is_shared_and_next_call_runs_again():
+    flight = singleflight.SingleFlight("t-error")
+    runs = []
+
+    async def failing():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("k", failing)
+
+    asyncio.run(run())
+    assert len(runs) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = singleflight.SingleFlight("t-cancel")
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "done"
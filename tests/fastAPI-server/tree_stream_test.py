@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TESTS_DIR, "..", ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "fastAPI-server")
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from mindmap_tree import normalise_tree  # noqa: E402
+from tree_stream import StreamParseError, TreeStreamParser  # noqa: E402
+
+
+TREE = {
+    "id": "root",
+    "label": "Networks",
+    "children": [
+        {"id": "n1", "label": "Layers \"OSI\"", "relation": "organizes", "children": [
+            {"id": "n1a", "label": "Transport", "relation": "ensures", "children": []},
+        ]},
+        {"id": "n2", "label": "Links", "relation": "connect", "weight": 1.5, "children": []},
+    ],
+}
+
+
+def _feed_in_pieces(text, size):
+    parser = TreeStreamParser()
+    nodes = []
+    for i in range(0, len(text), size):
+        nodes.extend(parser.feed(text[i:i + size]))
+    return parser, nodes
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_nodes_emitted_parent_first(size):
+    text = "Sure! ```json\n" + json.dumps(TREE, indent=2) + "\n```"
+    parser, nodes = _feed_in_pieces(text, size)
+
+    assert parser.done
+    assert parser.result() == TREE
+    assert nodes == [
+        {"id": "root", "label": "Networks", "relation": None, "parent_id": None},
+        {"id": "n1", "label": "Layers \"OSI\"", "relation": "organizes", "parent_id": "root"},
+        {"id": "n1a", "label": "Transport", "relation": "ensures", "parent_id": "n1"},
+        {"id": "n2", "label": "Links", "relation": "connect", "parent_id": "root"},
+    ]
+
+
+def test_node_reported_before_it_closes():
+    parser = TreeStreamParser()
+    nodes = parser.feed('{"id": "root", "label": "R", "children": [{"id": "a", "label": "A", "children": [')
+    assert [n["id"] for n in nodes] == ["root", "a"]
+    assert not parser.done
+
+
+def test_fields_after_children_reported_on_close():
+    parser = TreeStreamParser()
+    nodes = parser.feed('{"children": [], "label": "R", "id": "root"}')
+    assert nodes == [{"id": "root", "label": "R", "relation": None, "parent_id": None}]
+
+
+def test_duplicate_and_missing_ids_replaced_like_normalise_tree():
+    text = json.dumps({"id": "a", "label": "R", "children": [
+        {"id": "a", "label": "X", "children": [{"label": "Y", "children": []}]},
+        {"id": " b ", "label": "Z", "children": []},
+        {"id": "b", "label": "W", "children": []},
+    ]})
+    parser, nodes = _feed_in_pieces(text, 4)
+
+    assert [(n["id"], n["parent_id"]) for n in nodes] == [
+        ("a", None), ("a-1", "a"), ("a-1-1", "a-1"), ("b", "a"), ("a-3", "a"),
+    ]
+    normalised, fixes = normalise_tree(parser.result())
+    assert "id_reassigned" not in fixes
+    assert normalised["children"][0]["children"][0]["id"] == "a-1-1"
+
+
+def test_nodes_past_the_limits_are_not_reported():
+    parser = TreeStreamParser(max_children=2, max_nodes=3)
+    nodes = parser.feed(json.dumps({"id": "r", "label": "R", "children": [
+        {"id": "a", "label": "A", "relation": " is\n part ", "children": [{"id": "a1", "label": "A1"}]},
+        {"id": "b", "label": "B"},
+        {"id": "c", "label": "C"},
+    ]}))
+
+    assert [(n["id"], n["relation"]) for n in nodes] == [("r", None), ("a", "is part"), ("a1", "")]
+
+
+def test_unicode_escape_split_across_chunks():
+    parser, nodes = _feed_in_pieces('{"id": "r", "label": "caf\\u00e9", "children": []}', 2)
+    assert nodes[0]["label"] == "café"
+
+
+def test_invalid_json_raises():
+    parser = TreeStreamParser()
+    with pytest.raises(StreamParseError):
+        parser.feed('{"id": "root" "label": "R"}')